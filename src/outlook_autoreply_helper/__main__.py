@@ -1,10 +1,19 @@
 import argparse
+import contextlib
 import logging
+from pathlib import Path
 
 from pydantic import BaseModel, Field
 
-from .command import init, run
-from .settings import AbstractSettings, InitSettings, RunSettings
+from .instrumentation import export
+from .settings import (
+    AbstractSettings,
+    InitSettings,
+    RunSettings,
+    ServeSettings,
+    SimulateSettings,
+)
+from .tz import WINDOWS_ZONES_FILE, update_windows_zones
 
 log = logging.getLogger(__name__)
 
@@ -50,15 +59,75 @@ def main():
     parser = argparse.ArgumentParser(
         description="Outlook absence helper for automatic auto-reply management"
     )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        type=Path,
+        metavar="CASSETTE",
+        help="Record all HTTP exchanges of the command to a cassette file, with secrets redacted",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        type=Path,
+        metavar="CASSETTE",
+        help="Serve all HTTP requests of the command from a cassette file instead of sending them",
+    )
     subparsers = parser.add_subparsers(dest="command", help="Command to execute")
 
     # Add 'init' command.
     init_parser = subparsers.add_parser("init", help="Initialize the application")
-    init_parser.set_defaults(func=init, settings_cls=InitSettings)
+    init_parser.set_defaults(
+        func="init", fleet_func="init_fleet", settings_cls=InitSettings
+    )
 
     # Add 'run' command.
     run_parser = subparsers.add_parser("run", help="Run the application")
-    run_parser.set_defaults(func=run, settings_cls=RunSettings)
+    run_parser.set_defaults(
+        func="run", fleet_func="run_fleet", settings_cls=RunSettings
+    )
+
+    # Add 'plan' command.
+    plan_parser = subparsers.add_parser(
+        "plan",
+        help="Print the intended changes to the automatic replies as JSON, without applying them",
+    )
+    plan_parser.set_defaults(func="plan", fleet_func="plan", settings_cls=RunSettings)
+
+    # Add 'simulate' command.
+    simulate_parser = subparsers.add_parser(
+        "simulate",
+        help="Simulate runs over a range of dates and print the changes they would have made as JSON",
+    )
+    simulate_parser.set_defaults(
+        func="simulate", fleet_func="simulate", settings_cls=SimulateSettings
+    )
+
+    # Add 'serve' command.
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run the application continuously at a regular interval"
+    )
+    serve_parser.set_defaults(
+        func="serve", fleet_func="serve", settings_cls=ServeSettings
+    )
+
+    # Add 'update-tz-index' maintenance command.
+    tz_index_parser = subparsers.add_parser(
+        "update-tz-index",
+        help="Regenerate the Windows to IANA time zone index from a local CLDR windowsZones.xml file",
+    )
+    tz_index_parser.add_argument(
+        "cldr_file", type=Path, help="Path to CLDR windowsZones.xml"
+    )
+    tz_index_parser.add_argument(
+        "--output",
+        type=Path,
+        default=WINDOWS_ZONES_FILE,
+        help="Path of the index to write (default: the index shipped with the package)",
+    )
+    tz_index_parser.set_defaults(
+        func=lambda args: update_windows_zones(args.cldr_file, args.output),
+        settings_cls=None,
+    )
 
     # Parse arguments.
     args = parser.parse_args()
@@ -66,18 +135,43 @@ def main():
     # Default to 'run' if no command provided.
     if args.command is None:
         args.command = "run"
-        args.func = run
+        args.func = "run"
+        args.fleet_func = "run_fleet"
         args.settings_cls = RunSettings
 
     log.debug(f"Arguments: {args}")
 
-    # Load settings for command.
-    settings = args.settings_cls()
-
-    log.debug(f"Settings: {settings.model_dump_json(indent=2)}")
-
-    # Execute the selected command.
-    args.func(settings)
+    # Maintenance commands do not need any settings.
+    if args.settings_cls is None:
+        args.func(args)
+        return
+
+    # Record or replay all HTTP exchanges of the command, including those to load settings, if requested.
+    with contextlib.ExitStack() as stack:
+        if args.record or args.replay:
+            from .cassette import recording, replaying
+
+            stack.enter_context(
+                recording(args.record) if args.record else replaying(args.replay)
+            )
+
+        # Load settings for command.
+        settings = args.settings_cls()
+
+        log.debug(f"Settings: {settings.model_dump_json(indent=2)}")
+
+        # Import commands only now, since they pull in heavy dependencies.
+        from . import command
+
+        # Execute the selected command, for all configured mailboxes if any. Export instrumentation data even if the
+        # command fails, since timings are most interesting then.
+        try:
+            if settings.fleet.mailboxes:
+                getattr(command, args.fleet_func)(settings)
+            else:
+                getattr(command, args.func)(settings)
+        finally:
+            export(settings.instrumentation)
 
 
 if __name__ == "__main__":
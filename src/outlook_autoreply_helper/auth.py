@@ -1,50 +1,189 @@
+from __future__ import annotations
+
 import logging
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlparse
+from zoneinfo import ZoneInfo
 
 import msal
+import requests
 
-from .settings import AppRegistrationSettings
+from .instrumentation import span, timed
+from .settings import (
+    AbstractCacheSettings,
+    AppRegistrationSettings,
+    AuthorityCache,
+    DiscoveryResponse,
+)
 
 log = logging.getLogger(__name__)
 
+UTC = ZoneInfo("UTC")
 
-def get_access_token(
-    settings: AppRegistrationSettings, token_cache: msal.TokenCache
-) -> str:
+# Seconds after which a failed token refresh is retried.
+_REFRESH_RETRY_SECONDS = 60
+
+# Paths of the authority and instance discovery endpoints of the identity platform.
+_DISCOVERY_PATHS = ("/.well-known/openid-configuration", "/discovery/instance")
+
+
+class _AuthorityCachingHttpClient:
     """
-    Acquire an access token for Microsoft Graph API using MSAL.
+    HTTP client for MSAL that answers authority and instance discovery requests from a persisted cache.
+
+    The metadata of the authority rarely changes. Successful responses of the discovery endpoints are kept until their
+    time to live has passed, and stored in the cache as soon as they are received, so that other applications, also in
+    later runs, do not query them again. All other requests are passed through.
+    """
+
+    def __init__(
+        self,
+        http_client: requests.Session,
+        cache_settings: AbstractCacheSettings,
+        ttl: timedelta,
+    ):
+        self.http_client = http_client
+        self._cache_settings = cache_settings
+        self._ttl = ttl
+        self._authority_cache: AuthorityCache | None = None
+        self._lock = threading.Lock()
+
+    def _get_authority_cache(self) -> AuthorityCache:
+        """Return the authority cache, loading it on first use."""
+        with self._lock:
+            if self._authority_cache is None:
+                self._authority_cache = (
+                    self._cache_settings.get_authority_cache() or AuthorityCache()
+                )
+            return self._authority_cache
+
+    def get(self, url: str, params: dict | None = None, **kwargs) -> requests.Response:
+        if not urlparse(url).path.endswith(_DISCOVERY_PATHS):
+            return self.http_client.get(url, params=params, **kwargs)
+
+        key = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+        authority_cache = self._get_authority_cache()
+        now = datetime.now(UTC)
+
+        entry = authority_cache.responses.get(key)
+        if entry is not None and entry.expires > now:
+            log.debug(f"Using cached authority metadata from {url}.")
+            response = requests.Response()
+            response.status_code = 200
+            response.url = url
+            response.headers["Content-Type"] = "application/json"
+            response._content = entry.content.encode("utf-8")
+            return response
+
+        response = self.http_client.get(url, params=params, **kwargs)
+
+        if 200 <= response.status_code < 300:
+            with self._lock:
+                # Drop expired responses, e.g. of authorities that are no longer used.
+                authority_cache.responses = {
+                    k: v
+                    for k, v in authority_cache.responses.items()
+                    if v.expires > now
+                }
+                authority_cache.responses[key] = DiscoveryResponse(
+                    content=response.text, expires=now + self._ttl
+                )
+                value = authority_cache.model_copy(deep=True)
+
+            log.info(f"Saving authority metadata from {url}.")
+            self._cache_settings.put_authority_cache(value)
+
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.http_client.post(url, **kwargs)
+
+    def close(self) -> None:
+        self.http_client.close()
 
-    This function attempts to retrieve an access token using the following strategies:
-    1. First, try to get a token silently from the token cache.
-    2. If no cached token is available, use either device code or interactive authentication flow, and initialize the
-       cache.
+
+def get_msal_app(
+    settings: AppRegistrationSettings,
+    token_cache: msal.TokenCache,
+    http_client: requests.Session | None = None,
+    cache_settings: AbstractCacheSettings | None = None,
+) -> msal.PublicClientApplication:
+    """
+    Create an MSAL public client application with the given token cache.
+
+    The application can be shared between several token acquisitions, e.g. for multiple accounts. If cache settings are
+    given, the authority metadata is read from and stored in the authority cache, instead of being discovered from the
+    identity provider each time an application is created. Without an HTTP session, a session of its own is created for
+    the application and closed along with it.
 
     Args:
         settings (AppRegistrationSettings): Application registration settings
         token_cache: A persistent token cache for storing and retrieving tokens
+        http_client (requests.Session | None): Optional HTTP session to use for requests to the identity provider
+        cache_settings (AbstractCacheSettings | None): Optional cache settings for the authority cache
 
     Returns:
-        str: A valid access token for Microsoft Graph API
-
-    Raises:
-        RuntimeError: If token acquisition fails
+        msal.PublicClientApplication: The MSAL application
     """
-    # Create MSAL public client application with persistent token cache.
+    session = None
+    if cache_settings is not None and settings.authority_cache_ttl_seconds > 0:
+        if http_client is None:
+            http_client = session = requests.Session()
+        http_client = _AuthorityCachingHttpClient(
+            http_client,
+            cache_settings,
+            timedelta(seconds=settings.authority_cache_ttl_seconds),
+        )
+
     msal_app = msal.PublicClientApplication(
         settings.client_id,
         authority=f"https://login.microsoftonline.com/{settings.tenant_id}",
         token_cache=token_cache,
+        http_client=http_client,
     )
 
+    if session is not None:
+        weakref.finalize(msal_app, session.close)
+
+    return msal_app
+
+
+def _acquire_token(
+    settings: AppRegistrationSettings,
+    token_cache: msal.TokenCache,
+    msal_app: msal.PublicClientApplication | None = None,
+    username: str | None = None,
+    interactive: bool = True,
+    force_refresh: bool = False,
+) -> dict:
+    """
+    Acquire an access token for Microsoft Graph API using MSAL, and return the MSAL result. See get_access_token.
+    """
+    # Create MSAL public client application with persistent token cache, unless one is given.
+    if msal_app is None:
+        msal_app = get_msal_app(settings, token_cache)
+
     # Attempt to retrieve tokens from cache.
-    accounts = msal_app.get_accounts()
+    accounts = msal_app.get_accounts(username=username)
     result = None
     if accounts:
-        log.info(f"Found {len(accounts)} account(s) in cache.")
-        # Try to acquire token silently for the first cached account.
-        result = msal_app.acquire_token_silent(settings.scopes, account=accounts[0])
+        log.info(f"Found {len(accounts)} matching account(s) in cache.")
+        # Try to acquire token silently for the first matching cached account.
+        result = msal_app.acquire_token_silent(
+            settings.scopes, account=accounts[0], force_refresh=force_refresh
+        )
 
     # If no suitable token found in cache, proceed with authentication.
     if not result:
+        if not interactive:
+            raise RuntimeError(
+                f"No suitable token in cache for account {username}. Run 'init' first."
+            )
+
         log.info("No suitable token in cache. Initiating authentication.")
 
         # Choose authentication flow based on settings.
@@ -69,11 +208,12 @@ def get_access_token(
             result = msal_app.acquire_token_interactive(
                 scopes=settings.scopes,
                 prompt="select_account",  # Force account selection.
+                login_hint=username,
             )
 
-    # Validate and return token.
+    # Validate and return result.
     if "access_token" in result:
-        return result["access_token"]
+        return result
     else:
         log.error("Token acquisition failed.")
         if "error" in result:
@@ -82,3 +222,197 @@ def get_access_token(
                 log.error(f"Error description: {result['error_description']}")
 
         raise RuntimeError("Failed to acquire authentication token.")
+
+
+@timed("auth.get_access_token")
+def get_access_token(
+    settings: AppRegistrationSettings,
+    token_cache: msal.TokenCache,
+    msal_app: msal.PublicClientApplication | None = None,
+    username: str | None = None,
+    interactive: bool = True,
+) -> str:
+    """
+    Acquire an access token for Microsoft Graph API using MSAL.
+
+    This function attempts to retrieve an access token using the following strategies:
+    1. First, try to get a token silently from the token cache.
+    2. If no cached token is available, use either device code or interactive authentication flow, and initialize the
+       cache.
+
+    Args:
+        settings (AppRegistrationSettings): Application registration settings
+        token_cache: A persistent token cache for storing and retrieving tokens
+        msal_app (msal.PublicClientApplication | None): Optional MSAL application to reuse
+        username (str | None): Account to acquire the token for. Defaults to the first cached account.
+        interactive (bool): Whether to fall back to an authentication flow if no cached token is available
+
+    Returns:
+        str: A valid access token for Microsoft Graph API
+
+    Raises:
+        RuntimeError: If token acquisition fails
+    """
+    return _acquire_token(settings, token_cache, msal_app, username, interactive)[
+        "access_token"
+    ]
+
+
+@dataclass
+class _ManagedToken:
+    """
+    Access token of an account held by a token manager, with monotonic times of its expiry and planned refresh.
+    """
+
+    authorization: str
+    expires: float
+    refresh_at: float
+
+
+class TokenManager:
+    """
+    Hands out access tokens for several accounts, and refreshes them on a background thread ahead of their expiry.
+
+    The first token of an account is acquired when it is first asked for. From then on, it is refreshed the configured
+    margin before it expires, but not before half of its remaining lifetime has passed, so that runs do not wait for
+    the identity provider. If a refresh fails, it is retried
+    after a minute until the token has expired, after which the next request acquires a token itself. The token cache
+    is stored after each acquisition, but only if its content changed.
+
+    A manager is safe to share between threads. Use it as a context manager to run the background thread.
+    """
+
+    def __init__(
+        self,
+        settings: AppRegistrationSettings,
+        cache_settings: AbstractCacheSettings,
+        token_cache: msal.TokenCache,
+        msal_app: msal.PublicClientApplication,
+        refresh_margin: timedelta,
+    ):
+        """
+        Args:
+            settings (AppRegistrationSettings): Application registration settings
+            cache_settings (AbstractCacheSettings): Cache settings to store the token cache with
+            token_cache: Token cache shared with the MSAL application
+            msal_app (msal.PublicClientApplication): MSAL application to acquire tokens with
+            refresh_margin (timedelta): Time before the expiry of a token at which it is refreshed
+        """
+        self.settings = settings
+        self.cache_settings = cache_settings
+        self.token_cache = token_cache
+        self.msal_app = msal_app
+        self.refresh_margin = refresh_margin.total_seconds()
+
+        self._tokens: dict[str | None, _ManagedToken] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self) -> TokenManager:
+        self._thread = threading.Thread(
+            target=self._refresh_tokens, name="token-refresh", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+
+    def get_authorization(self, username: str | None = None) -> str:
+        """
+        Return the Authorization header for requests on behalf of an account.
+
+        Args:
+            username (str | None): Account to authorize. Defaults to the first cached account.
+
+        Returns:
+            str: Authorization header with the current access token of the account
+
+        Raises:
+            RuntimeError: If no token is held and none can be acquired without user interaction
+        """
+        with self._lock:
+            token = self._tokens.get(username)
+
+        if token is None or token.expires <= time.monotonic():
+            token = self._acquire(username)
+
+        return token.authorization
+
+    def save(self) -> None:
+        """Store the token cache, if its content changed since it was last stored."""
+        with self._save_lock:
+            if not getattr(self.token_cache, "has_state_changed", True):
+                log.debug("Token cache did not change. Not saving.")
+                return
+
+            # Serializing the token cache resets its state.
+            log.info("Saving token cache.")
+            self.cache_settings.put_token_cache(self.token_cache)
+
+    def _acquire(
+        self, username: str | None, force_refresh: bool = False
+    ) -> _ManagedToken:
+        """Acquire a token for an account without user interaction, and schedule its refresh."""
+        result = _acquire_token(
+            self.settings,
+            self.token_cache,
+            self.msal_app,
+            username,
+            interactive=False,
+            force_refresh=force_refresh,
+        )
+
+        now = time.monotonic()
+        expires_in = float(result.get("expires_in", 0))
+        token = _ManagedToken(
+            authorization=f"Bearer {result['access_token']}",
+            expires=now + expires_in,
+            refresh_at=now + max(expires_in - self.refresh_margin, expires_in / 2),
+        )
+
+        with self._lock:
+            self._tokens[username] = token
+        self._wakeup.set()
+
+        self.save()
+
+        return token
+
+    def _refresh_tokens(self) -> None:
+        """Refresh each held token when it is due, until stopped."""
+        while not self._stopped.is_set():
+            with self._lock:
+                due = min(
+                    self._tokens.items(),
+                    key=lambda item: item[1].refresh_at,
+                    default=None,
+                )
+
+            timeout = None if due is None else due[1].refresh_at - time.monotonic()
+
+            # Start over whenever a token was acquired in the meantime, or when stopped.
+            if (timeout is None or timeout > 0) and self._wakeup.wait(timeout):
+                self._wakeup.clear()
+                continue
+
+            username, token = due
+            try:
+                with span("auth.refresh_token", mailbox=username):
+                    self._acquire(username, force_refresh=True)
+                log.info(f"Refreshed access token for {username or 'default account'}.")
+            except Exception as e:
+                log.warning(
+                    f"Failed to refresh access token for {username or 'default account'}: {e}"
+                )
+                with self._lock:
+                    if time.monotonic() + _REFRESH_RETRY_SECONDS < token.expires:
+                        token.refresh_at = time.monotonic() + _REFRESH_RETRY_SECONDS
+                    elif self._tokens.get(username) is token:
+                        # Leave it to the next request to acquire a token.
+                        del self._tokens[username]
@@ -0,0 +1,561 @@
+import base64
+import gzip
+import hashlib
+import http
+import io
+import json
+import logging
+import re
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+log = logging.getLogger(__name__)
+
+# Version of the cassette file format.
+CASSETTE_VERSION = 1
+
+# Prefix of placeholders for redacted secrets.
+REDACTED_PREFIX = "redacted-"
+
+# Keys of JSON properties that hold secrets, in token responses and token caches.
+SECRET_KEYS = frozenset(
+    {
+        "access_token",
+        "refresh_token",
+        "id_token",
+        "device_code",
+        "client_secret",
+        "secret",
+    }
+)
+
+# Fields of form-encoded token requests that hold secrets.
+SECRET_FORM_FIELDS = frozenset(
+    {
+        "refresh_token",
+        "code",
+        "device_code",
+        "client_secret",
+        "client_assertion",
+        "password",
+    }
+)
+
+# Request headers stored with each exchange. Other request headers do not affect the responses.
+REQUEST_HEADERS = ("Authorization", "Content-Type")
+
+# Response headers not stored, since the body is stored decoded or they would leak session state.
+DROPPED_RESPONSE_HEADERS = frozenset(
+    {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+)
+
+# Claims of JSON web tokens that are stored as is. They identify neither the user nor the token, but MSAL reads them.
+PUBLIC_CLAIMS = frozenset({"aud", "iss", "iat", "nbf", "exp", "tid", "ver"})
+
+_JWT_PATTERN = re.compile(r"^[\w-]+\.[\w-]+\.[\w-]+$")
+
+# Path of a Key Vault secret holding a part of a bundle too large for a single secret, optionally with its version.
+_PART_SECRET_PATTERN = re.compile(
+    r"/secrets/(?P<bundle>[^/]+)-part-(?P<index>\d+)(/[^/]*)?"
+)
+
+
+def _redact_claims(payload: str) -> str:
+    """
+    Redact all claims of the payload of a JSON web token except the public ones, keeping the payload readable.
+    """
+    padded = payload + "=" * (-len(payload) % 4)
+    claims = json.loads(base64.urlsafe_b64decode(padded))
+    if not isinstance(claims, dict):
+        raise ValueError("Payload is not a JSON object.")
+
+    redacted = {
+        name: value
+        if name in PUBLIC_CLAIMS
+        else _redact_secret(value if isinstance(value, str) else json.dumps(value))
+        for name, value in claims.items()
+    }
+    return (
+        base64.urlsafe_b64encode(json.dumps(redacted, separators=(",", ":")).encode())
+        .rstrip(b"=")
+        .decode("ascii")
+    )
+
+
+def _redact_secret(value: str) -> str:
+    """
+    Replace a secret by a placeholder derived from its hash.
+
+    Of a JSON web token, the signature and all claims that may identify the user, e.g. names and object IDs, are
+    replaced, but the token remains readable, since MSAL reads the claims of ID tokens. Redacting a redacted secret
+    again leaves it unchanged.
+    """
+    if value.startswith(REDACTED_PREFIX):
+        return value
+
+    if _JWT_PATTERN.match(value):
+        header, payload, signature = value.split(".")
+        try:
+            return f"{header}.{_redact_claims(payload)}.{_redact_secret(signature)}"
+        except ValueError:
+            # Not a JSON web token after all.
+            pass
+
+    return REDACTED_PREFIX + hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def _find_secrets(value, secrets: set[str]) -> set[str]:
+    """
+    Collect all secrets in a JSON value, including those within strings that hold JSON themselves.
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in SECRET_KEYS and isinstance(item, str):
+                secrets.add(item)
+            else:
+                _find_secrets(item, secrets)
+    elif isinstance(value, list):
+        for item in value:
+            _find_secrets(item, secrets)
+    elif isinstance(value, str) and value[:1] in ("{", "["):
+        try:
+            _find_secrets(json.loads(value), secrets)
+        except ValueError:
+            pass
+    return secrets
+
+
+def _redact_text(text: str, secrets: set[str]) -> str:
+    """Replace the given secrets within a text, longest first."""
+    for secret in sorted(secrets, key=len, reverse=True):
+        text = text.replace(secret, _redact_secret(secret))
+    return text
+
+
+def _redact_json(value):
+    """
+    Redact all secrets in a JSON value, including those within strings that hold JSON themselves, e.g. a token cache
+    stored as a Key Vault secret.
+
+    Secrets are replaced within the text, so that such strings keep their formatting. Otherwise, the token cache would
+    seem changed after replaying, and be written back.
+    """
+    return json.loads(_redact_text(json.dumps(value), _find_secrets(value, set())))
+
+
+def _get_part_secret(url: str) -> tuple[str, int] | None:
+    """Return the bundle name and part index of a Key Vault secret holding a part of a bundle, or None."""
+    match = _PART_SECRET_PATTERN.fullmatch(urlsplit(url).path)
+    if match is None:
+        return None
+    return match["bundle"], int(match["index"])
+
+
+def _redact_header(name: str, value: str) -> str:
+    """Redact the credentials of an authorization header."""
+    if name.lower() == "authorization" and " " in value:
+        scheme, credentials = value.split(" ", 1)
+        return f"{scheme} {_redact_secret(credentials)}"
+    return value
+
+
+def _encode_body(body: bytes | str | None, content_type: str) -> dict:
+    """
+    Encode a request or response body for the cassette, with all secrets redacted.
+
+    JSON and form bodies are stored as such, other text as is and binary content in base64.
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not body:
+        return {}
+
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+    if "json" in content_type:
+        try:
+            return {"json": _redact_json(json.loads(text))}
+        except ValueError:
+            pass
+
+    if "x-www-form-urlencoded" in content_type:
+        return {
+            "form": [
+                [key, _redact_secret(value) if key in SECRET_FORM_FIELDS else value]
+                for key, value in parse_qsl(text, keep_blank_values=True)
+            ]
+        }
+
+    return {"text": text}
+
+
+def _decode_body(body: dict) -> bytes:
+    """Decode a request or response body from the cassette."""
+    if "json" in body:
+        return json.dumps(body["json"]).encode("utf-8")
+    if "form" in body:
+        return urlencode(body["form"]).encode("utf-8")
+    if "text" in body:
+        return body["text"].encode("utf-8")
+    if "base64" in body:
+        return base64.b64decode(body["base64"])
+    return b""
+
+
+class Cassette:
+    """
+    Recorded HTTP exchanges of a command, in the order they were sent.
+
+    Secrets, i.e. tokens, codes, client credentials and the secrets within token caches, are replaced by a placeholder
+    derived from a hash of the secret before they are stored. A secret thus has the same placeholder wherever it
+    appears, so that a token received in a replayed response matches the token sent in the recorded requests that
+    follow, even across cassettes.
+
+    A bundle of state too large for a single Key Vault secret is split into parts at arbitrary positions, so a part
+    neither parses as JSON nor necessarily holds a secret as a whole. The values of part secrets are therefore replaced
+    by a placeholder when recorded. Once all parts of a bundle were recorded, the bundle is reassembled and redacted as
+    a whole, and its redacted content is split into the recorded parts again, so that replaying still reassembles it.
+
+    Replayed requests are matched by method, URL path and authorization. Among the matching exchanges not yet replayed,
+    one with the same URL and body is preferred, otherwise the first one is used. This tolerates requests that depend
+    on the current time, and requests for different mailboxes that are sent concurrently in a different order.
+    """
+
+    def __init__(self, interactions: list[dict] | None = None):
+        self._lock = threading.Lock()
+        self.interactions: list[dict] = interactions if interactions is not None else []
+        self._replayed = [False] * len(self.interactions)
+
+        # Values of the part secrets of each bundle recorded so far, with the bodies that hold them, by bundle name
+        # and by whether they were sent in requests or received in responses.
+        self._parts: dict[tuple[str, str], list[tuple[str, dict]]] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        """
+        Load a cassette from a file, gzip-compressed if its name ends with .gz.
+
+        Args:
+            path (Path): Path of the cassette file
+
+        Returns:
+            Cassette: The loaded cassette
+        """
+        content = path.read_bytes()
+        if path.suffix == ".gz":
+            content = gzip.decompress(content)
+
+        data = json.loads(content)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(
+                f"Unsupported cassette version {data.get('version')} in {path}."
+            )
+
+        log.info(f"Loaded {len(data['interactions'])} HTTP exchange(s) from {path}.")
+
+        return cls(data["interactions"])
+
+    def save(self, path: Path) -> None:
+        """
+        Save the cassette to a file, gzip-compressed if its name ends with .gz.
+
+        Args:
+            path (Path): Path of the cassette file
+        """
+        with self._lock:
+            content = json.dumps(
+                {"version": CASSETTE_VERSION, "interactions": self.interactions},
+                separators=(",", ":"),
+            ).encode("utf-8")
+
+        if path.suffix == ".gz":
+            content = gzip.compress(content)
+
+        log.info(f"Saving {len(self.interactions)} HTTP exchange(s) to {path}.")
+
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_bytes(content)
+        tmp_path.replace(path)
+
+    @staticmethod
+    def _encode_request(method: str, url: str, headers, body) -> dict:
+        return {
+            "method": method,
+            "url": url,
+            "headers": {
+                name: _redact_header(name, headers[name])
+                for name in REQUEST_HEADERS
+                if name in headers
+            },
+            "body": _encode_body(body, headers.get("Content-Type", "")),
+        }
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        headers,
+        body: bytes | str | None,
+        status: int,
+        response_headers,
+        content: bytes,
+    ) -> None:
+        """
+        Add an HTTP exchange to the cassette, with all secrets redacted.
+
+        Args:
+            method (str): Request method
+            url (str): Request URL
+            headers: Request headers
+            body (bytes | str | None): Request body
+            status (int): Response status code
+            response_headers: Response headers
+            content (bytes): Decoded response body
+        """
+        interaction = {
+            "request": self._encode_request(method, url, headers, body),
+            "response": {
+                "status": status,
+                "headers": {
+                    name: value
+                    for name, value in response_headers.items()
+                    if name.lower() not in DROPPED_RESPONSE_HEADERS
+                },
+                "body": _encode_body(content, response_headers.get("Content-Type", "")),
+            },
+        }
+
+        part = _get_part_secret(url)
+
+        with self._lock:
+            if part is not None:
+                for kind in ("request", "response"):
+                    self._redact_part(*part, kind, interaction[kind]["body"])
+
+            self.interactions.append(interaction)
+            self._replayed.append(False)
+
+    def _redact_part(self, bundle: str, index: int, kind: str, body: dict) -> None:
+        """
+        Replace the value of a part secret in a recorded body by a placeholder, and redact the complete bundle once
+        its last part was recorded.
+        """
+        value = body.get("json", {}).get("value")
+        if not isinstance(value, str):
+            return
+
+        body["json"]["value"] = _redact_secret(value)
+
+        # The first part starts the bundle anew, further parts follow in order.
+        parts = self._parts.setdefault((bundle, kind), [])
+        if index == 0:
+            parts.clear()
+        elif index != len(parts):
+            return
+        parts.append((value, body))
+
+        content = "".join(value for value, _ in parts)
+        try:
+            secrets = _find_secrets(json.loads(content), set())
+        except ValueError:
+            # Further parts follow.
+            return
+
+        content = _redact_text(content, secrets)
+        for i, (_, part_body) in enumerate(parts):
+            part_body["json"]["value"] = content[
+                i * len(content) // len(parts) : (i + 1) * len(content) // len(parts)
+            ]
+        parts.clear()
+
+    def play(
+        self, method: str, url: str, headers, body: bytes | str | None
+    ) -> tuple[int, dict, bytes]:
+        """
+        Find the recorded response to a request.
+
+        Args:
+            method (str): Request method
+            url (str): Request URL
+            headers: Request headers
+            body (bytes | str | None): Request body
+
+        Returns:
+            tuple[int, dict, bytes]: Status code, headers and body of the recorded response
+        """
+        path = urlsplit(url)[:3]
+        authorization = (
+            _redact_header("Authorization", headers["Authorization"])
+            if "Authorization" in headers
+            else None
+        )
+
+        with self._lock:
+            candidates = [
+                i
+                for i, interaction in enumerate(self.interactions)
+                if not self._replayed[i]
+                and interaction["request"]["method"] == method
+                and urlsplit(interaction["request"]["url"])[:3] == path
+                and interaction["request"]["headers"].get("Authorization")
+                == authorization
+            ]
+
+            if not candidates:
+                raise RuntimeError(f"No recorded response to {method} {url}.")
+
+            index = candidates[0]
+            if len(candidates) > 1:
+                encoded_body = _encode_body(body, headers.get("Content-Type", ""))
+                index = next(
+                    (
+                        i
+                        for i in candidates
+                        if self.interactions[i]["request"]["url"] == url
+                        and self.interactions[i]["request"]["body"] == encoded_body
+                    ),
+                    index,
+                )
+            self._replayed[index] = True
+
+        response = self.interactions[index]["response"]
+        return response["status"], response["headers"], _decode_body(response["body"])
+
+
+@contextmanager
+def _intercept(cassette: Cassette, replay: bool) -> Iterator[Cassette]:
+    """
+    Intercept all requests sent via requests, and via httpx if installed, to record or replay them.
+
+    Requests are intercepted at the transport level, which covers MSAL, the Microsoft Graph clients and the Azure SDK
+    alike.
+    """
+    send = HTTPAdapter.send
+
+    def record_send(adapter, request, **kwargs):
+        response = send(adapter, request, **kwargs)
+        cassette.record(
+            request.method,
+            request.url,
+            request.headers,
+            request.body,
+            response.status_code,
+            response.headers,
+            response.content,
+        )
+        return response
+
+    def replay_send(adapter, request, **kwargs):
+        status, headers, body = cassette.play(
+            request.method, request.url, request.headers, request.body
+        )
+        raw = HTTPResponse(
+            body=io.BytesIO(body),
+            headers={**headers, "Content-Length": str(len(body))},
+            status=status,
+            reason=http.HTTPStatus(status).phrase,
+            preload_content=False,
+            decode_content=False,
+            request_method=request.method,
+        )
+        return adapter.build_response(request, raw)
+
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+
+    if httpx is not None:
+        handle_async_request = httpx.AsyncHTTPTransport.handle_async_request
+
+        async def record_handle_async_request(transport, request):
+            response = await handle_async_request(transport, request)
+            await response.aread()
+            cassette.record(
+                request.method,
+                str(request.url),
+                request.headers,
+                request.content,
+                response.status_code,
+                response.headers,
+                response.content,
+            )
+            return response
+
+        async def replay_handle_async_request(transport, request):
+            status, headers, body = cassette.play(
+                request.method, str(request.url), request.headers, request.content
+            )
+            return httpx.Response(
+                status,
+                headers={**headers, "Content-Length": str(len(body))},
+                content=body,
+                request=request,
+            )
+
+    HTTPAdapter.send = replay_send if replay else record_send
+    if httpx is not None:
+        httpx.AsyncHTTPTransport.handle_async_request = (
+            replay_handle_async_request if replay else record_handle_async_request
+        )
+
+    try:
+        yield cassette
+    finally:
+        HTTPAdapter.send = send
+        if httpx is not None:
+            httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+
+@contextmanager
+def recording(path: Path) -> Iterator[Cassette]:
+    """
+    Record all HTTP exchanges within the enclosed block to a cassette file.
+
+    The cassette is saved even if the block fails, since failed runs are the most interesting ones to reproduce.
+
+    Args:
+        path (Path): Path of the cassette file, gzip-compressed if its name ends with .gz
+
+    Returns:
+        A context manager that yields the cassette
+    """
+    cassette = Cassette()
+
+    log.info(f"Recording HTTP exchanges to {path}.")
+
+    try:
+        with _intercept(cassette, replay=False):
+            yield cassette
+    finally:
+        cassette.save(path)
+
+
+@contextmanager
+def replaying(cassette: Cassette | Path) -> Iterator[Cassette]:
+    """
+    Serve all HTTP requests within the enclosed block from a cassette, without sending any.
+
+    A cassette may be replayed in several blocks, e.g. to replay a recorded init and run separately. Each block
+    continues with the exchanges not replayed yet.
+
+    Args:
+        cassette (Cassette | Path): Cassette, or path of a cassette file
+
+    Returns:
+        A context manager that yields the cassette
+    """
+    if not isinstance(cassette, Cassette):
+        cassette = Cassette.load(cassette)
+
+    with _intercept(cassette, replay=True):
+        yield cassette
@@ -1,54 +1,184 @@
+import asyncio
+import functools
 import logging
-import xml.etree.ElementTree as ElementTree
+import random
+import signal
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Literal
 from zoneinfo import ZoneInfo
 
-import jinja2
+import msal
 import requests
+from pydantic import BaseModel
 
-from .auth import get_access_token
-from .settings import RunSettings, InitSettings, TimeZoneCache
-from .util import get_adjacent_events, get_datetime
+from .auth import TokenManager, get_access_token, get_msal_app
+from .delta import (
+    get_valid_until,
+    is_outcome_valid,
+    is_outcome_valid_async,
+    put_delta_state,
+    put_delta_states,
+    sync_calendar,
+    sync_calendar_async,
+)
+from .fingerprint import (
+    create_fingerprint,
+    get_fingerprint,
+    get_inputs_hash,
+    get_mailbox_hash,
+    get_settings_hash,
+    put_fingerprint,
+)
+from .graph import (
+    AsyncGraphClient,
+    GraphClient,
+    RateLimiter,
+    RunDeadline,
+    create_async_client,
+    create_session,
+    select,
+)
+from .instrumentation import export, span
+from .plan import PLANS_ADAPTER, MailboxState, Plan, get_absence_period, plan_many
+from .plan import plan as plan_mailbox
+from .settings import (
+    DeltaState,
+    InitSettings,
+    RunSettings,
+    ServeSettings,
+    SimulateSettings,
+)
+from .simulate import (
+    CHANGES_ADAPTER,
+    SNAPSHOTS_ADAPTER,
+    CalendarSnapshot,
+    SimulatedChange,
+)
+from .simulate import simulate as simulate_runs
+from .templates import TemplateRegistry
+from .tz import get_iana_timezone
+from .util import get_adjacent_events, get_adjacent_events_async, get_datetime
 
 log = logging.getLogger(__name__)
 
 UTC = ZoneInfo("UTC")
 
 
+def _get_current_time() -> datetime:
+    """Return the current time in UTC."""
+    return datetime.now(UTC).astimezone(UTC)
+
+
+@dataclass
 class Context:
     """
     Application context for storing stateful information during execution.
+
+    The token cache, MSAL application, Graph client and template registry may be provided by the caller to share them
+    between runs for multiple mailboxes. Otherwise, they are created on demand. The asyncio implementation uses an
+    async Graph client. The clock returns the current time of a run, and may be replaced e.g. to simulate runs at other
+    times. If a token manager is given, it provides the access tokens instead of acquiring them for each run. If the
+    delta state is deferred, the synchronization state of a run is kept for the caller to store, e.g. once for many
+    mailboxes.
     """
 
-    headers: dict | None = None
+    username: str | None = None
+    interactive: bool = True
+    token_cache: msal.TokenCache | None = None
+    msal_app: msal.PublicClientApplication | None = None
+    graph: GraphClient | AsyncGraphClient | None = None
+    templates: TemplateRegistry | None = None
     mailbox_settings_response: requests.Response | None = None
     mailbox_timezone: ZoneInfo | None = None
+    clock: Callable[[], datetime] = _get_current_time
+    tokens: TokenManager | None = None
+    defer_delta_state: bool = False
+    delta_state: DeltaState | None = None
 
 
-def init(settings: InitSettings, ctx: Context = Context()):
+class MailboxResult(BaseModel):
     """
-    Initialize the application by acquiring and caching an access token.
+    Outcome of a run for a single mailbox.
+    """
+
+    mailbox: str | None = None
+    status: Literal["updated", "unchanged", "no_absence", "dry_run", "failed"]
+    start: datetime | None = None
+    end: datetime | None = None
+    error: str | None = None
+    bytes_sent: int = 0
+
+
+def _authenticate(settings: InitSettings, ctx: Context) -> None:
+    """
+    Acquire an access token and set up the Graph client to use it.
 
     Args:
         settings (Settings): Application configuration
         ctx (Context): Execution context
     """
-    log.info("Initializing token cache.")
-    token_cache = settings.cache.get_token_cache()
+    # Only load and save the token cache here if it is not shared with other runs.
+    owns_token_cache = ctx.token_cache is None
 
-    log.info("Getting access token.")
-    access_token = get_access_token(settings.app, token_cache)
+    if owns_token_cache:
+        log.info("Initializing token cache.")
+        ctx.token_cache = settings.cache.get_token_cache()
 
-    log.info("Saving token cache.")
-    settings.cache.put_token_cache(token_cache)
+    if ctx.graph is None:
+        ctx.graph = GraphClient(settings.graph, settings.app.base_url)
+
+    if ctx.tokens is not None:
+        # Authorize each request with the current token of the account, which is refreshed in the background.
+        log.info("Getting access token.")
+        ctx.tokens.get_authorization(ctx.username)
+        ctx.graph.set_authorization(
+            functools.partial(ctx.tokens.get_authorization, ctx.username)
+        )
+        return
 
-    # Prepare API request headers
-    ctx.headers = {"Authorization": f"Bearer {access_token}"}
+    # Use the Graph client's connection pool for requests to the identity provider, too.
+    if ctx.msal_app is None:
+        ctx.msal_app = get_msal_app(
+            settings.app,
+            ctx.token_cache,
+            http_client=ctx.graph.session,
+            cache_settings=settings.cache,
+        )
 
-    # Retrieve mailbox settings
-    ctx.mailbox_settings_response = requests.get(
-        f"{settings.app.base_url}/me/mailboxSettings", headers=ctx.headers
+    log.info("Getting access token.")
+    access_token = get_access_token(
+        settings.app,
+        ctx.token_cache,
+        msal_app=ctx.msal_app,
+        username=ctx.username,
+        interactive=ctx.interactive,
     )
+
+    if owns_token_cache:
+        log.info("Saving token cache.")
+        settings.cache.put_token_cache(ctx.token_cache)
+
+    # Authenticate subsequent API requests.
+    ctx.graph.set_access_token(access_token)
+
+
+def _load_mailbox_settings(
+    settings: InitSettings, ctx: Context, response: requests.Response
+) -> None:
+    """
+    Store the mailbox settings from the given response and determine the mailbox timezone.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+        response (requests.Response): Response to a mailbox settings request
+    """
+    ctx.mailbox_settings_response = response
     ctx.mailbox_settings_response.raise_for_status()
 
     log.debug(f"Mailbox settings: {ctx.mailbox_settings_response.json()}")
@@ -57,47 +187,40 @@ def init(settings: InitSettings, ctx: Context = Context()):
     mailbox_timezone_name = ctx.mailbox_settings_response.json().get("timeZone")
     log.info(f"Mailbox timezone (Windows): {mailbox_timezone_name}")
 
-    timezone_cache = settings.cache.get_tz_cache()
-    log.info(f"Timezone cache: {timezone_cache}")
+    iana_tz = get_iana_timezone(mailbox_timezone_name)
 
-    if not timezone_cache or timezone_cache.windows_tz != mailbox_timezone_name:
-        log.info("Updating timezone cache...")
-
-        # Retrieve Windows timezone to IANA timezone mapping.
-        windows_zones_response = requests.get(
-            "https://raw.githubusercontent.com/unicode-org/cldr/main/common/supplemental/windowsZones.xml"
+    if not iana_tz:
+        raise ValueError(
+            f"Failed to find IANA timezone for Windows timezone: {mailbox_timezone_name}"
         )
 
-        # Raise an exception if the request was unsuccessful.
-        windows_zones_response.raise_for_status()
+    ctx.mailbox_timezone = ZoneInfo(iana_tz)
+    log.info(f"Mailbox timezone (IANA): {ctx.mailbox_timezone}")
 
-        iana_tz = None
 
-        # Parse the XML content.
-        root = ElementTree.fromstring(windows_zones_response.text)
+def init(settings: InitSettings, ctx: Context | None = None):
+    """
+    Initialize the application by acquiring and caching an access token.
 
-        # Find the IANA timezone for the given Windows timezone.
-        for mapZone in root.findall(".//mapZone"):
-            if mapZone.get("other") == mailbox_timezone_name:
-                iana_name = mapZone.get("type").split()[0]
-                iana_tz = iana_name
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+    """
+    if ctx is None:
+        ctx = Context()
 
-        if not iana_tz:
-            raise ValueError(
-                f"Failed to find IANA timezone for Windows timezone: {mailbox_timezone_name}"
-            )
+    with span("command.init", mailbox=ctx.username):
+        _authenticate(settings, ctx)
 
-        # Update timezone cache.
-        timezone_cache = TimeZoneCache(
-            windows_tz=mailbox_timezone_name, iana_tz=iana_tz
+        # Retrieve mailbox settings
+        _load_mailbox_settings(
+            settings,
+            ctx,
+            ctx.graph.get("/me/mailboxSettings", params=select("mailboxSettings")),
         )
-        settings.cache.put_tz_cache(timezone_cache)
-
-    ctx.mailbox_timezone = ZoneInfo(timezone_cache.iana_tz)
-    log.info(f"Mailbox timezone (IANA): {ctx.mailbox_timezone}")
 
 
-def run(settings: RunSettings, ctx: Context = Context()):
+def run(settings: RunSettings, ctx: Context | None = None) -> MailboxResult:
     """
     Main execution method for managing absence automatic replies.
 
@@ -106,19 +229,142 @@ def run(settings: RunSettings, ctx: Context = Context()):
     Args:
         settings (Settings): Application configuration
         ctx (Context): Execution context
+
+    Returns:
+        MailboxResult: Outcome of the run
     """
-    init(settings, ctx)
+    if ctx is None:
+        ctx = Context()
 
-    # Initialize Jinja2 environment with custom filters.
-    env = jinja2.Environment()
-    env.filters["date"] = (
-        lambda value: value.strftime(settings.absence.date_format)
-        if isinstance(value, datetime)
-        else value
-    )
+    with span("command.run", mailbox=ctx.username) as s:
+        _authenticate(settings, ctx)
+
+        now = ctx.clock()
+
+        bytes_sent = ctx.graph.bytes_sent
+
+        result = (
+            _run_delta(settings, ctx, now)
+            if settings.delta_sync
+            else _run(settings, ctx, now)
+        )
+
+        result.bytes_sent = ctx.graph.bytes_sent - bytes_sent
+        log.info(f"Sent {result.bytes_sent} bytes of request data.")
+
+        s.attributes["status"] = result.status
+
+    return result
+
+
+def _run_delta(settings: RunSettings, ctx: Context, now: datetime) -> MailboxResult:
+    """
+    Run for an authenticated mailbox, unless neither the calendar, the mailbox settings nor the templates and absence
+    settings changed since the last run.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+        now (datetime): Current time
+
+    Returns:
+        MailboxResult: Outcome of the run
+    """
+    # Skip the run if the calendar did not change and the outcome of the last run is still valid.
+    delta_state, changed = sync_calendar(settings, ctx.graph, ctx.username, now)
+
+    if not changed and is_outcome_valid(settings, ctx.graph, delta_state, now):
+        log.info(
+            f"No calendar changes since last run and outcome valid until {delta_state.valid_until}. Skipping run."
+        )
+        _put_delta_state(settings, ctx, delta_state)
+        return MailboxResult(mailbox=ctx.username, status="unchanged")
 
-    # Determine absence period
-    now = datetime.now(UTC).astimezone(UTC)
+    result = _run(settings, ctx, now)
+
+    _set_outcome(settings, ctx, delta_state, result, now)
+    _put_delta_state(settings, ctx, delta_state)
+
+    return result
+
+
+def _set_outcome(
+    settings: RunSettings,
+    ctx: Context,
+    delta_state: DeltaState,
+    result: MailboxResult,
+    now: datetime,
+) -> None:
+    """
+    Remember the outcome of a run in the synchronization state, so that the next run can be skipped while it is valid.
+
+    Only runs that left the automatic replies as they were have such an outcome, since the next run must be able to
+    check that the mailbox settings are still the same. After an update, the next run evaluates them again.
+    """
+    if result.status in ("unchanged", "no_absence"):
+        mailbox_settings = ctx.mailbox_settings_response.json()
+        delta_state.valid_until = get_valid_until(
+            settings,
+            delta_state,
+            ctx.mailbox_timezone,
+            mailbox_settings.get("automaticRepliesSetting", {}),
+            result.end,
+            now,
+        )
+        delta_state.mailbox = get_mailbox_hash(mailbox_settings)
+        delta_state.configuration = get_settings_hash(settings)
+    else:
+        delta_state.valid_until = None
+        delta_state.mailbox = None
+        delta_state.configuration = None
+
+
+def _put_delta_state(
+    settings: RunSettings, ctx: Context, delta_state: DeltaState
+) -> None:
+    """
+    Store the synchronization state of a run, unless it is deferred to the caller.
+    """
+    if ctx.defer_delta_state:
+        ctx.delta_state = delta_state
+    else:
+        put_delta_state(settings, ctx.username, delta_state)
+
+
+def _put_deferred_delta_states(settings: RunSettings, contexts: list[Context]) -> None:
+    """
+    Store the deferred synchronization states of several runs at once.
+    """
+    states = {
+        ctx.username: ctx.delta_state for ctx in contexts if ctx.delta_state is not None
+    }
+    for ctx in contexts:
+        ctx.delta_state = None
+
+    if states:
+        put_delta_states(settings, states)
+
+
+@dataclass
+class _Evaluation:
+    """
+    Outcome of evaluating the absence events and the automatic replies of a mailbox, before updating them.
+    """
+
+    # Outcome of the run, assuming that the update succeeds.
+    result: MailboxResult
+    # Hash of the inputs of the run, when skipping unchanged runs.
+    inputs: str | None = None
+    # Properties of the automatic replies to update, if any.
+    changes: dict | None = None
+    # Whether the inputs did not change since the last run, so that the run ends without further action.
+    skipped: bool = False
+
+
+def _get_calendar_view_params(settings: RunSettings, now: datetime) -> dict:
+    """
+    Return the query parameters for the next absence event within the future period.
+    """
     start_time = now.isoformat()
     end_time = (now + timedelta(days=settings.absence.future_period_days)).isoformat()
 
@@ -126,18 +372,22 @@ def run(settings: RunSettings, ctx: Context = Context()):
         f"Querying calendar view for upcoming or ongoing absence from {start_time} to {end_time}."
     )
 
-    # Query calendar for next absence event
-    calendar_view_response = requests.get(
-        f"{settings.app.base_url}/me/calendar/calendarView",
-        headers=ctx.headers,
-        params={
-            "startDateTime": start_time,
-            "endDateTime": end_time,
-            "$filter": f"subject eq '{settings.absence.keyword}' and isAllDay eq true",
-            "$orderby": "start/dateTime",
-            "$top": 1,
-        },
-    )
+    return {
+        "startDateTime": start_time,
+        "endDateTime": end_time,
+        "$filter": f"subject eq '{settings.absence.keyword}' and isAllDay eq true",
+        "$orderby": "start/dateTime",
+        "$top": 1,
+        **select("event"),
+    }
+
+
+def _get_next_absence_event(
+    ctx: Context, calendar_view_response: requests.Response
+) -> dict | None:
+    """
+    Return the next absence event from the response to a calendar view request, if any.
+    """
     calendar_view_response.raise_for_status()
 
     calendar_events = calendar_view_response.json().get("value", [])
@@ -147,9 +397,8 @@ def run(settings: RunSettings, ctx: Context = Context()):
 
     if not next_vacation:
         log.info("No upcoming vacation events found.")
-        return
+        return None
 
-    # Process vacation event details
     vacation_start = get_datetime(next_vacation["start"]).replace(
         tzinfo=ctx.mailbox_timezone
     )
@@ -161,207 +410,1044 @@ def run(settings: RunSettings, ctx: Context = Context()):
         f"Found upcoming vacation event from {vacation_start.strftime('%Y-%m-%d')} to {vacation_end.strftime('%Y-%m-%d')}."
     )
 
-    # Find adjacent vacation events
-    log.info("Finding adjacent/overlapping vacation events...")
-    adjacent_events = get_adjacent_events(
-        ctx.mailbox_timezone, settings, ctx.headers, next_vacation
+    return next_vacation
+
+
+def _get_mailbox_state(
+    ctx: Context, next_vacation: dict | None, adjacent_events: list[dict]
+) -> MailboxState:
+    """
+    Return the fetched state of a mailbox to plan the changes to its automatic replies.
+    """
+    return MailboxState(
+        mailbox=ctx.username,
+        timezone=ctx.mailbox_timezone,
+        auto_reply_settings=ctx.mailbox_settings_response.json().get(
+            "automaticRepliesSetting", {}
+        ),
+        next_absence=next_vacation,
+        adjacent_events=adjacent_events,
     )
+
+
+def _evaluate(
+    settings: RunSettings,
+    ctx: Context,
+    next_vacation: dict,
+    adjacent_events: list[dict],
+    now: datetime,
+) -> _Evaluation:
+    """
+    Decide whether and how to update the automatic replies of a mailbox for the upcoming absence period.
+
+    Shared by the blocking and the async implementation of a run. The decision itself is left to the planner; this adds
+    the check for unchanged inputs and the outcome of the run. Sends no requests to the Microsoft Graph API, but may
+    access the fingerprint cache.
+
+    The inputs include all absence events of the period, which are only known once the adjacent events have been
+    queried, so unchanged inputs cannot be detected before. A match therefore saves no requests, only evaluating the
+    plan, rendering the templates and comparing the replies. Runs without any calendar changes are skipped before all
+    calendar queries via delta sync instead.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context, with the mailbox settings loaded
+        next_vacation (dict): Next absence event
+        adjacent_events (list[dict]): Absence events adjacent to or overlapping with the next one
+        now (datetime): Current time
+
+    Returns:
+        _Evaluation: Outcome of the evaluation
+    """
+    state = _get_mailbox_state(ctx, next_vacation, adjacent_events)
+    vacation_start, vacation_end = get_absence_period(state)
+
     log.info(f"Found {len(adjacent_events)} adjacent/overlapping vacation events.")
 
     if adjacent_events:
         log.info("Updating vacation period to include adjacent/overlapping events.")
-        vacation_end = get_datetime(adjacent_events[-1]["end"]).replace(
-            tzinfo=ctx.mailbox_timezone
-        )
         log.info(
             f"Updated vacation period to end on {vacation_end.strftime('%Y-%m-%d')}."
         )
 
-    # Get current automatic replies settings.
-    auto_reply_settings = ctx.mailbox_settings_response.json().get(
-        "automaticRepliesSetting", {}
-    )
+    # Skip the rest of the run if none of its inputs changed since the last run that left the automatic replies
+    # unchanged. The inputs include the current automatic replies, so changes made outside the application are detected.
+    inputs = None
+    if settings.skip_unchanged:
+        inputs = get_inputs_hash(
+            settings,
+            [next_vacation, *adjacent_events],
+            ctx.mailbox_settings_response.json(),
+        )
+        fingerprint = get_fingerprint(settings, ctx.username)
+
+        if (
+            fingerprint is not None
+            and fingerprint.inputs == inputs
+            and now < fingerprint.valid_until
+        ):
+            log.info(
+                f"Inputs unchanged since last run and outcome valid until {fingerprint.valid_until}. Not updating."
+            )
+            return _Evaluation(
+                result=MailboxResult(
+                    mailbox=ctx.username,
+                    status="unchanged",
+                    start=vacation_start,
+                    end=vacation_end,
+                ),
+                inputs=inputs,
+                skipped=True,
+            )
+
+    auto_reply_settings = state.auto_reply_settings
 
     log.debug(f"Current automatic replies settings: {auto_reply_settings}")
+    log.info(
+        f"Current automatic replies status: {auto_reply_settings.get('status')}"
+        + (
+            f" from {get_datetime(auto_reply_settings['scheduledStartDateTime'])} to {get_datetime(auto_reply_settings['scheduledEndDateTime'])}"
+            if auto_reply_settings.get("status") == "scheduled"
+            else ""
+        )
+    )
 
-    # Check if automatic replies are currently active.
-    auto_replies_active = auto_reply_settings.get(
-        "status"
-    )  # == 'scheduled' or auto_reply_settings.get('status') == 'alwaysEnabled'
+    mailbox_plan = plan_mailbox(settings.absence, state, ctx.templates, now)
 
-    scheduled_start_date_time = (
-        get_datetime(auto_reply_settings.get("scheduledStartDateTime"))
-        if auto_replies_active == "scheduled"
-        else None
+    log.info(mailbox_plan.reason)
+
+    result = MailboxResult(
+        mailbox=ctx.username,
+        status="unchanged",
+        start=mailbox_plan.start,
+        end=mailbox_plan.end,
     )
 
-    scheduled_end_date_time = (
-        get_datetime(auto_reply_settings.get("scheduledEndDateTime"))
-        if auto_replies_active == "scheduled"
-        else None
+    if mailbox_plan.changes is not None:
+        log.info(
+            f"Scheduling automatic replies for vacation period from {mailbox_plan.start} to {mailbox_plan.end}."
+        )
+        log.info(f"Changed properties: {', '.join(mailbox_plan.changes) or 'none'}.")
+
+        if not mailbox_plan.changes:
+            log.info("Automatic replies already match the desired settings.")
+        elif settings.dry_run:
+            log.info("Dry run mode enabled. Automatic replies not updated.")
+            result.status = "dry_run"
+
+    return _Evaluation(result=result, inputs=inputs, changes=mailbox_plan.changes)
+
+
+def _apply_update_response(
+    result: MailboxResult, update_response: requests.Response
+) -> None:
+    """
+    Set the outcome of a run from the response to the update of the automatic replies.
+    """
+    if update_response.status_code == 200:
+        log.info("Successfully updated automatic replies for vacation period.")
+        result.status = "updated"
+    else:
+        log.error(
+            f"Failed to update automatic replies: {update_response.status_code} {update_response.text}"
+        )
+        result.status = "failed"
+        result.error = f"{update_response.status_code} {update_response.text}"
+
+
+def _finish_run(
+    settings: RunSettings, ctx: Context, evaluation: _Evaluation, now: datetime
+) -> None:
+    """
+    Conclude a run after the automatic replies have been updated, if needed.
+    """
+    # Remember the inputs if the automatic replies are left unchanged. Otherwise, the next run must evaluate them again.
+    if settings.skip_unchanged:
+        put_fingerprint(
+            settings,
+            ctx.username,
+            create_fingerprint(
+                evaluation.inputs, ctx.mailbox_settings_response.json(), now
+            )
+            if evaluation.result.status == "unchanged"
+            else None,
+        )
+
+    log.info("Run complete.")
+
+
+def _fetch_next_absence_event(
+    settings: RunSettings, ctx: Context, now: datetime
+) -> dict | None:
+    """
+    Load the mailbox settings and return the next absence event of an authenticated mailbox, if any.
+    """
+    # Retrieve mailbox settings and query calendar for next absence event in a single batch request.
+    with ctx.graph.batch() as batch:
+        mailbox_settings_response = batch.get(
+            "/me/mailboxSettings", params=select("mailboxSettings")
+        )
+        calendar_view_response = batch.get(
+            "/me/calendar/calendarView", params=_get_calendar_view_params(settings, now)
+        )
+
+    _load_mailbox_settings(settings, ctx, mailbox_settings_response)
+
+    return _get_next_absence_event(ctx, calendar_view_response)
+
+
+def _run(settings: RunSettings, ctx: Context, now: datetime) -> MailboxResult:
+    """
+    Detect upcoming absence events and update the automatic replies of an authenticated mailbox accordingly.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+        now (datetime): Current time
+
+    Returns:
+        MailboxResult: Outcome of the run
+    """
+    # Create template registry, if not shared by the caller.
+    if ctx.templates is None:
+        ctx.templates = TemplateRegistry(settings.absence)
+
+    next_vacation = _fetch_next_absence_event(settings, ctx, now)
+    if not next_vacation:
+        return MailboxResult(mailbox=ctx.username, status="no_absence")
+
+    # Find adjacent vacation events
+    log.info("Finding adjacent/overlapping vacation events...")
+    adjacent_events = get_adjacent_events(
+        ctx.mailbox_timezone, settings, ctx.graph, next_vacation
     )
 
-    log.info(
-        f"Current automatic replies status: {auto_replies_active}"
-        + (
-            f" from {scheduled_start_date_time} to {scheduled_end_date_time}"
-            if auto_replies_active == "scheduled"
-            else ""
+    evaluation = _evaluate(settings, ctx, next_vacation, adjacent_events, now)
+    if evaluation.skipped:
+        return evaluation.result
+
+    # Update automatic replies
+    if evaluation.changes and not settings.dry_run:
+        _apply_update_response(
+            evaluation.result,
+            ctx.graph.patch(
+                "/me/mailboxSettings",
+                json={"automaticRepliesSetting": evaluation.changes},
+            ),
         )
+
+    _finish_run(settings, ctx, evaluation, now)
+
+    return evaluation.result
+
+
+def _create_fleet_session(settings: InitSettings) -> requests.Session:
+    """
+    Create an HTTP session with a connection pool large enough for all worker threads.
+    """
+    return create_session(
+        settings.graph, max(settings.graph.pool_size, settings.fleet.max_workers)
     )
 
-    # Get internal and external absence messages.
-    internal_msg_current = auto_reply_settings.get("internalReplyMessage")
-    external_msg_current = auto_reply_settings.get("externalReplyMessage")
 
-    log.debug(f"Current internal absence message: {internal_msg_current}")
-    log.debug(f"Current external absence message: {external_msg_current}")
+def init_fleet(settings: InitSettings) -> None:
+    """
+    Initialize the application for all configured mailboxes.
 
-    # Initialize internal and external absence messages.
-    internal_msg = None
-    external_msg = None
+    Mailboxes are processed one after another, since each one may require interactive authentication. All accounts are
+    stored in the same token cache.
 
-    # Check if autotomatic replies should be updated.
+    Args:
+        settings (Settings): Application configuration
+    """
+    log.info("Initializing token cache.")
+    token_cache = settings.cache.get_token_cache()
+
+    session = _create_fleet_session(settings)
+    msal_app = get_msal_app(
+        settings.app, token_cache, http_client=session, cache_settings=settings.cache
+    )
+
+    try:
+        for mailbox in settings.fleet.mailboxes:
+            log.info(f"Initializing mailbox {mailbox}.")
+            init(
+                settings,
+                Context(
+                    username=mailbox,
+                    token_cache=token_cache,
+                    msal_app=msal_app,
+                    graph=GraphClient(settings.graph, settings.app.base_url, session),
+                ),
+            )
+    finally:
+        session.close()
+
+        log.info("Saving token cache.")
+        settings.cache.put_token_cache(token_cache)
+
+
+def _create_fleet_contexts(
+    settings: RunSettings,
+    token_cache: msal.TokenCache,
+    msal_app: msal.PublicClientApplication,
+    session: requests.Session,
+    mailboxes: list[str | None],
+    tokens: TokenManager | None = None,
+    run_deadline: RunDeadline | None = None,
+) -> list[Context]:
+    """
+    Create non-interactive execution contexts for the given mailboxes, sharing the token cache, MSAL application,
+    HTTP session, rate limiter, run deadline, template registry and token manager, if any. Delta states are deferred,
+    so that they are stored once for all mailboxes.
+    """
+    templates = TemplateRegistry(settings.absence)
+    limiter = RateLimiter(settings.graph.rate_limit)
+    if run_deadline is None:
+        run_deadline = RunDeadline(settings.graph.run_deadline_seconds)
+
+    return [
+        Context(
+            username=mailbox,
+            interactive=False,
+            token_cache=token_cache,
+            msal_app=msal_app,
+            graph=GraphClient(
+                settings.graph, settings.app.base_url, session, limiter, run_deadline
+            ),
+            templates=templates,
+            tokens=tokens,
+            defer_delta_state=True,
+        )
+        for mailbox in mailboxes
+    ]
+
+
+def _run_mailboxes(
+    settings: RunSettings, contexts: list[Context], executor: ThreadPoolExecutor
+) -> list[MailboxResult]:
+    """
+    Run for several mailboxes concurrently and log a per-mailbox summary.
+
+    A failure for one mailbox does not affect the others. The deferred delta states of all mailboxes are stored at once
+    afterwards.
+
+    Args:
+        settings (Settings): Application configuration
+        contexts (list[Context]): Execution context for each mailbox
+        executor (ThreadPoolExecutor): Thread pool to run in
+
+    Returns:
+        list[MailboxResult]: Outcome for each mailbox, in the given order
+    """
+
+    def run_mailbox(ctx: Context) -> MailboxResult:
+        try:
+            return run(settings, ctx)
+        except Exception as e:
+            log.exception(f"Run failed for mailbox {ctx.username}.")
+            return MailboxResult(mailbox=ctx.username, status="failed", error=str(e))
+
+    results = list(executor.map(run_mailbox, contexts))
+
+    _put_deferred_delta_states(settings, contexts)
+
+    _log_fleet_summary(results)
 
-    should_update = False
+    return results
 
-    if auto_replies_active == "disabled":
-        # Schedule automatic replies since they're not active.
-        should_update = True
+
+def _log_fleet_summary(results: list[MailboxResult]) -> None:
+    """
+    Log the outcome for each mailbox of a fleet run.
+    """
+    for result in results:
         log.info(
-            "Automatic replies are not currently active. Scheduling for vacation period."
+            f"{result.mailbox or '(default)'}: {result.status}"
+            + (f" ({result.start} to {result.end})" if result.start else "")
+            + (f" - {result.error}" if result.error else "")
+            + f" [{result.bytes_sent} bytes sent]"
         )
-    elif auto_replies_active == "alwaysEnabled":
-        # Do not change automatic replies if they're always enabled.
-        should_update = False
+
+    failed = sum(1 for result in results if result.status == "failed")
+    log.info(f"Fleet run complete. {len(results) - failed} succeeded, {failed} failed.")
+
+
+def run_fleet(settings: RunSettings) -> list[MailboxResult]:
+    """
+    Manage absence automatic replies for all configured mailboxes concurrently.
+
+    Mailboxes are processed in a bounded thread pool, or on an asyncio event loop if so configured. Settings, the token
+    cache, the MSAL application and the HTTP connection pool are shared between all mailboxes. A failure for one
+    mailbox does not affect the others.
+
+    Args:
+        settings (Settings): Application configuration
+
+    Returns:
+        list[MailboxResult]: Outcome for each mailbox, in the configured order
+    """
+    if settings.fleet.engine == "asyncio":
+        return asyncio.run(run_fleet_async(settings))
+
+    log.info("Initializing token cache.")
+    token_cache = settings.cache.get_token_cache()
+
+    session = _create_fleet_session(settings)
+    msal_app = get_msal_app(
+        settings.app, token_cache, http_client=session, cache_settings=settings.cache
+    )
+
+    contexts = _create_fleet_contexts(
+        settings, token_cache, msal_app, session, settings.fleet.mailboxes
+    )
+
+    log.info(
+        f"Processing {len(contexts)} mailbox(es) with up to {settings.fleet.max_workers} workers."
+    )
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=settings.fleet.max_workers, thread_name_prefix="mailbox"
+        ) as executor:
+            return _run_mailboxes(settings, contexts, executor)
+    finally:
+        session.close()
+
+        log.info("Saving token cache.")
+        settings.cache.put_token_cache(token_cache)
+
+
+def serve(settings: ServeSettings) -> None:
+    """
+    Manage absence automatic replies continuously, running at a regular interval.
+
+    Settings, the token cache, the MSAL application and the HTTP connection pool are kept between runs. Access tokens
+    are refreshed on a background thread before they expire, so that runs do not wait for them, and the token cache is
+    only stored when it changed. Processes all configured mailboxes, or the first cached account if none are
+    configured. Stops gracefully on SIGTERM or SIGINT, after completing the current run.
+
+    Mailboxes are always processed in a thread pool, since the clients kept between runs are bound to threads. The
+    asyncio engine is therefore not supported.
+
+    Args:
+        settings (Settings): Application configuration
+    """
+    if settings.fleet.engine != "threads":
+        raise ValueError(
+            f"The serve command does not support the {settings.fleet.engine} engine. Use the threads engine."
+        )
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        log.info(f"Received signal {signum}. Stopping after the current run.")
+        stop.set()
+
+    log.info("Initializing token cache.")
+    token_cache = settings.cache.get_token_cache()
+
+    session = _create_fleet_session(settings)
+    msal_app = get_msal_app(
+        settings.app, token_cache, http_client=session, cache_settings=settings.cache
+    )
+
+    tokens = TokenManager(
+        settings.app,
+        settings.cache,
+        token_cache,
+        msal_app,
+        timedelta(seconds=settings.scheduler.token_refresh_seconds),
+    )
+
+    run_deadline = RunDeadline(settings.graph.run_deadline_seconds)
+
+    contexts = _create_fleet_contexts(
+        settings,
+        token_cache,
+        msal_app,
+        session,
+        settings.fleet.mailboxes or [None],
+        tokens,
+        run_deadline,
+    )
+
+    log.info(
+        f"Serving {len(contexts)} mailbox(es) every {settings.scheduler.interval_seconds} seconds."
+    )
+
+    # Stop on signals while serving, and restore the previous handlers afterwards.
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+    try:
+        with (
+            tokens,
+            ThreadPoolExecutor(
+                max_workers=settings.fleet.max_workers, thread_name_prefix="mailbox"
+            ) as executor,
+        ):
+            while not stop.is_set():
+                started = time.monotonic()
+                run_deadline.start()
+
+                _run_mailboxes(settings, contexts, executor)
+
+                tokens.save()
+
+                export(settings.instrumentation)
+
+                # Wait for the rest of the interval plus a random jitter, unless asked to stop.
+                delay = max(
+                    0.0,
+                    settings.scheduler.interval_seconds - (time.monotonic() - started),
+                ) + random.uniform(0, settings.scheduler.jitter_seconds)
+
+                log.info(f"Next run in {delay:.0f} seconds.")
+                stop.wait(delay)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+        session.close()
+
+    log.info("Stopped.")
+
+
+def _fetch_mailbox_state(
+    settings: RunSettings, ctx: Context, now: datetime
+) -> MailboxState:
+    """
+    Fetch the state of a mailbox that the changes to its automatic replies are planned on.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+        now (datetime): Current time
+
+    Returns:
+        MailboxState: Fetched state of the mailbox
+    """
+    with span("command.fetch", mailbox=ctx.username):
+        _authenticate(settings, ctx)
+
+        next_vacation = _fetch_next_absence_event(settings, ctx, now)
+
+        adjacent_events = []
+        if next_vacation:
+            log.info("Finding adjacent/overlapping vacation events...")
+            adjacent_events = get_adjacent_events(
+                ctx.mailbox_timezone, settings, ctx.graph, next_vacation
+            )
+
+        return _get_mailbox_state(ctx, next_vacation, adjacent_events)
+
+
+def plan(settings: RunSettings) -> list[Plan]:
+    """
+    Plan the changes to the automatic replies of all configured mailboxes, or of the default mailbox, and print them as
+    JSON.
+
+    The state of the mailboxes is fetched concurrently first, then the changes for all of them are planned in one
+    batch. Neither the automatic replies nor the delta and fingerprint caches are updated. A failure for one mailbox
+    does not affect the others.
+
+    Args:
+        settings (Settings): Application configuration
+
+    Returns:
+        list[Plan]: Intended changes for each mailbox, in the configured order
+    """
+    log.info("Initializing token cache.")
+    token_cache = settings.cache.get_token_cache()
+
+    session = _create_fleet_session(settings)
+    msal_app = get_msal_app(
+        settings.app, token_cache, http_client=session, cache_settings=settings.cache
+    )
+
+    contexts = _create_fleet_contexts(
+        settings, token_cache, msal_app, session, settings.fleet.mailboxes or [None]
+    )
+
+    now = contexts[0].clock()
+
+    def fetch_mailbox(ctx: Context) -> MailboxState | Plan:
+        try:
+            return _fetch_mailbox_state(settings, ctx, now)
+        except Exception as e:
+            log.exception(f"Fetching state failed for mailbox {ctx.username}.")
+            return Plan(
+                mailbox=ctx.username,
+                action="failed",
+                reason="Failed to fetch mailbox state.",
+                error=str(e),
+            )
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=settings.fleet.max_workers, thread_name_prefix="mailbox"
+        ) as executor:
+            fetched = list(executor.map(fetch_mailbox, contexts))
+    finally:
+        session.close()
+
+        log.info("Saving token cache.")
+        settings.cache.put_token_cache(token_cache)
+
+    states = [item for item in fetched if isinstance(item, MailboxState)]
+
+    log.info(f"Planning changes for {len(states)} mailbox(es).")
+
+    with span("command.plan", mailboxes=len(states)):
+        planned = iter(plan_many(settings.absence, states, contexts[0].templates, now))
+
+    # Keep the failures in place.
+    plans = [item if isinstance(item, Plan) else next(planned) for item in fetched]
+
+    print(PLANS_ADAPTER.dump_json(plans, indent=2).decode())
+
+    return plans
+
+
+def _fetch_calendar_snapshot(
+    settings: SimulateSettings, ctx: Context, start: datetime, end: datetime
+) -> CalendarSnapshot:
+    """
+    Fetch the automatic replies and all absence events of a mailbox that runs over the given period may consider.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+        start (datetime): Start of the simulated period
+        end (datetime): End of the simulated period
+
+    Returns:
+        CalendarSnapshot: Snapshot of the mailbox
+    """
+    with span("command.fetch", mailbox=ctx.username):
+        _authenticate(settings, ctx)
+
+        _load_mailbox_settings(
+            settings,
+            ctx,
+            ctx.graph.get("/me/mailboxSettings", params=select("mailboxSettings")),
+        )
+
+        # Include events that only become relevant as adjacent events near the end of the period.
+        window_end = end + timedelta(
+            days=settings.absence.future_period_days + settings.absence.lookahead_days
+        )
+
         log.info(
-            "Automatic replies are always enabled. Not scheduling for vacation period."
+            f"Querying absence events from {start.isoformat()} to {window_end.isoformat()}."
         )
-    elif auto_replies_active == "scheduled":
-        if scheduled_end_date_time < now:
-            # Current scheduled period has already ended.
-            should_update = True
-            log.info(
-                "Automatic replies are scheduled but the current period has already ended. Scheduling for vacation period."
+
+        events = list(
+            ctx.graph.iter_collection(
+                "/me/calendar/calendarView",
+                params={
+                    "startDateTime": start.isoformat(),
+                    "endDateTime": window_end.isoformat(),
+                    "$filter": f"subject eq '{settings.absence.keyword}' and isAllDay eq true",
+                    "$orderby": "start/dateTime",
+                    **select("event"),
+                },
             )
-        elif (
-            vacation_start == scheduled_start_date_time
-            and vacation_end == scheduled_end_date_time
-        ):
-            render_args = {"start": vacation_start, "end": vacation_end}
-            internal_msg = env.from_string(
-                settings.absence.internal_reply_template.get_template()
-            ).render(**render_args)
-            external_msg = env.from_string(
-                settings.absence.external_reply_template.get_template()
-            ).render(**render_args)
-
-            if (
-                internal_msg_current != internal_msg
-                or external_msg_current != external_msg
-            ):
-                should_update = True
-                log.info(
-                    "Automatic replies are already scheduled for the vacation period, but messages are different. Updating messages."
-                )
-            else:
-                should_update = False
-                log.info(
-                    "Automatic replies are already scheduled for the vacation period with the same messages. Not updating."
-                )
-        elif scheduled_start_date_time < vacation_start:
-            # Current scheduled period starts before vacation period.
-            if scheduled_end_date_time < vacation_start:
-                # Scheduled period ends before vacation period starts.
-
-                # CHeck if difference between scheduled end and vacation start is less than MAX_DELTA_HOURS
-                if (
-                    vacation_start - scheduled_end_date_time
-                ).total_seconds() / 3600 < settings.absence.max_delta_hours:
-                    should_update = True
-                    log.info(
-                        f"Automatic replies are scheduled but end before vacation period starts. However, the difference is less than {settings.absence.max_delta_hours} hours. Scheduling current and vacation period."
-                    )
-                    # Determine beginning and end of overlapping period.
-                    vacation_start = min(vacation_start, scheduled_start_date_time)
-                    vacation_end = max(vacation_end, scheduled_end_date_time)
-                else:
-                    should_update = False
-                    log.info(
-                        "Automatic replies are scheduled prior to beginning of vacation period."
-                    )
-            else:
-                # Scheduled period overlaps with vacation period.
-                should_update = True
-                log.info(
-                    "Automatic replies are scheduled but overlap with the vacation period. Scheduling current and vacation period."
+        )
+
+        log.info(f"Found {len(events)} absence event(s).")
+
+        return CalendarSnapshot(
+            mailbox=ctx.username,
+            timezone=ctx.mailbox_timezone.key,
+            auto_reply_settings=ctx.mailbox_settings_response.json().get(
+                "automaticRepliesSetting", {}
+            ),
+            events=events,
+        )
+
+
+def _get_calendar_snapshots(
+    settings: SimulateSettings, start: datetime, end: datetime
+) -> list[CalendarSnapshot]:
+    """
+    Load the snapshots of all mailboxes from the snapshot file, or fetch them concurrently and store them there.
+    """
+    snapshot_file = settings.simulation.snapshot_file
+
+    if snapshot_file is not None and snapshot_file.exists():
+        log.info(f"Loading calendar snapshots from {snapshot_file}.")
+        return SNAPSHOTS_ADAPTER.validate_json(snapshot_file.read_bytes())
+
+    log.info("Initializing token cache.")
+    token_cache = settings.cache.get_token_cache()
+
+    session = _create_fleet_session(settings)
+    msal_app = get_msal_app(
+        settings.app, token_cache, http_client=session, cache_settings=settings.cache
+    )
+
+    contexts = _create_fleet_contexts(
+        settings, token_cache, msal_app, session, settings.fleet.mailboxes or [None]
+    )
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=settings.fleet.max_workers, thread_name_prefix="mailbox"
+        ) as executor:
+            snapshots = list(
+                executor.map(
+                    lambda ctx: _fetch_calendar_snapshot(settings, ctx, start, end),
+                    contexts,
                 )
-                # Determine beginning and end of overlapping period.
-                vacation_start = min(vacation_start, scheduled_start_date_time)
-                vacation_end = max(vacation_end, scheduled_end_date_time)
-        else:
-            # Update automatic replies if the vacation period starts before the current scheduled period.
-            should_update = True
-            log.info(
-                "Automatic replies are scheduled but the vacation period starts before the current scheduled period. Scheduling for vacation period."
             )
+    finally:
+        session.close()
 
-    if should_update:
-        # Ensure internal and external messages are available.
-        if internal_msg is None or external_msg is None:
-            render_args = {"start": vacation_start, "end": vacation_end}
-            internal_msg = env.from_string(
-                settings.absence.internal_reply_template.get_template()
-            ).render(**render_args)
-            external_msg = env.from_string(
-                settings.absence.external_reply_template.get_template()
-            ).render(**render_args)
+        log.info("Saving token cache.")
+        settings.cache.put_token_cache(token_cache)
 
-        log.info(
-            f"Scheduling automatic replies for vacation period from {vacation_start} to {vacation_end}."
+    if snapshot_file is not None:
+        log.info(f"Writing calendar snapshots to {snapshot_file}.")
+        snapshot_file.write_bytes(SNAPSHOTS_ADAPTER.dump_json(snapshots))
+
+    return snapshots
+
+
+def simulate(settings: SimulateSettings) -> list[SimulatedChange]:
+    """
+    Simulate runs at each tick over a range of dates, and print the changes to the automatic replies they would have
+    made as JSON.
+
+    The absence events and current automatic replies of all configured mailboxes, or of the default mailbox, are
+    fetched once, or loaded from a snapshot file. Runs are then simulated with the same decision logic as the run
+    command, with a simulated clock in place of the current time. Nothing is updated.
+
+    Args:
+        settings (Settings): Application configuration
+
+    Returns:
+        list[SimulatedChange]: Changes to the automatic replies, by mailbox, then by time
+    """
+    start = datetime.combine(
+        settings.simulation.start or _get_current_time().date(),
+        datetime.min.time(),
+        UTC,
+    )
+    end = start + timedelta(days=settings.simulation.days)
+    tick = timedelta(minutes=settings.simulation.tick_minutes)
+
+    snapshots = _get_calendar_snapshots(settings, start, end)
+
+    log.info(
+        f"Simulating runs every {settings.simulation.tick_minutes} minutes from {start.isoformat()} to {end.isoformat()} for {len(snapshots)} mailbox(es)."
+    )
+
+    with span("command.simulate", mailboxes=len(snapshots)) as s:
+        changes = simulate_runs(
+            settings.absence,
+            snapshots,
+            start,
+            end,
+            tick,
         )
 
-        log.debug(f"Internal absence message: {internal_msg}")
-        log.debug(f"External absence message: {external_msg}")
+    log.info(
+        f"Simulation complete in {s.duration:.3f} seconds. {len(changes)} change(s) to automatic replies."
+    )
 
-        # Prepare the update payload.
-        update_payload = {
-            "automaticRepliesSetting": {
-                "status": "scheduled",
-                "scheduledStartDateTime": {
-                    "dateTime": vacation_start.astimezone(ctx.mailbox_timezone)
-                    .replace(tzinfo=None)
-                    .isoformat(),
-                    "timeZone": ctx.mailbox_timezone.key,
-                },
-                "scheduledEndDateTime": {
-                    "dateTime": vacation_end.astimezone(ctx.mailbox_timezone)
-                    .replace(tzinfo=None)
-                    .isoformat(),
-                    "timeZone": ctx.mailbox_timezone.key,
-                },
-                "internalReplyMessage": internal_msg,
-                "externalReplyMessage": external_msg,
-                # Send reply to all external recipients.
-                "externalAudience": "all",
-            }
-        }
-
-        # Update automatic replies
-        if not settings.dry_run:
-            update_response = requests.patch(
-                f"{settings.app.base_url}/me/mailboxSettings",
-                headers=ctx.headers,
-                json=update_payload,
+    print(CHANGES_ADAPTER.dump_json(changes, indent=2).decode())
+
+    return changes
+
+
+async def _authenticate_async(settings: InitSettings, ctx: Context) -> None:
+    """
+    Acquire an access token and set up the async Graph client to use it.
+
+    MSAL and the caches only offer blocking interfaces, so they are used from worker threads.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context, with an async Graph client
+    """
+    # Only load and save the token cache here if it is not shared with other runs.
+    owns_token_cache = ctx.token_cache is None
+
+    if owns_token_cache:
+        log.info("Initializing token cache.")
+        ctx.token_cache = await asyncio.to_thread(settings.cache.get_token_cache)
+
+    # MSAL needs a blocking HTTP session. Unless the caller shares an application, it is only used for this run.
+    msal_app = ctx.msal_app
+    session = None
+    if msal_app is None:
+        session = create_session(settings.graph)
+        msal_app = await asyncio.to_thread(
+            get_msal_app,
+            settings.app,
+            ctx.token_cache,
+            http_client=session,
+            cache_settings=settings.cache,
+        )
+
+    try:
+        log.info("Getting access token.")
+        access_token = await asyncio.to_thread(
+            get_access_token,
+            settings.app,
+            ctx.token_cache,
+            msal_app=msal_app,
+            username=ctx.username,
+            interactive=ctx.interactive,
+        )
+    finally:
+        if session is not None:
+            session.close()
+
+    if owns_token_cache:
+        log.info("Saving token cache.")
+        await asyncio.to_thread(settings.cache.put_token_cache, ctx.token_cache)
+
+    # Authenticate subsequent API requests.
+    ctx.graph.set_access_token(access_token)
+
+
+async def init_async(settings: InitSettings, ctx: Context | None = None):
+    """
+    Initialize the application by acquiring and caching an access token, using asyncio. See init.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+    """
+    if ctx is None:
+        ctx = Context()
+
+    owns_graph = ctx.graph is None
+    if owns_graph:
+        ctx.graph = AsyncGraphClient(settings.graph, settings.app.base_url)
+
+    try:
+        with span("command.init", mailbox=ctx.username):
+            await _authenticate_async(settings, ctx)
+
+            # Retrieve mailbox settings
+            _load_mailbox_settings(
+                settings,
+                ctx,
+                await ctx.graph.get(
+                    "/me/mailboxSettings", params=select("mailboxSettings")
+                ),
             )
+    finally:
+        if owns_graph:
+            await ctx.graph.close()
+
+
+async def run_async(settings: RunSettings, ctx: Context | None = None) -> MailboxResult:
+    """
+    Manage absence automatic replies using asyncio. See run.
+
+    Makes the same decisions as run, but sends all requests to the Microsoft Graph API through an async client, so
+    that a single event loop can process many mailboxes concurrently.
+
+    Args:
+        settings (Settings): Application configuration
+        ctx (Context): Execution context
+
+    Returns:
+        MailboxResult: Outcome of the run
+    """
+    if ctx is None:
+        ctx = Context()
+
+    owns_graph = ctx.graph is None
+    if owns_graph:
+        ctx.graph = AsyncGraphClient(settings.graph, settings.app.base_url)
+
+    try:
+        with span("command.run", mailbox=ctx.username) as s:
+            await _authenticate_async(settings, ctx)
+
+            now = ctx.clock()
+
+            bytes_sent = ctx.graph.bytes_sent
+
+            result = await (
+                _run_delta_async(settings, ctx, now)
+                if settings.delta_sync
+                else _run_async(settings, ctx, now)
+            )
+
+            result.bytes_sent = ctx.graph.bytes_sent - bytes_sent
+            log.info(f"Sent {result.bytes_sent} bytes of request data.")
+
+            s.attributes["status"] = result.status
+    finally:
+        if owns_graph:
+            await ctx.graph.close()
+
+    return result
 
-            if update_response.status_code == 200:
-                log.info("Successfully updated automatic replies for vacation period.")
-            else:
-                log.error(
-                    f"Failed to update automatic replies: {update_response.status_code} {update_response.text}"
+
+async def _run_delta_async(
+    settings: RunSettings, ctx: Context, now: datetime
+) -> MailboxResult:
+    """
+    Run for an authenticated mailbox using asyncio, unless neither the calendar nor the mailbox settings changed since
+    the last run. See _run_delta.
+    """
+    delta_state, changed = await sync_calendar_async(
+        settings, ctx.graph, ctx.username, now
+    )
+
+    if not changed and await is_outcome_valid_async(
+        settings, ctx.graph, delta_state, now
+    ):
+        log.info(
+            f"No calendar changes since last run and outcome valid until {delta_state.valid_until}. Skipping run."
+        )
+        await asyncio.to_thread(_put_delta_state, settings, ctx, delta_state)
+        return MailboxResult(mailbox=ctx.username, status="unchanged")
+
+    result = await _run_async(settings, ctx, now)
+
+    _set_outcome(settings, ctx, delta_state, result, now)
+    await asyncio.to_thread(_put_delta_state, settings, ctx, delta_state)
+
+    return result
+
+
+async def _run_async(
+    settings: RunSettings, ctx: Context, now: datetime
+) -> MailboxResult:
+    """
+    Detect upcoming absence events and update the automatic replies of an authenticated mailbox accordingly, using
+    asyncio. See _run.
+
+    Evaluation runs in a worker thread, since it may access the fingerprint cache and render templates.
+    """
+    # Create template registry, if not shared by the caller.
+    if ctx.templates is None:
+        ctx.templates = TemplateRegistry(settings.absence)
+
+    # Retrieve mailbox settings and query calendar for next absence event in a single batch request.
+    async with ctx.graph.batch() as batch:
+        mailbox_settings_response = batch.get(
+            "/me/mailboxSettings", params=select("mailboxSettings")
+        )
+        calendar_view_response = batch.get(
+            "/me/calendar/calendarView", params=_get_calendar_view_params(settings, now)
+        )
+
+    _load_mailbox_settings(settings, ctx, mailbox_settings_response)
+
+    next_vacation = _get_next_absence_event(ctx, calendar_view_response)
+    if not next_vacation:
+        return MailboxResult(mailbox=ctx.username, status="no_absence")
+
+    # Find adjacent vacation events
+    log.info("Finding adjacent/overlapping vacation events...")
+    adjacent_events = await get_adjacent_events_async(
+        ctx.mailbox_timezone, settings, ctx.graph, next_vacation
+    )
+
+    evaluation = await asyncio.to_thread(
+        _evaluate, settings, ctx, next_vacation, adjacent_events, now
+    )
+    if evaluation.skipped:
+        return evaluation.result
+
+    # Update automatic replies
+    if evaluation.changes and not settings.dry_run:
+        _apply_update_response(
+            evaluation.result,
+            await ctx.graph.patch(
+                "/me/mailboxSettings",
+                json={"automaticRepliesSetting": evaluation.changes},
+            ),
+        )
+
+    await asyncio.to_thread(_finish_run, settings, ctx, evaluation, now)
+
+    return evaluation.result
+
+
+async def run_fleet_async(settings: RunSettings) -> list[MailboxResult]:
+    """
+    Manage absence automatic replies for all configured mailboxes concurrently, using asyncio. See run_fleet.
+
+    All mailboxes are processed as tasks on the running event loop, at most the configured number of workers at a
+    time, sharing a single async HTTP client. This scales to many more concurrent mailboxes than a thread pool.
+
+    Args:
+        settings (Settings): Application configuration
+
+    Returns:
+        list[MailboxResult]: Outcome for each mailbox, in the configured order
+    """
+    log.info("Initializing token cache.")
+    token_cache = await asyncio.to_thread(settings.cache.get_token_cache)
+
+    # Requests to the identity provider are sent by MSAL, which needs a blocking HTTP session.
+    session = create_session(settings.graph)
+    msal_app = await asyncio.to_thread(
+        get_msal_app, settings.app, token_cache, session, settings.cache
+    )
+
+    client = create_async_client(
+        settings.graph, max(settings.graph.pool_size, settings.fleet.max_workers)
+    )
+    limiter = RateLimiter(settings.graph.rate_limit)
+    run_deadline = RunDeadline(settings.graph.run_deadline_seconds)
+    templates = TemplateRegistry(settings.absence)
+
+    contexts = [
+        Context(
+            username=mailbox,
+            interactive=False,
+            token_cache=token_cache,
+            msal_app=msal_app,
+            graph=AsyncGraphClient(
+                settings.graph, settings.app.base_url, client, limiter, run_deadline
+            ),
+            templates=templates,
+            defer_delta_state=True,
+        )
+        for mailbox in settings.fleet.mailboxes
+    ]
+
+    log.info(
+        f"Processing {len(contexts)} mailbox(es) with up to {settings.fleet.max_workers} concurrent tasks."
+    )
+
+    semaphore = asyncio.Semaphore(settings.fleet.max_workers)
+
+    async def run_mailbox(ctx: Context) -> MailboxResult:
+        async with semaphore:
+            try:
+                return await run_async(settings, ctx)
+            except Exception as e:
+                log.exception(f"Run failed for mailbox {ctx.username}.")
+                return MailboxResult(
+                    mailbox=ctx.username, status="failed", error=str(e)
                 )
-        else:
-            log.info("Dry run mode enabled. Automatic replies not updated.")
 
-    log.info("Run complete.")
+    try:
+        results = await asyncio.gather(*(run_mailbox(ctx) for ctx in contexts))
+
+        await asyncio.to_thread(_put_deferred_delta_states, settings, contexts)
+    finally:
+        await client.aclose()
+        session.close()
+
+        log.info("Saving token cache.")
+        await asyncio.to_thread(settings.cache.put_token_cache, token_cache)
+
+    _log_fleet_summary(results)
+
+    return results
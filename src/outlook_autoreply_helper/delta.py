@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, tzinfo
+
+import requests
+
+from .fingerprint import get_mailbox_hash, get_settings_hash
+from .graph import AsyncGraphClient, GraphClient, select
+from .settings import DeltaCache, DeltaState, RunSettings
+from .util import get_datetime
+
+log = logging.getLogger(__name__)
+
+# Serializes read-modify-write access to the delta cache when processing multiple mailboxes concurrently.
+_delta_cache_lock = threading.Lock()
+
+# Age after which the calendar window of the delta query is re-established.
+WINDOW_MAX_AGE = timedelta(days=1)
+
+# Status codes of responses to delta queries with an expired delta link.
+EXPIRED_STATUS_CODES = (400, 404, 410)
+
+
+def _get_mailbox_key(username: str | None) -> str:
+    """Return the key of a mailbox in the delta cache."""
+    return username or ""
+
+
+def _is_absence_event(settings: RunSettings, event: dict) -> bool:
+    """
+    Check whether a calendar event is an absence event, mirroring the filter of the calendar view queries.
+    """
+    return (
+        event.get("isAllDay") is True
+        and (event.get("subject") or "").casefold()
+        == settings.absence.keyword.casefold()
+    )
+
+
+def _get_state(
+    settings: RunSettings, username: str | None, now: datetime
+) -> DeltaState | None:
+    """
+    Retrieve the synchronization state of the last run for a mailbox, unless its calendar window is outdated.
+    """
+    with _delta_cache_lock:
+        delta_cache = settings.cache.get_delta_cache()
+
+    state = (
+        delta_cache.mailboxes.get(_get_mailbox_key(username)) if delta_cache else None
+    )
+
+    if state is not None and (
+        state.keyword != settings.absence.keyword
+        or now - state.window_start >= WINDOW_MAX_AGE
+    ):
+        log.info("Calendar window of delta query is outdated.")
+        state = None
+
+    if state is not None:
+        log.info("Querying calendar changes since last run.")
+
+    return state
+
+
+def _create_state(settings: RunSettings, now: datetime) -> tuple[DeltaState, dict]:
+    """
+    Create the synchronization state for a new delta query.
+
+    Returns:
+        tuple[DeltaState, dict]: The state, without delta link yet, and the query parameters of the new delta query
+    """
+    window_start = now
+    window_end = now + timedelta(
+        days=settings.absence.future_period_days + settings.absence.lookahead_days
+    )
+
+    log.info(
+        f"Starting delta query for calendar window from {window_start.isoformat()} to {window_end.isoformat()}."
+    )
+
+    state = DeltaState(
+        delta_link="",
+        keyword=settings.absence.keyword,
+        window_start=window_start,
+        window_end=window_end,
+    )
+    params = {
+        "startDateTime": window_start.isoformat(),
+        "endDateTime": window_end.isoformat(),
+    }
+
+    return state, params
+
+
+def _apply_changes(
+    settings: RunSettings,
+    state: DeltaState,
+    items: list[dict],
+    delta_link: str,
+    changed: bool,
+) -> tuple[DeltaState, bool]:
+    """
+    Apply the changes returned by a delta query to the absence events of a synchronization state.
+    """
+    state.delta_link = delta_link
+
+    # Apply changes to the absence events. Changes to other events are irrelevant.
+    for item in items:
+        if "@removed" in item or not _is_absence_event(settings, item):
+            if state.events.pop(item["id"], None) is not None:
+                changed = True
+        else:
+            event = {"start": item["start"], "end": item["end"]}
+            if state.events.get(item["id"]) != event:
+                state.events[item["id"]] = event
+                changed = True
+
+    log.info(
+        f"Received {len(items)} calendar change(s). Absence events changed: {changed}."
+    )
+
+    return state, changed
+
+
+def sync_calendar(
+    settings: RunSettings, graph: GraphClient, username: str | None, now: datetime
+) -> tuple[DeltaState, bool]:
+    """
+    Synchronize the absence events of a mailbox incrementally via a calendar view delta query.
+
+    Continues from the delta link of the last run, if available. Otherwise, or if the calendar window is outdated,
+    starts a new delta query over a window covering the future period and the look-ahead horizon.
+
+    Args:
+        settings (Settings): Application settings
+        graph (GraphClient): Microsoft Graph API client
+        username (str | None): Mailbox to synchronize
+        now (datetime): Current time
+
+    Returns:
+        tuple[DeltaState, bool]: The updated state, and whether any absence events changed since the last run
+    """
+    state = _get_state(settings, username, now)
+
+    if state is not None:
+        try:
+            items, delta_link = graph.get_delta(state.delta_link)
+            return _apply_changes(settings, state, items, delta_link, False)
+        except requests.HTTPError as e:
+            # The delta link may have expired.
+            if e.response is None or e.response.status_code not in EXPIRED_STATUS_CODES:
+                raise
+            log.warning(f"Delta link no longer valid: {e}")
+
+    state, params = _create_state(settings, now)
+    items, delta_link = graph.get_delta(
+        "/me/calendar/calendarView/delta", params=params
+    )
+    return _apply_changes(settings, state, items, delta_link, True)
+
+
+async def sync_calendar_async(
+    settings: RunSettings,
+    graph: AsyncGraphClient,
+    username: str | None,
+    now: datetime,
+) -> tuple[DeltaState, bool]:
+    """
+    Synchronize the absence events of a mailbox incrementally, using an async client. See sync_calendar.
+    """
+    import httpx
+
+    state = await asyncio.to_thread(_get_state, settings, username, now)
+
+    if state is not None:
+        try:
+            items, delta_link = await graph.get_delta(state.delta_link)
+            return _apply_changes(settings, state, items, delta_link, False)
+        except httpx.HTTPStatusError as e:
+            # The delta link may have expired.
+            if e.response.status_code not in EXPIRED_STATUS_CODES:
+                raise
+            log.warning(f"Delta link no longer valid: {e}")
+
+    state, params = _create_state(settings, now)
+    items, delta_link = await graph.get_delta(
+        "/me/calendar/calendarView/delta", params=params
+    )
+    return _apply_changes(settings, state, items, delta_link, True)
+
+
+def get_valid_until(
+    settings: RunSettings,
+    state: DeltaState,
+    mailbox_timezone: tzinfo,
+    auto_reply_settings: dict,
+    end: datetime | None,
+    now: datetime,
+) -> datetime:
+    """
+    Determine until when the outcome of a run remains valid, provided that the calendar does not change.
+
+    The outcome may change once the absence period or the scheduled automatic replies end, or once another absence
+    event enters the future period.
+
+    Args:
+        settings (Settings): Application settings
+        state (DeltaState): Synchronization state with the current absence events
+        mailbox_timezone (tzinfo): User's mailbox timezone
+        auto_reply_settings (dict): Current automatic replies settings of the mailbox
+        end (datetime | None): End of the absence period determined by the run, if any
+        now (datetime): Current time
+
+    Returns:
+        datetime: Time until which the outcome remains valid
+    """
+    future_period = timedelta(days=settings.absence.future_period_days)
+
+    # The window is re-established at the latest after its maximum age.
+    candidates = [state.window_start + WINDOW_MAX_AGE]
+
+    if end is not None:
+        candidates.append(end)
+
+    if auto_reply_settings.get("status") == "scheduled":
+        candidates.append(get_datetime(auto_reply_settings["scheduledEndDateTime"]))
+
+    for event in state.events.values():
+        event_start = get_datetime(event["start"]).replace(tzinfo=mailbox_timezone)
+        if event_start - future_period > now:
+            candidates.append(event_start - future_period)
+
+    return min(candidates)
+
+
+def is_outcome_valid(
+    settings: RunSettings, graph: GraphClient, state: DeltaState, now: datetime
+) -> bool:
+    """
+    Check whether the outcome of the last run is still valid, provided that the calendar did not change.
+
+    The outcome expires at the end of its validity, and no longer applies once the templates or absence settings
+    changed, or once the mailbox settings changed, e.g. if the automatic replies were disabled outside the
+    application. The latter is checked with a single small request.
+
+    Args:
+        settings (Settings): Application settings
+        graph (GraphClient): Microsoft Graph API client
+        state (DeltaState): Synchronization state with the outcome of the last run
+        now (datetime): Current time
+
+    Returns:
+        bool: Whether the outcome of the last run is still valid
+    """
+    if not _is_outcome_current(settings, state, now):
+        return False
+
+    response = graph.get("/me/mailboxSettings", params=select("mailboxSettings"))
+    return _is_mailbox_unchanged(state, response)
+
+
+async def is_outcome_valid_async(
+    settings: RunSettings, graph: AsyncGraphClient, state: DeltaState, now: datetime
+) -> bool:
+    """
+    Check whether the outcome of the last run is still valid, using an async client. See is_outcome_valid.
+    """
+    if not _is_outcome_current(settings, state, now):
+        return False
+
+    response = await graph.get("/me/mailboxSettings", params=select("mailboxSettings"))
+    return _is_mailbox_unchanged(state, response)
+
+
+def _is_outcome_current(
+    settings: RunSettings, state: DeltaState, now: datetime
+) -> bool:
+    """
+    Check whether the outcome of the last run has not expired yet, and is based on the current templates and absence
+    settings.
+    """
+    if state.valid_until is None or state.mailbox is None or now >= state.valid_until:
+        return False
+
+    if state.configuration != get_settings_hash(settings):
+        log.info("Templates or absence settings changed since last run.")
+        return False
+
+    return True
+
+
+def _is_mailbox_unchanged(state: DeltaState, response) -> bool:
+    """
+    Check whether the mailbox settings in the given response match those the outcome of the last run is based on.
+    """
+    response.raise_for_status()
+
+    if get_mailbox_hash(response.json()) != state.mailbox:
+        log.info("Mailbox settings changed since last run.")
+        return False
+
+    return True
+
+
+def put_delta_state(
+    settings: RunSettings, username: str | None, state: DeltaState
+) -> None:
+    """
+    Store the synchronization state of a mailbox in the delta cache.
+
+    Args:
+        settings (Settings): Application settings
+        username (str | None): Mailbox of the state
+        state (DeltaState): Synchronization state
+    """
+    put_delta_states(settings, {username: state})
+
+
+def put_delta_states(
+    settings: RunSettings, states: dict[str | None, DeltaState]
+) -> None:
+    """
+    Store the synchronization states of several mailboxes in the delta cache at once.
+
+    Nothing is written if all states are unchanged.
+
+    Args:
+        settings (Settings): Application settings
+        states (dict[str | None, DeltaState]): Synchronization states, by mailbox
+    """
+    states = {_get_mailbox_key(username): state for username, state in states.items()}
+
+    with _delta_cache_lock:
+        delta_cache = settings.cache.get_delta_cache() or DeltaCache()
+
+        if all(
+            delta_cache.mailboxes.get(key) == state for key, state in states.items()
+        ):
+            log.debug("Delta states did not change. Not updating.")
+            return
+
+        delta_cache.mailboxes.update(states)
+        settings.cache.put_delta_cache(delta_cache)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from .settings import Fingerprint, FingerprintCache, RunSettings
+from .util import get_datetime
+
+log = logging.getLogger(__name__)
+
+# Serializes read-modify-write access to the fingerprint cache when processing multiple mailboxes concurrently.
+_fingerprint_cache_lock = threading.Lock()
+
+# Age after which a fingerprint expires, so that the full logic runs at least once per period.
+FINGERPRINT_MAX_AGE = timedelta(days=1)
+
+
+def _get_mailbox_key(username: str | None) -> str:
+    """Return the key of a mailbox in the fingerprint cache."""
+    return username or ""
+
+
+def _get_hash(value) -> str:
+    """Return a hash of the canonical JSON representation of the given value."""
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def get_mailbox_hash(mailbox_settings: dict) -> str:
+    """
+    Return a hash of the parts of the mailbox settings a run depends on.
+
+    Args:
+        mailbox_settings (dict): Mailbox settings
+
+    Returns:
+        str: Hash of the automatic replies settings and time zone
+    """
+    return _get_hash(
+        {
+            "automaticRepliesSetting": mailbox_settings.get("automaticRepliesSetting"),
+            "timeZone": mailbox_settings.get("timeZone"),
+        }
+    )
+
+
+def get_settings_hash(settings: RunSettings) -> str:
+    """
+    Return a hash of the templates and absence settings a run depends on.
+
+    Args:
+        settings (Settings): Application settings
+
+    Returns:
+        str: Hash of the template versions and absence settings
+    """
+    return _get_hash(
+        {
+            "templates": [
+                settings.absence.internal_reply_template.get_version(),
+                settings.absence.external_reply_template.get_version(),
+            ],
+            "settings": settings.absence.model_dump(
+                mode="json",
+                include={
+                    "future_period_days",
+                    "keyword",
+                    "max_delta_hours",
+                    "lookahead_days",
+                    "date_format",
+                },
+            ),
+        }
+    )
+
+
+def get_inputs_hash(
+    settings: RunSettings, events: list[dict], mailbox_settings: dict
+) -> str:
+    """
+    Return a hash of all inputs of a run.
+
+    Args:
+        settings (Settings): Application settings
+        events (list[dict]): Absence events that make up the absence period
+        mailbox_settings (dict): Current mailbox settings
+
+    Returns:
+        str: Hash of the absence events, templates, absence settings and mailbox settings
+    """
+    return _get_hash(
+        {
+            "events": sorted([event["id"], event.get("changeKey")] for event in events),
+            "settings": get_settings_hash(settings),
+            "mailbox": get_mailbox_hash(mailbox_settings),
+        }
+    )
+
+
+def get_fingerprint(settings: RunSettings, username: str | None) -> Fingerprint | None:
+    """
+    Retrieve the fingerprint of the last run for a mailbox, if any.
+
+    Args:
+        settings (Settings): Application settings
+        username (str | None): Mailbox of the fingerprint
+
+    Returns:
+        Fingerprint | None: The fingerprint, or None if there is none
+    """
+    with _fingerprint_cache_lock:
+        fingerprint_cache = settings.cache.get_fingerprint_cache()
+
+    return (
+        fingerprint_cache.mailboxes.get(_get_mailbox_key(username))
+        if fingerprint_cache
+        else None
+    )
+
+
+def create_fingerprint(
+    inputs: str, mailbox_settings: dict, now: datetime
+) -> Fingerprint:
+    """
+    Create a fingerprint for a run that left the automatic replies unchanged.
+
+    The outcome of such a run only depends on the current time through the end of the scheduled automatic replies.
+    The fingerprint therefore expires then, and at the latest after its maximum age.
+
+    Args:
+        inputs (str): Hash of all inputs of the run
+        mailbox_settings (dict): Current mailbox settings
+        now (datetime): Current time
+
+    Returns:
+        Fingerprint: The fingerprint
+    """
+    candidates = [now + FINGERPRINT_MAX_AGE]
+
+    auto_reply_settings = mailbox_settings.get("automaticRepliesSetting", {})
+    if auto_reply_settings.get("status") == "scheduled":
+        scheduled_end = get_datetime(auto_reply_settings["scheduledEndDateTime"])
+        if scheduled_end > now:
+            candidates.append(scheduled_end)
+
+    return Fingerprint(inputs=inputs, valid_until=min(candidates))
+
+
+def put_fingerprint(
+    settings: RunSettings, username: str | None, fingerprint: Fingerprint | None
+) -> None:
+    """
+    Store the fingerprint of the last run for a mailbox in the fingerprint cache.
+
+    Args:
+        settings (Settings): Application settings
+        username (str | None): Mailbox of the fingerprint
+        fingerprint (Fingerprint | None): The fingerprint, or None to remove it
+    """
+    key = _get_mailbox_key(username)
+
+    with _fingerprint_cache_lock:
+        fingerprint_cache = settings.cache.get_fingerprint_cache() or FingerprintCache()
+
+        if fingerprint_cache.mailboxes.get(key) == fingerprint:
+            return
+
+        if fingerprint is None:
+            del fingerprint_cache.mailboxes[key]
+        else:
+            fingerprint_cache.mailboxes[key] = fingerprint
+
+        settings.cache.put_fingerprint_cache(fingerprint_cache)
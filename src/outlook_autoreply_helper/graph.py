@@ -0,0 +1,900 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Iterator
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .instrumentation import increment, span
+from .settings import GraphSettings
+
+# The async HTTP client is an optional dependency. Only import it when the asyncio engine is used.
+if TYPE_CHECKING:
+    import httpx
+
+log = logging.getLogger(__name__)
+
+# Fields used by the application, by resource type. Reads only request these fields, to keep responses small.
+FIELDS: dict[str, tuple[str, ...]] = {
+    "mailboxSettings": ("automaticRepliesSetting", "timeZone"),
+    "event": ("subject", "isAllDay", "start", "end", "changeKey"),
+}
+
+
+# Status codes of responses to throttled or temporarily failed requests, which are retried.
+RETRY_STATUS_CODES = frozenset({429, 503, 504})
+
+
+def select(resource: str) -> dict[str, str]:
+    """
+    Return the $select query parameter for reading a resource type.
+
+    Args:
+        resource (str): Resource type, as registered in FIELDS
+
+    Returns:
+        dict[str, str]: Query parameters selecting the fields used by the application
+    """
+    return {"$select": ",".join(FIELDS[resource])}
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter, safe to share between threads and asyncio tasks.
+
+    Allows bursts of up to one second worth of requests. When the API throttles requests, the limiter can be paused, so
+    that all clients sharing it back off together instead of each running into the limit on its own.
+    """
+
+    def __init__(self, rate: float):
+        """
+        Args:
+            rate (float): Maximum number of requests per second
+        """
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token from the bucket.
+
+        Returns:
+            float: Seconds to wait until the token is available and the limiter is not paused
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            # Reserve the token right away, so that waiting callers are served in turn.
+            self._tokens -= 1
+            delay = max(-self._tokens / self.rate, self._resume_at - now)
+
+        if delay > 0:
+            log.debug(f"Rate limited. Waiting {delay:.2f} seconds.")
+
+        return max(0.0, delay)
+
+    def acquire(self) -> None:
+        """Take a token from the bucket, waiting until it is available."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        """Take a token from the bucket, waiting asynchronously until it is available."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the given number of seconds."""
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+class RunDeadline:
+    """
+    Time after which no retries start within a run, safe to share between threads and asyncio tasks.
+
+    Bounds the time all retries of a run may take together, e.g. when the API throttles every mailbox of a fleet, in
+    addition to the deadline of each request.
+    """
+
+    def __init__(self, seconds: float):
+        """
+        Args:
+            seconds (float): Seconds after the start of a run after which no retry starts
+        """
+        self.seconds = seconds
+        self.start()
+
+    def start(self) -> None:
+        """Start a new run, allowing retries for the configured number of seconds from now."""
+        self.expires = time.monotonic() + self.seconds
+
+
+def get_retry_after(response: requests.Response | httpx.Response) -> float | None:
+    """
+    Return the number of seconds to wait before retrying, as requested by the Retry-After header of a response.
+
+    Args:
+        response (requests.Response | httpx.Response): The response
+
+    Returns:
+        float | None: Seconds to wait, or None if the header is missing or invalid
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(
+            0.0,
+            (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(),
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def create_session(
+    settings: GraphSettings, pool_size: int | None = None
+) -> requests.Session:
+    """
+    Create an HTTP session with a keep-alive connection pool.
+
+    Args:
+        settings (GraphSettings): Graph client settings
+        pool_size (int | None): Number of connections to keep per host. Defaults to the configured pool size.
+
+    Returns:
+        requests.Session: The HTTP session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size or settings.pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def create_async_client(
+    settings: GraphSettings, pool_size: int | None = None
+) -> httpx.AsyncClient:
+    """
+    Create an async HTTP client with a keep-alive connection pool.
+
+    Args:
+        settings (GraphSettings): Graph client settings
+        pool_size (int | None): Maximum number of connections. Defaults to the configured pool size.
+
+    Returns:
+        httpx.AsyncClient: The HTTP client
+
+    Raises:
+        RuntimeError: If the async HTTP client is not installed
+    """
+    try:
+        import httpx
+    except ImportError as e:
+        raise RuntimeError(
+            "The asyncio engine requires the 'async' extra: pip install outlook-autoreply-helper[async]"
+        ) from e
+
+    pool_size = pool_size or settings.pool_size
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        ),
+        timeout=httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout),
+    )
+
+
+class _BaseGraphClient:
+    """
+    Functionality shared by the blocking and the async client for the Microsoft Graph API.
+    """
+
+    def __init__(
+        self,
+        settings: GraphSettings,
+        base_url: str,
+        limiter: RateLimiter | None,
+        run_deadline: RunDeadline | None,
+    ):
+        self.settings = settings
+        self.run_deadline = (
+            run_deadline
+            if run_deadline is not None
+            else RunDeadline(settings.run_deadline_seconds)
+        )
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (settings.connect_timeout, settings.read_timeout)
+        self.page_size = settings.page_size
+        self.limiters = [
+            limiter if limiter is not None else RateLimiter(settings.rate_limit),
+            RateLimiter(settings.mailbox_rate_limit),
+        ]
+        self.headers: dict[str, str] = {}
+        self.authorization: Callable[[], str] | None = None
+        self.bytes_sent = 0
+
+    def set_access_token(self, access_token: str) -> None:
+        """Use the given access token for all subsequent requests."""
+        self.headers["Authorization"] = f"Bearer {access_token}"
+
+    def set_authorization(self, authorization: Callable[[], str]) -> None:
+        """Determine the Authorization header of each subsequent request with the given function."""
+        self.authorization = authorization
+
+    def get_headers(self, headers: dict[str, str] | None) -> dict[str, str]:
+        """Return the headers of a request, i.e. the default headers, updated with the given ones."""
+        headers = {**self.headers, **(headers or {})}
+        if self.authorization is not None:
+            headers["Authorization"] = self.authorization()
+        return headers
+
+    def url(self, path: str) -> str:
+        """Return the absolute URL for an API path. Absolute URLs are returned unchanged."""
+        if path.startswith("https://") or path.startswith("http://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def _count_bytes_sent(self, body: str | bytes | None) -> None:
+        """Add the size of a request body to the number of bytes sent."""
+        if body:
+            size = len(body.encode("utf-8") if isinstance(body, str) else body)
+            self.bytes_sent += size
+            increment("graph.bytes_sent", size)
+
+    def get_retry_delay(
+        self,
+        attempt: int,
+        deadline: float,
+        reason: str,
+        response: requests.Response | httpx.Response | None = None,
+    ) -> float | None:
+        """
+        Determine how long to wait before retrying a failed request, unless retries are exhausted.
+
+        Waits as long as the response asks via Retry-After, or else for an exponentially growing delay with full jitter.
+        If the request was throttled, all clients sharing the rate limiter pause for that time, too. No retry starts after
+        the deadline of the request or of the run.
+
+        Args:
+            attempt (int): Number of the failed attempt, starting at 0
+            deadline (float): Monotonic time after which no retry of the request starts
+            reason (str): Reason of the failure, for logging
+            response (requests.Response | httpx.Response | None): Response of the failed attempt, if any
+
+        Returns:
+            float | None: Seconds to wait before retrying, or None to not retry
+        """
+        if attempt >= self.settings.max_retries:
+            return None
+
+        delay = get_retry_after(response) if response is not None else None
+        if delay is None:
+            delay = random.uniform(
+                0,
+                min(
+                    self.settings.max_backoff_seconds,
+                    self.settings.backoff_seconds * 2**attempt,
+                ),
+            )
+
+        if time.monotonic() + delay > deadline:
+            log.warning(f"Not retrying after {reason}, deadline would be exceeded.")
+            return None
+
+        if time.monotonic() + delay > self.run_deadline.expires:
+            log.warning(
+                f"Not retrying after {reason}, deadline of the run would be exceeded."
+            )
+            increment("graph.run_deadline_exceeded")
+            return None
+
+        if response is not None and response.status_code == 429:
+            increment("graph.throttled")
+            for limiter in self.limiters:
+                limiter.pause(delay)
+
+        log.warning(f"Retrying after {reason} in {delay:.1f} seconds.")
+        increment("graph.retries")
+
+        return delay
+
+
+class GraphClient(_BaseGraphClient):
+    """
+    Client for the Microsoft Graph API.
+
+    Sends all requests through a pooled HTTP session, so that connections to the API are reused between requests. The
+    session may be shared between several clients, e.g. one per mailbox, each with its own default headers.
+
+    Throttled requests, temporary server errors and connection failures are retried as configured in the settings.
+    All requests the application sends are idempotent, so this is safe for all methods. Requests pass through a rate
+    limiter that may be shared between clients, and through one of the client's own, since each client serves a single
+    mailbox.
+
+    Keeps count of the number of request body bytes sent by the client in bytes_sent.
+    """
+
+    def __init__(
+        self,
+        settings: GraphSettings,
+        base_url: str,
+        session: requests.Session | None = None,
+        limiter: RateLimiter | None = None,
+        run_deadline: RunDeadline | None = None,
+    ):
+        """
+        Args:
+            settings (GraphSettings): Graph client settings
+            base_url (str): Base URL of the Microsoft Graph API
+            session (requests.Session | None): HTTP session to use. A new session is created if not given.
+            limiter (RateLimiter | None): Rate limiter shared with other clients. A new one is created if not given.
+            run_deadline (RunDeadline | None): Deadline of the run shared with other clients. A new one, starting now, is
+                created if not given.
+        """
+        super().__init__(settings, base_url, limiter, run_deadline)
+        self.session = session if session is not None else create_session(settings)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request to the Microsoft Graph API.
+
+        Args:
+            method (str): HTTP method
+            path (str): API path relative to the base URL, e.g. /me/mailboxSettings, or an absolute URL
+            **kwargs: Additional arguments for requests.Session.request
+
+        Returns:
+            requests.Response: The response
+        """
+        headers = self.get_headers(kwargs.pop("headers", None))
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        deadline = time.monotonic() + self.settings.deadline_seconds
+
+        for attempt in range(self.settings.max_retries + 1):
+            for limiter in self.limiters:
+                limiter.acquire()
+
+            try:
+                with span("graph.request", method=method, path=urlsplit(url).path) as s:
+                    response = self.session.request(
+                        method, url, headers=headers, **kwargs
+                    )
+                    s.attributes["status"] = response.status_code
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self.wait_for_retry(attempt, deadline, type(e).__name__):
+                    raise
+                continue
+
+            self._count_bytes_sent(
+                response.request.body if response.request is not None else None
+            )
+
+            if (
+                response.status_code not in RETRY_STATUS_CODES
+                or not self.wait_for_retry(
+                    attempt, deadline, f"HTTP {response.status_code}", response
+                )
+            ):
+                return response
+
+        return response
+
+    def wait_for_retry(
+        self,
+        attempt: int,
+        deadline: float,
+        reason: str,
+        response: requests.Response | None = None,
+    ) -> bool:
+        """
+        Wait before retrying a failed request, unless retries are exhausted. See get_retry_delay.
+
+        Returns:
+            bool: Whether to retry the request
+        """
+        delay = self.get_retry_delay(attempt, deadline, reason, response)
+        if delay is None:
+            return False
+
+        time.sleep(delay)
+        return True
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """Send a GET request to the Microsoft Graph API."""
+        return self.request("GET", path, **kwargs)
+
+    def patch(self, path: str, **kwargs) -> requests.Response:
+        """Send a PATCH request to the Microsoft Graph API."""
+        return self.request("PATCH", path, **kwargs)
+
+    def iter_collection(
+        self, path: str, params: dict | None = None, page_size: int | None = None
+    ) -> Iterator[dict]:
+        """
+        Iterate over the items of a collection, following @odata.nextLink across pages.
+
+        Pages are fetched lazily, i.e. the next page is only requested once all items of the current page have been
+        consumed. Callers can thus stop iterating early to avoid fetching further pages. Only one page is held in
+        memory at a time.
+
+        Args:
+            path (str): API path of the collection
+            params (dict | None): Query parameters for the first request
+            page_size (int | None): Number of items per page. Defaults to the configured page size.
+
+        Yields:
+            dict: The items of the collection
+        """
+        url = path
+        params = {"$top": page_size or self.page_size, **(params or {})}
+
+        while url:
+            response = self.get(url, params=params)
+            response.raise_for_status()
+
+            page = response.json()
+            yield from page.get("value", [])
+
+            # The next link already contains all query parameters.
+            url = page.get("@odata.nextLink")
+            params = None
+
+    def get_delta(
+        self, path: str, params: dict | None = None
+    ) -> tuple[list[dict], str]:
+        """
+        Fetch all changes from a delta query, following @odata.nextLink until the delta link is returned.
+
+        Args:
+            path (str): API path of the delta query, or the delta link returned by a previous query
+            params (dict | None): Query parameters for the first request
+
+        Returns:
+            tuple[list[dict], str]: The changed items and the delta link for the next query
+        """
+        items = []
+        url = path
+        headers = {"Prefer": f"odata.maxpagesize={self.page_size}"}
+
+        while True:
+            response = self.get(url, params=params, headers=headers)
+            response.raise_for_status()
+
+            page = response.json()
+            items.extend(page.get("value", []))
+
+            if "@odata.nextLink" not in page:
+                return items, page["@odata.deltaLink"]
+
+            # The next link already contains all query parameters.
+            url = page["@odata.nextLink"]
+            params = None
+
+    def batch(self) -> GraphBatch:
+        """
+        Create a batch for sending several independent requests in a single JSON batch request.
+
+        Returns:
+            GraphBatch: An empty batch. Use it as a context manager to execute it on exit.
+        """
+        return GraphBatch(self)
+
+    def close(self) -> None:
+        """Close the underlying HTTP session."""
+        self.session.close()
+
+
+class AsyncGraphClient(_BaseGraphClient):
+    """
+    Async client for the Microsoft Graph API, for use with asyncio.
+
+    Mirrors GraphClient, with coroutines in place of blocking methods, so that a single event loop can serve many
+    mailboxes concurrently. Responses are httpx responses, which offer the same interface as those of requests for the
+    purposes of the application. The HTTP client may be shared between several clients, e.g. one per mailbox.
+    """
+
+    def __init__(
+        self,
+        settings: GraphSettings,
+        base_url: str,
+        client: httpx.AsyncClient | None = None,
+        limiter: RateLimiter | None = None,
+        run_deadline: RunDeadline | None = None,
+    ):
+        """
+        Args:
+            settings (GraphSettings): Graph client settings
+            base_url (str): Base URL of the Microsoft Graph API
+            client (httpx.AsyncClient | None): HTTP client to use. A new client is created if not given.
+            limiter (RateLimiter | None): Rate limiter shared with other clients. A new one is created if not given.
+            run_deadline (RunDeadline | None): Deadline of the run shared with other clients. A new one, starting now, is
+                created if not given.
+        """
+        super().__init__(settings, base_url, limiter, run_deadline)
+        self.client = client if client is not None else create_async_client(settings)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Send a request to the Microsoft Graph API.
+
+        Args:
+            method (str): HTTP method
+            path (str): API path relative to the base URL, e.g. /me/mailboxSettings, or an absolute URL
+            **kwargs: Additional arguments for httpx.AsyncClient.request
+
+        Returns:
+            httpx.Response: The response
+        """
+        import httpx
+
+        headers = self.get_headers(kwargs.pop("headers", None))
+        url = self.url(path)
+        deadline = time.monotonic() + self.settings.deadline_seconds
+
+        for attempt in range(self.settings.max_retries + 1):
+            for limiter in self.limiters:
+                await limiter.acquire_async()
+
+            try:
+                with span("graph.request", method=method, path=urlsplit(url).path) as s:
+                    response = await self.client.request(
+                        method, url, headers=headers, **kwargs
+                    )
+                    s.attributes["status"] = response.status_code
+            except httpx.TransportError as e:
+                if not await self.wait_for_retry(attempt, deadline, type(e).__name__):
+                    raise
+                continue
+
+            self._count_bytes_sent(response.request.content)
+
+            if (
+                response.status_code not in RETRY_STATUS_CODES
+                or not await self.wait_for_retry(
+                    attempt, deadline, f"HTTP {response.status_code}", response
+                )
+            ):
+                return response
+
+        return response
+
+    async def wait_for_retry(
+        self,
+        attempt: int,
+        deadline: float,
+        reason: str,
+        response: requests.Response | httpx.Response | None = None,
+    ) -> bool:
+        """
+        Wait asynchronously before retrying a failed request, unless retries are exhausted. See get_retry_delay.
+
+        Returns:
+            bool: Whether to retry the request
+        """
+        delay = self.get_retry_delay(attempt, deadline, reason, response)
+        if delay is None:
+            return False
+
+        await asyncio.sleep(delay)
+        return True
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        """Send a GET request to the Microsoft Graph API."""
+        return await self.request("GET", path, **kwargs)
+
+    async def patch(self, path: str, **kwargs) -> httpx.Response:
+        """Send a PATCH request to the Microsoft Graph API."""
+        return await self.request("PATCH", path, **kwargs)
+
+    async def iter_collection(
+        self, path: str, params: dict | None = None, page_size: int | None = None
+    ) -> AsyncIterator[dict]:
+        """
+        Iterate asynchronously over the items of a collection, following @odata.nextLink across pages.
+
+        Pages are fetched lazily, as with GraphClient.iter_collection.
+
+        Args:
+            path (str): API path of the collection
+            params (dict | None): Query parameters for the first request
+            page_size (int | None): Number of items per page. Defaults to the configured page size.
+
+        Yields:
+            dict: The items of the collection
+        """
+        url = path
+        params = {"$top": page_size or self.page_size, **(params or {})}
+
+        while url:
+            response = await self.get(url, params=params)
+            response.raise_for_status()
+
+            page = response.json()
+            for item in page.get("value", []):
+                yield item
+
+            # The next link already contains all query parameters.
+            url = page.get("@odata.nextLink")
+            params = None
+
+    async def get_delta(
+        self, path: str, params: dict | None = None
+    ) -> tuple[list[dict], str]:
+        """
+        Fetch all changes from a delta query, following @odata.nextLink until the delta link is returned.
+
+        Args:
+            path (str): API path of the delta query, or the delta link returned by a previous query
+            params (dict | None): Query parameters for the first request
+
+        Returns:
+            tuple[list[dict], str]: The changed items and the delta link for the next query
+        """
+        items = []
+        url = path
+        headers = {"Prefer": f"odata.maxpagesize={self.page_size}"}
+
+        while True:
+            response = await self.get(url, params=params, headers=headers)
+            response.raise_for_status()
+
+            page = response.json()
+            items.extend(page.get("value", []))
+
+            if "@odata.nextLink" not in page:
+                return items, page["@odata.deltaLink"]
+
+            # The next link already contains all query parameters.
+            url = page["@odata.nextLink"]
+            params = None
+
+    def batch(self) -> AsyncGraphBatch:
+        """
+        Create a batch for sending several independent requests in a single JSON batch request.
+
+        Returns:
+            AsyncGraphBatch: An empty batch. Use it as an async context manager to execute it on exit.
+        """
+        return AsyncGraphBatch(self)
+
+    async def close(self) -> None:
+        """Close the underlying HTTP client."""
+        await self.client.aclose()
+
+
+class _BaseGraphBatch:
+    """
+    Collects independent requests and sends them via the JSON batching endpoint of the Microsoft Graph API.
+
+    Each queued request returns a response object that is populated with the corresponding result once the batch has
+    been executed. Batches with more than the maximum number of requests are split into several batch requests.
+    Individual requests that were throttled or failed temporarily are sent again in another batch request, as
+    configured for the client.
+    """
+
+    # Maximum number of requests in a single batch request, as imposed by the Microsoft Graph API.
+    max_requests = 20
+
+    def __init__(self, client: _BaseGraphClient):
+        """
+        Args:
+            client (GraphClient | AsyncGraphClient): Client to send the batch request with
+        """
+        self.client = client
+        self._requests: list[tuple[dict, requests.Response]] = []
+
+    def add(
+        self,
+        method: str,
+        path: str,
+        params: dict | None = None,
+        json: dict | None = None,
+    ) -> requests.Response:
+        """
+        Queue a request.
+
+        Args:
+            method (str): HTTP method
+            path (str): API path relative to the base URL, e.g. /me/mailboxSettings
+            params (dict | None): Query parameters
+            json (dict | None): JSON request body
+
+        Returns:
+            requests.Response: Response that is populated when the batch is executed
+        """
+        url = f"{path}?{urlencode(params)}" if params else path
+        item = {"id": str(len(self._requests) + 1), "method": method, "url": url}
+        if json is not None:
+            item["body"] = json
+            item["headers"] = {"Content-Type": "application/json"}
+
+        response = requests.Response()
+        response.url = self.client.url(url)
+        response.encoding = "utf-8"
+
+        self._requests.append((item, response))
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """Queue a GET request."""
+        return self.add("GET", path, **kwargs)
+
+    def patch(self, path: str, **kwargs) -> requests.Response:
+        """Queue a PATCH request."""
+        return self.add("PATCH", path, **kwargs)
+
+    def _get_chunks(self) -> list[list[tuple[dict, requests.Response]]]:
+        """Split the queued requests into chunks of at most the maximum number of requests."""
+        return [
+            self._requests[i : i + self.max_requests]
+            for i in range(0, len(self._requests), self.max_requests)
+        ]
+
+    @staticmethod
+    def _populate_chunk(
+        chunk: list[tuple[dict, requests.Response]],
+        batch_response: requests.Response | httpx.Response,
+    ) -> list[tuple[dict, requests.Response]]:
+        """
+        Populate the responses of a chunk of requests from a batch response.
+
+        Returns:
+            list[tuple[dict, requests.Response]]: The requests that failed temporarily and may be retried
+        """
+        batch_response.raise_for_status()
+
+        # Responses may arrive in any order, so match them to requests by ID.
+        results = {
+            result["id"]: result
+            for result in batch_response.json().get("responses", [])
+        }
+
+        for item, response in chunk:
+            _populate_response(response, results[item["id"]])
+
+        return [
+            (item, response)
+            for item, response in chunk
+            if response.status_code in RETRY_STATUS_CODES
+        ]
+
+    @staticmethod
+    def _get_retry_args(
+        failed: list[tuple[dict, requests.Response]],
+    ) -> tuple[str, requests.Response]:
+        """
+        Return the reason and response to determine the delay before retrying failed requests from. The delay is
+        determined by the failed request that asks for the longest one.
+        """
+        slowest = max(failed, key=lambda f: get_retry_after(f[1]) or 0)[1]
+        return (
+            f"HTTP {slowest.status_code} for {len(failed)} batched request(s)",
+            slowest,
+        )
+
+
+class GraphBatch(_BaseGraphBatch):
+    """
+    Batch of requests sent by a GraphClient. See _BaseGraphBatch.
+    """
+
+    client: GraphClient
+
+    def execute(self) -> None:
+        """
+        Send all queued requests and populate their responses.
+
+        Raises:
+            requests.HTTPError: If a batch request itself fails
+        """
+        for chunk in self._get_chunks():
+            deadline = time.monotonic() + self.client.settings.deadline_seconds
+
+            for attempt in range(self.client.settings.max_retries + 1):
+                chunk = self._populate_chunk(
+                    chunk,
+                    self.client.request(
+                        "POST",
+                        "/$batch",
+                        json={"requests": [item for item, _ in chunk]},
+                    ),
+                )
+                if not chunk or not self.client.wait_for_retry(
+                    attempt, deadline, *self._get_retry_args(chunk)
+                ):
+                    break
+
+        self._requests.clear()
+
+    def __enter__(self) -> GraphBatch:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.execute()
+
+
+class AsyncGraphBatch(_BaseGraphBatch):
+    """
+    Batch of requests sent by an AsyncGraphClient. See _BaseGraphBatch.
+    """
+
+    client: AsyncGraphClient
+
+    async def execute(self) -> None:
+        """
+        Send all queued requests and populate their responses.
+
+        Raises:
+            httpx.HTTPStatusError: If a batch request itself fails
+        """
+        for chunk in self._get_chunks():
+            deadline = time.monotonic() + self.client.settings.deadline_seconds
+
+            for attempt in range(self.client.settings.max_retries + 1):
+                chunk = self._populate_chunk(
+                    chunk,
+                    await self.client.request(
+                        "POST",
+                        "/$batch",
+                        json={"requests": [item for item, _ in chunk]},
+                    ),
+                )
+                if not chunk or not await self.client.wait_for_retry(
+                    attempt, deadline, *self._get_retry_args(chunk)
+                ):
+                    break
+
+        self._requests.clear()
+
+    async def __aenter__(self) -> AsyncGraphBatch:
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            await self.execute()
+
+
+def _populate_response(response: requests.Response, result: dict) -> None:
+    """
+    Populate a response object with an individual result from a batch response.
+    """
+    response.status_code = result["status"]
+    response.headers = CaseInsensitiveDict(result.get("headers", {}))
+
+    body = result.get("body")
+    if body is None:
+        response._content = b""
+    elif isinstance(body, str):
+        response._content = body.encode("utf-8")
+    else:
+        response._content = json.dumps(body).encode("utf-8")
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .settings import InstrumentationSettings
+
+log = logging.getLogger(__name__)
+
+# Prefix of all exported Prometheus metrics.
+METRIC_PREFIX = "outlook_autoreply_helper"
+
+# Maximum number of spans kept between exports, to bound memory if nothing is ever exported. Further spans are only
+# counted in the summary.
+MAX_SPANS = 10000
+
+
+@dataclass
+class Span:
+    """
+    A timed operation, e.g. a single request to the Microsoft Graph API.
+
+    Start times are seconds since the epoch, durations are seconds. Spans started while another span is active in the
+    same thread or asyncio task are children of that span.
+    """
+
+    id: int
+    parent: int | None
+    name: str
+    start: float
+    duration: float = 0.0
+    thread: str = ""
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+
+class Recorder:
+    """
+    Collects spans and counters of a process, from all threads.
+
+    Keeps the number and total duration of spans by name, and the individual spans up to MAX_SPANS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._current: ContextVar[Span | None] = ContextVar("span", default=None)
+        self.spans: list[Span] = []
+        self.counters: dict[str, float] = {}
+        self._summary: dict[str, dict[str, float]] = {}
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time the enclosed block as a span. Attributes can still be added to the span within the block.
+        """
+        parent = self._current.get()
+
+        span = Span(
+            id=next(self._ids),
+            parent=parent.id if parent else None,
+            name=name,
+            start=time.time(),
+            thread=threading.current_thread().name,
+            attributes=attributes,
+        )
+
+        token = self._current.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            self._current.reset(token)
+            with self._lock:
+                if len(self.spans) < MAX_SPANS:
+                    self.spans.append(span)
+                entry = self._summary.setdefault(name, {"count": 0, "seconds": 0.0})
+                entry["count"] += 1
+                entry["seconds"] += span.duration
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Increment a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return the number and total duration of spans, by name."""
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._summary.items()}
+
+    def reset(self) -> None:
+        """Discard all recorded spans and counters."""
+        with self._lock:
+            self.spans = []
+            self.counters = {}
+            self._summary = {}
+
+
+# Recorder of the current process.
+recorder = Recorder()
+
+
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a span of the current process.
+
+    Args:
+        name (str): Name of the operation, e.g. graph.request
+        **attributes: Attributes of the span
+
+    Returns:
+        A context manager that yields the span
+    """
+    return recorder.span(name, **attributes)
+
+
+def timed(name: str):
+    """
+    Decorator that times each call of a function as a span with the given name.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Increment a counter of the current process."""
+    recorder.increment(name, value)
+
+
+def to_json() -> str:
+    """
+    Return all recorded spans and counters as JSON.
+    """
+    with recorder._lock:
+        spans = list(recorder.spans)
+        counters = dict(recorder.counters)
+
+    return json.dumps(
+        {
+            "spans": [asdict(span) for span in sorted(spans, key=lambda s: s.start)],
+            "counters": counters,
+            "summary": recorder.summary(),
+        },
+        default=str,
+    )
+
+
+def to_prometheus() -> str:
+    """
+    Return the number and total duration of spans by name, and all counters, in the Prometheus text format.
+
+    The recorder is reset after each export, and each run of the `run` command is a process of its own. The values
+    therefore describe the last run only and are exported as gauges.
+    """
+    summary = recorder.summary()
+    with recorder._lock:
+        counters = dict(recorder.counters)
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_last_run_operation_seconds Time spent in operations during the last run.",
+        f"# TYPE {METRIC_PREFIX}_last_run_operation_seconds gauge",
+        *(
+            f'{METRIC_PREFIX}_last_run_operation_seconds{{operation="{name}"}} {entry["seconds"]:.6f}'
+            for name, entry in sorted(summary.items())
+        ),
+        f"# HELP {METRIC_PREFIX}_last_run_operations Number of operations during the last run.",
+        f"# TYPE {METRIC_PREFIX}_last_run_operations gauge",
+        *(
+            f'{METRIC_PREFIX}_last_run_operations{{operation="{name}"}} {entry["count"]}'
+            for name, entry in sorted(summary.items())
+        ),
+        f"# HELP {METRIC_PREFIX}_last_run_count Counters of the last run.",
+        f"# TYPE {METRIC_PREFIX}_last_run_count gauge",
+        *(
+            f'{METRIC_PREFIX}_last_run_count{{counter="{name}"}} {value}'
+            for name, value in sorted(counters.items())
+        ),
+        f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Time of the end of the last run.",
+        f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+        f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomically(path: Path, content: str) -> None:
+    """
+    Write a file atomically, so that readers such as the Prometheus node exporter never see a partial file.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(content)
+    os.replace(tmp_path, path)
+
+
+def _export_otlp(endpoint: str) -> None:
+    """
+    Send all recorded spans to an OpenTelemetry collector via OTLP over HTTP.
+    """
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        raise RuntimeError(
+            "Exporting spans to OpenTelemetry requires the 'otel' extra: pip install outlook-autoreply-helper[otel]"
+        ) from e
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": "outlook-autoreply-helper"})
+    )
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint)))
+    tracer = provider.get_tracer(__name__)
+
+    with recorder._lock:
+        spans = sorted(recorder.spans, key=lambda s: s.start)
+
+    # Parents start before their children, so they have been created already.
+    otel_spans = {}
+    for span in spans:
+        parent = otel_spans.get(span.parent)
+        otel_span = tracer.start_span(
+            span.name,
+            context=trace.set_span_in_context(parent) if parent else None,
+            start_time=int(span.start * 1e9),
+            attributes={
+                "thread.name": span.thread,
+                **{key: str(value) for key, value in span.attributes.items()},
+            },
+        )
+        if span.error:
+            otel_span.set_status(trace.StatusCode.ERROR, span.error)
+        otel_span.end(end_time=int((span.start + span.duration) * 1e9))
+        otel_spans[span.id] = otel_span
+
+    provider.shutdown()
+
+
+def export(settings: InstrumentationSettings) -> None:
+    """
+    Export all spans and counters recorded since the last export, then discard them.
+
+    Logs a summary and writes the configured exports. Does nothing if nothing has been recorded.
+
+    Args:
+        settings (InstrumentationSettings): Instrumentation settings
+    """
+    summary = recorder.summary()
+    if not summary and not recorder.counters:
+        return
+
+    log.info(
+        "Timings: "
+        + ", ".join(
+            f"{name} {entry['count']}x {entry['seconds']:.3f}s"
+            for name, entry in sorted(summary.items())
+        )
+    )
+
+    try:
+        if settings.json_file is not None:
+            log.info(f"Writing instrumentation data to {settings.json_file}.")
+            _write_atomically(settings.json_file, to_json())
+
+        if settings.prometheus_file is not None:
+            log.info(f"Writing metrics to {settings.prometheus_file}.")
+            _write_atomically(settings.prometheus_file, to_prometheus())
+
+        if settings.otlp_endpoint is not None:
+            log.info(f"Sending spans to {settings.otlp_endpoint}.")
+            _export_otlp(settings.otlp_endpoint)
+    finally:
+        recorder.reset()
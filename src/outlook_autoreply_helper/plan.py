@@ -0,0 +1,264 @@
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Literal
+from zoneinfo import ZoneInfo
+
+from pydantic import BaseModel, TypeAdapter
+
+from .settings import AbsenceSettings
+from .templates import TemplateRegistry
+from .util import get_datetime
+
+
+@dataclass(frozen=True)
+class MailboxState:
+    """
+    State of a mailbox as fetched from the Microsoft Graph API, which a plan is based on.
+    """
+
+    # Mailbox, i.e. username of the account.
+    mailbox: str | None
+    # Mailbox time zone.
+    timezone: ZoneInfo
+    # Current automatic replies settings.
+    auto_reply_settings: dict
+    # Next absence event within the future period, if any.
+    next_absence: dict | None = None
+    # Absence events adjacent to or overlapping with the next one.
+    adjacent_events: list[dict] = field(default_factory=list)
+
+
+class Plan(BaseModel):
+    """
+    Intended changes to the automatic replies of a mailbox.
+    """
+
+    mailbox: str | None = None
+    action: Literal["update", "none", "failed"]
+    # Explanation of the decision.
+    reason: str
+    # Absence period, if any.
+    start: datetime | None = None
+    end: datetime | None = None
+    # Properties of the automatic replies to update. None if the automatic replies are not to be scheduled for the
+    # absence period, empty if they already match.
+    changes: dict | None = None
+    error: str | None = None
+
+
+# Serializes a batch of plans to JSON.
+PLANS_ADAPTER = TypeAdapter(list[Plan])
+
+
+def get_absence_period(state: MailboxState) -> tuple[datetime, datetime]:
+    """
+    Determine the absence period starting with the next absence event, including all adjacent or overlapping events.
+
+    Args:
+        state (MailboxState): Mailbox state with a next absence event
+
+    Returns:
+        tuple[datetime, datetime]: Start and end of the absence period, in the mailbox time zone
+    """
+    start = get_datetime(state.next_absence["start"]).replace(tzinfo=state.timezone)
+    end = max(
+        get_datetime(event["end"]).replace(tzinfo=state.timezone)
+        for event in (state.next_absence, *state.adjacent_events)
+    )
+    return start, end
+
+
+def get_changed_properties(current: dict, desired: dict) -> dict:
+    """
+    Determine the properties of the automatic replies settings that differ from the desired ones.
+
+    Date and time properties are compared by the point in time they represent, since the Microsoft Graph API may
+    return them in a different time zone and format than they were set.
+
+    Args:
+        current (dict): Current automatic replies settings
+        desired (dict): Desired automatic replies settings
+
+    Returns:
+        dict: The desired values of all properties that differ
+    """
+    changed = {}
+
+    for name, value in desired.items():
+        current_value = current.get(name)
+
+        if isinstance(value, dict) and "dateTime" in value:
+            if (
+                isinstance(current_value, dict)
+                and "dateTime" in current_value
+                and get_datetime(current_value) == get_datetime(value)
+            ):
+                continue
+        elif current_value == value:
+            continue
+
+        changed[name] = value
+
+    return changed
+
+
+def plan(
+    settings: AbsenceSettings,
+    state: MailboxState,
+    templates: TemplateRegistry,
+    now: datetime,
+) -> Plan:
+    """
+    Decide whether and how to update the automatic replies of a mailbox for its upcoming absence period.
+
+    Automatic replies that are disabled, or scheduled for a period that has ended or starts after the absence, are
+    scheduled for the absence period. Automatic replies that are always enabled are left as they are. A scheduled
+    period that overlaps with the absence, or ends less than max_delta_hours before it, is merged with it.
+
+    Has no side effects apart from rendering the reply templates, and sends no requests.
+
+    Args:
+        settings (AbsenceSettings): Absence settings
+        state (MailboxState): Fetched state of the mailbox
+        templates (TemplateRegistry): Registry of the reply templates
+        now (datetime): Current time
+
+    Returns:
+        Plan: Intended changes to the automatic replies
+    """
+    if state.next_absence is None:
+        return Plan(
+            mailbox=state.mailbox,
+            action="none",
+            reason="No upcoming vacation events found.",
+        )
+
+    vacation_start, vacation_end = get_absence_period(state)
+
+    auto_reply_settings = state.auto_reply_settings
+    status = auto_reply_settings.get("status")
+
+    scheduled_start = (
+        get_datetime(auto_reply_settings.get("scheduledStartDateTime"))
+        if status == "scheduled"
+        else None
+    )
+    scheduled_end = (
+        get_datetime(auto_reply_settings.get("scheduledEndDateTime"))
+        if status == "scheduled"
+        else None
+    )
+
+    def render() -> tuple[str, str]:
+        render_args = {"start": vacation_start, "end": vacation_end}
+        return (
+            templates.render(settings.internal_reply_template, **render_args),
+            templates.render(settings.external_reply_template, **render_args),
+        )
+
+    messages = None
+    should_update = False
+
+    if status == "disabled":
+        should_update = True
+        reason = "Automatic replies are not currently active. Scheduling for vacation period."
+    elif status == "alwaysEnabled":
+        reason = (
+            "Automatic replies are always enabled. Not scheduling for vacation period."
+        )
+    elif status == "scheduled":
+        if scheduled_end < now:
+            should_update = True
+            reason = "Automatic replies are scheduled but the current period has already ended. Scheduling for vacation period."
+        elif vacation_start == scheduled_start and vacation_end == scheduled_end:
+            messages = render()
+            if (
+                auto_reply_settings.get("internalReplyMessage") != messages[0]
+                or auto_reply_settings.get("externalReplyMessage") != messages[1]
+            ):
+                should_update = True
+                reason = "Automatic replies are already scheduled for the vacation period, but messages are different. Updating messages."
+            else:
+                reason = "Automatic replies are already scheduled for the vacation period with the same messages. Not updating."
+        elif scheduled_start < vacation_start:
+            if scheduled_end < vacation_start:
+                # Merge the periods if the gap between them is small.
+                if (
+                    vacation_start - scheduled_end
+                ).total_seconds() / 3600 < settings.max_delta_hours:
+                    should_update = True
+                    reason = f"Automatic replies are scheduled but end before vacation period starts. However, the difference is less than {settings.max_delta_hours} hours. Scheduling current and vacation period."
+                    vacation_start = min(vacation_start, scheduled_start)
+                    vacation_end = max(vacation_end, scheduled_end)
+                else:
+                    reason = "Automatic replies are scheduled prior to beginning of vacation period."
+            else:
+                should_update = True
+                reason = "Automatic replies are scheduled but overlap with the vacation period. Scheduling current and vacation period."
+                vacation_start = min(vacation_start, scheduled_start)
+                vacation_end = max(vacation_end, scheduled_end)
+        else:
+            should_update = True
+            reason = "Automatic replies are scheduled but the vacation period starts before the current scheduled period. Scheduling for vacation period."
+    else:
+        reason = f"Automatic replies status {status} is not managed. Not updating."
+
+    changes = None
+
+    if should_update:
+        if messages is None:
+            messages = render()
+
+        desired_settings = {
+            "status": "scheduled",
+            "scheduledStartDateTime": {
+                "dateTime": vacation_start.astimezone(state.timezone)
+                .replace(tzinfo=None)
+                .isoformat(),
+                "timeZone": state.timezone.key,
+            },
+            "scheduledEndDateTime": {
+                "dateTime": vacation_end.astimezone(state.timezone)
+                .replace(tzinfo=None)
+                .isoformat(),
+                "timeZone": state.timezone.key,
+            },
+            "internalReplyMessage": messages[0],
+            "externalReplyMessage": messages[1],
+            # Send reply to all external recipients.
+            "externalAudience": "all",
+        }
+
+        # Only the changed properties need to be updated.
+        changes = get_changed_properties(auto_reply_settings, desired_settings)
+
+    return Plan(
+        mailbox=state.mailbox,
+        action="update" if changes else "none",
+        reason=reason,
+        start=vacation_start,
+        end=vacation_end,
+        changes=changes,
+    )
+
+
+def plan_many(
+    settings: AbsenceSettings,
+    states: Iterable[MailboxState],
+    templates: TemplateRegistry,
+    now: datetime,
+) -> list[Plan]:
+    """
+    Plan the changes to the automatic replies of several mailboxes at once.
+
+    Args:
+        settings (AbsenceSettings): Absence settings
+        states (Iterable[MailboxState]): Fetched state of each mailbox
+        templates (TemplateRegistry): Registry of the reply templates, shared by all mailboxes
+        now (datetime): Current time
+
+    Returns:
+        list[Plan]: Intended changes for each mailbox, in the given order
+    """
+    return [plan(settings, state, templates, now) for state in states]
@@ -1,43 +1,154 @@
+from __future__ import annotations
+
+import functools
+import hashlib
 import logging
 import os
+import threading
 from abc import ABC, abstractmethod
+from datetime import date, datetime
 from pathlib import Path
-from typing import Literal
-
-from azure.core.exceptions import ResourceNotFoundError
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
-from msal import SerializableTokenCache
-from msal_extensions import (
-    PersistedTokenCache,
-    FilePersistenceWithDataProtection,
-    FilePersistence,
-)
-from pydantic import BaseModel, Field, AliasChoices
+from typing import TYPE_CHECKING, Literal
+
+from pydantic import BaseModel, Field, AliasChoices, PrivateAttr
 from pydantic_settings import (
     BaseSettings,
     SettingsConfigDict,
     PydanticBaseSettingsSource,
-    AzureKeyVaultSettingsSource,
 )
 
+from .instrumentation import span, timed
+
+# Azure and MSAL packages are slow to import. Only import them on the code paths that need them.
+if TYPE_CHECKING:
+    from azure.identity import DefaultAzureCredential
+    from azure.keyvault.secrets import SecretClient
+    from msal import SerializableTokenCache
+
 log = logging.getLogger(__name__)
 
 
-class TimeZoneCache(BaseModel):
+@functools.cache
+def get_azure_credential() -> DefaultAzureCredential:
+    """
+    Return the Azure credential for accessing key vaults, creating it on first use.
+
+    The credential is shared by the key vault settings source and cache, so its credential chain is only resolved once
+    per process.
+    """
+    from azure.identity import DefaultAzureCredential
+
+    return DefaultAzureCredential()
+
+
+class DeltaState(BaseModel):
+    """
+    State of the incremental calendar synchronization for a single mailbox.
+
+    Holds the delta link for the next incremental query over a fixed calendar window, the absence events in that
+    window, the time until which the outcome of the last run remains valid if the calendar does not change, and hashes
+    of the mailbox settings and of the templates and absence settings that outcome is based on.
+    """
+
+    delta_link: str
+    keyword: str
+    window_start: datetime
+    window_end: datetime
+    events: dict[str, dict] = Field(default_factory=dict)
+    valid_until: datetime | None = None
+    mailbox: str | None = None
+    configuration: str | None = None
+
+
+class DeltaCache(BaseModel):
+    """
+    Cache for incremental calendar synchronization states, by mailbox.
+    """
+
+    mailboxes: dict[str, DeltaState] = Field(default_factory=dict)
+
+
+class Fingerprint(BaseModel):
+    """
+    Fingerprint of the last run for a single mailbox that left the automatic replies unchanged.
+
+    Consists of a hash over all inputs of the run, i.e. the absence events, templates, settings and current automatic
+    replies settings.
+    """
+
+    inputs: str
+    valid_until: datetime
+
+
+class FingerprintCache(BaseModel):
+    """
+    Cache for fingerprints of the last run, by mailbox.
+    """
+
+    mailboxes: dict[str, Fingerprint] = Field(default_factory=dict)
+
+
+class DiscoveryResponse(BaseModel):
     """
-    Cache for mapping a Windows time zone to an IANA time zone.
+    Successful response to an authority or instance discovery request of the identity platform.
     """
 
-    windows_tz: str
-    iana_tz: str
+    content: str
+    expires: datetime
+
+
+class AuthorityCache(BaseModel):
+    """
+    Cache for authority and instance discovery responses of the identity platform, by request URL.
+    """
+
+    responses: dict[str, DiscoveryResponse] = Field(default_factory=dict)
+
+
+class StateBundle(BaseModel):
+    """
+    All persisted state in a single document, stored as one secret.
+
+    Entries are keyed by the name of the secret that would hold them otherwise. A bundle too large for a single secret
+    is split into parts, each stored in a secret of its own. The bundle secret then only lists the versions of these
+    part secrets, so that a reader never combines parts of different bundles.
+    """
+
+    version: Literal[1] = 1
+    entries: dict[str, str] = Field(default_factory=dict)
+    parts: list[str] = Field(default_factory=list)
+
+
+# Maximum size of a secret value in Azure Key Vault, in bytes.
+MAX_SECRET_SIZE = 25000
+
+
+def _get_content_hash(content: str) -> str:
+    """Return a hash of the given content, to detect changes."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _split_content(content: str, size: int) -> list[str]:
+    """Split content into parts of at most the given size in bytes when encoded as UTF-8, keeping characters whole."""
+    data = content.encode("utf-8")
+    parts = []
+    start = 0
+    while start < len(data):
+        end = min(start + size, len(data))
+        # Do not end a part within a multi-byte character.
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode("utf-8"))
+        start = end
+    return parts
 
 
 class AbstractCacheSettings(ABC, BaseModel):
     """
     Abstract base class for cache-related settings.
 
-    Defines an interface for token/timezone cache management with methods for retrieving and storing.
+    Defines an interface for token/delta/fingerprint/authority cache management with methods for retrieving and
+    storing.
     """
 
     @abstractmethod
@@ -51,13 +162,33 @@ class AbstractCacheSettings(ABC, BaseModel):
         pass
 
     @abstractmethod
-    def get_tz_cache(self) -> TimeZoneCache | None:
-        """Retrieve a token cache."""
+    def get_delta_cache(self) -> DeltaCache | None:
+        """Retrieve a delta cache."""
         pass
 
     @abstractmethod
-    def put_tz_cache(self, tz_cache: TimeZoneCache) -> None:
-        """Store a token cache."""
+    def put_delta_cache(self, delta_cache: DeltaCache) -> None:
+        """Store a delta cache."""
+        pass
+
+    @abstractmethod
+    def get_fingerprint_cache(self) -> FingerprintCache | None:
+        """Retrieve a fingerprint cache."""
+        pass
+
+    @abstractmethod
+    def put_fingerprint_cache(self, fingerprint_cache: FingerprintCache) -> None:
+        """Store a fingerprint cache."""
+        pass
+
+    @abstractmethod
+    def get_authority_cache(self) -> AuthorityCache | None:
+        """Retrieve an authority cache."""
+        pass
+
+    @abstractmethod
+    def put_authority_cache(self, authority_cache: AuthorityCache) -> None:
+        """Store an authority cache."""
         pass
 
 
@@ -66,7 +197,8 @@ class LocalCacheSettings(AbstractCacheSettings):
     Local file-based token cache settings with optional encryption.
 
     Supports storing tokens in a local file, with the option to use
-    data protection for enhanced security.
+    data protection for enhanced security. For many accounts, tokens can
+    instead be stored in a directory with one file per account.
     """
 
     type: Literal["local"] = "local"
@@ -78,17 +210,40 @@ class LocalCacheSettings(AbstractCacheSettings):
         default=True,
         validation_alias=AliasChoices("fallback_to_plaintext", "fallback-to-plaintext"),
     )
-    tz_cache_file: Path = Field(
-        default=Path("tz_cache.json"),
-        validation_alias=AliasChoices("tz_cache_file", "tz-cache-file"),
+    token_cache_dir: Path | None = Field(
+        default=None,
+        validation_alias=AliasChoices("token_cache_dir", "token-cache-dir"),
+    )
+    delta_cache_file: Path = Field(
+        default=Path("delta_cache.json"),
+        validation_alias=AliasChoices("delta_cache_file", "delta-cache-file"),
+    )
+    fingerprint_cache_file: Path = Field(
+        default=Path("fingerprint_cache.json"),
+        validation_alias=AliasChoices(
+            "fingerprint_cache_file", "fingerprint-cache-file"
+        ),
+    )
+    authority_cache_file: Path = Field(
+        default=Path("authority_cache.json"),
+        validation_alias=AliasChoices("authority_cache_file", "authority-cache-file"),
     )
 
+    @timed("cache.local.get_token_cache")
     def get_token_cache(self) -> SerializableTokenCache:
         """
         Create a persistent token cache with optional encryption.
 
-        Falls back to plaintext storage if encryption is unavailable.
+        Falls back to plaintext storage if encryption is unavailable. If a token cache directory is set, the cache is
+        sharded by account. Such a cache is initialized from the token cache file, if it has no shards yet.
         """
+        from msal_extensions import (
+            PersistedTokenCache,
+            FilePersistenceWithDataProtection,
+            FilePersistence,
+        )
+
+        persistence_cls = FilePersistenceWithDataProtection
         try:
             persistence = FilePersistenceWithDataProtection(self.token_cache_file)
         except Exception as e:
@@ -97,13 +252,31 @@ class LocalCacheSettings(AbstractCacheSettings):
                     "Failed to initialize token cache with encryption."
                 ) from e
             log.warning("Encryption unavailable. Falling back to plaintext: %s", str(e))
+            persistence_cls = FilePersistence
             persistence = FilePersistence(self.token_cache_file)
 
         log.info("Using persistence type: %s", persistence.__class__.__name__)
         log.info("Persistence encryption status: %s", persistence.is_encrypted)
 
-        return PersistedTokenCache(persistence)
+        if self.token_cache_dir is None:
+            return PersistedTokenCache(persistence)
+
+        from .token_cache import ShardedTokenCache
 
+        token_cache = ShardedTokenCache(self.token_cache_dir, persistence_cls)
+
+        if (
+            not any(self.token_cache_dir.glob("*.json"))
+            and self.token_cache_file.exists()
+        ):
+            log.info(
+                f"Migrating token cache from {self.token_cache_file} to {self.token_cache_dir}."
+            )
+            token_cache.merge(persistence.load())
+
+        return token_cache
+
+    @timed("cache.local.put_token_cache")
     def put_token_cache(self, token_cache: SerializableTokenCache) -> None:
         """
         No-op method for local cache storage.
@@ -112,24 +285,68 @@ class LocalCacheSettings(AbstractCacheSettings):
         """
         pass
 
-    def get_tz_cache(self) -> TimeZoneCache | None:
+    @timed("cache.local.get_delta_cache")
+    def get_delta_cache(self) -> DeltaCache | None:
         """
-        Retrieve a time zone cache from a local file.
+        Retrieve a delta cache from a local file.
         """
         try:
-            if not self.tz_cache_file.exists():
+            if not self.delta_cache_file.exists():
                 return None
-            with open(self.tz_cache_file) as f:
-                return TimeZoneCache.model_validate_json(f.read())
+            with open(self.delta_cache_file) as f:
+                return DeltaCache.model_validate_json(f.read())
         except Exception as e:
-            raise RuntimeError("Failed to read time zone cache.") from e
+            raise RuntimeError("Failed to read delta cache.") from e
 
-    def put_tz_cache(self, tz_cache: TimeZoneCache) -> None:
+    @timed("cache.local.put_delta_cache")
+    def put_delta_cache(self, delta_cache: DeltaCache) -> None:
         """
-        Store a time zone cache in a local file.
+        Store a delta cache in a local file.
         """
-        with open(self.tz_cache_file, "w") as f:
-            f.write(tz_cache.model_dump_json())
+        with open(self.delta_cache_file, "w") as f:
+            f.write(delta_cache.model_dump_json())
+
+    @timed("cache.local.get_fingerprint_cache")
+    def get_fingerprint_cache(self) -> FingerprintCache | None:
+        """
+        Retrieve a fingerprint cache from a local file.
+        """
+        try:
+            if not self.fingerprint_cache_file.exists():
+                return None
+            with open(self.fingerprint_cache_file) as f:
+                return FingerprintCache.model_validate_json(f.read())
+        except Exception as e:
+            raise RuntimeError("Failed to read fingerprint cache.") from e
+
+    @timed("cache.local.put_fingerprint_cache")
+    def put_fingerprint_cache(self, fingerprint_cache: FingerprintCache) -> None:
+        """
+        Store a fingerprint cache in a local file.
+        """
+        with open(self.fingerprint_cache_file, "w") as f:
+            f.write(fingerprint_cache.model_dump_json())
+
+    @timed("cache.local.get_authority_cache")
+    def get_authority_cache(self) -> AuthorityCache | None:
+        """
+        Retrieve an authority cache from a local file.
+        """
+        try:
+            if not self.authority_cache_file.exists():
+                return None
+            with open(self.authority_cache_file) as f:
+                return AuthorityCache.model_validate_json(f.read())
+        except Exception as e:
+            raise RuntimeError("Failed to read authority cache.") from e
+
+    @timed("cache.local.put_authority_cache")
+    def put_authority_cache(self, authority_cache: AuthorityCache) -> None:
+        """
+        Store an authority cache in a local file.
+        """
+        with open(self.authority_cache_file, "w") as f:
+            f.write(authority_cache.model_dump_json())
 
 
 class KeyVaultCacheSettings(AbstractCacheSettings):
@@ -149,39 +366,215 @@ class KeyVaultCacheSettings(AbstractCacheSettings):
             "token_cache_secret_name", "token-cache-secret-name"
         ),
     )
-    tz_cache_secret_name: str = Field(
-        default="tz-cache",
-        validation_alias=AliasChoices("tz_cache_secret_name", "tz-cache-secret-name"),
+    delta_cache_secret_name: str = Field(
+        default="delta-cache",
+        validation_alias=AliasChoices(
+            "delta_cache_secret_name", "delta-cache-secret-name"
+        ),
+    )
+    fingerprint_cache_secret_name: str = Field(
+        default="fingerprint-cache",
+        validation_alias=AliasChoices(
+            "fingerprint_cache_secret_name", "fingerprint-cache-secret-name"
+        ),
+    )
+    authority_cache_secret_name: str = Field(
+        default="authority-cache",
+        validation_alias=AliasChoices(
+            "authority_cache_secret_name", "authority-cache-secret-name"
+        ),
     )
 
+    bundle_secret_name: str | None = Field(
+        default=None,
+        validation_alias=AliasChoices("bundle_secret_name", "bundle-secret-name"),
+    )
+
+    # Secret client and secret values, shared by all cache operations.
+    _secret_client: SecretClient | None = PrivateAttr(default=None)
+    _secrets: dict[str, str | None] = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    # Bundled state: whether it was loaded and found, and the hash of its last stored content.
+    _bundle_loaded: bool = PrivateAttr(default=False)
+    _bundle_found: bool = PrivateAttr(default=False)
+    _bundle_hash: str | None = PrivateAttr(default=None)
+    _bundle_write_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _get_secret_client(self) -> SecretClient:
+        """
+        Return the secret client for the key vault, creating it on first use.
+        """
+        from azure.keyvault.secrets import SecretClient
+
+        with self._lock:
+            if self._secret_client is None:
+                self._secret_client = SecretClient(
+                    vault_url=self.key_vault_url, credential=get_azure_credential()
+                )
+            return self._secret_client
+
+    def _read_secret(self, name: str, version: str | None = None) -> str | None:
+        """
+        Fetch a secret value from the key vault, or None if the secret does not exist.
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+
+        with span("keyvault.get_secret", secret=name):
+            try:
+                return self._get_secret_client().get_secret(name, version).value
+            except ResourceNotFoundError:
+                return None
+
+    def _get_part_secret_name(self, index: int) -> str:
+        """Return the name of the secret holding a part of a bundle too large for a single secret."""
+        return f"{self.bundle_secret_name}-part-{index}"
+
+    def _load_bundle(self) -> None:
+        """
+        Fetch the bundled state from the key vault, unless already loaded, and cache all of its entries.
+        """
+        with self._lock:
+            if self._bundle_loaded:
+                return
+
+        value = self._read_secret(self.bundle_secret_name)
+
+        try:
+            bundle = StateBundle.model_validate_json(value) if value else StateBundle()
+
+            if bundle.parts:
+                # Reassemble the bundle from the listed versions of its parts.
+                value = "".join(
+                    self._read_secret(self._get_part_secret_name(i), version) or ""
+                    for i, version in enumerate(bundle.parts)
+                )
+                bundle = StateBundle.model_validate_json(value)
+        except Exception as e:
+            raise RuntimeError("Failed to read bundled state.") from e
+
+        with self._lock:
+            if not self._bundle_loaded:
+                self._bundle_loaded = True
+                self._bundle_found = value is not None
+                self._bundle_hash = _get_content_hash(value) if value else None
+                for name, entry in bundle.entries.items():
+                    self._secrets.setdefault(name, entry)
+
+    def _write_bundle(self, content: str) -> None:
+        """
+        Store the bundled state in the key vault, split into parts if it exceeds the maximum size of a secret.
+
+        The parts are written first, so that the bundle secret only ever lists complete parts.
+        """
+        client = self._get_secret_client()
+
+        if len(content.encode("utf-8")) > MAX_SECRET_SIZE:
+            versions = []
+            for i, part in enumerate(_split_content(content, MAX_SECRET_SIZE)):
+                name = self._get_part_secret_name(i)
+                with span("keyvault.set_secret", secret=name):
+                    versions.append(client.set_secret(name, part).properties.version)
+
+            log.info(
+                f"Bundled state exceeds {MAX_SECRET_SIZE} bytes. Stored in {len(versions)} parts."
+            )
+            content = StateBundle(parts=versions).model_dump_json()
+
+        with span("keyvault.set_secret", secret=self.bundle_secret_name):
+            client.set_secret(self.bundle_secret_name, content)
+
+    def _get_secret(self, name: str) -> str | None:
+        """
+        Retrieve a secret value, or None if the secret does not exist.
+
+        Each secret is fetched from the key vault at most once. Subsequent calls return the cached value. When using
+        bundled state, the value is an entry of the bundle instead.
+        """
+        with self._lock:
+            if name in self._secrets:
+                return self._secrets[name]
+
+        if self.bundle_secret_name:
+            self._load_bundle()
+
+            with self._lock:
+                if name in self._secrets or self._bundle_found:
+                    return self._secrets.setdefault(name, None)
+
+            # No bundle found. Migrate from the individual secret.
+
+        value = self._read_secret(name)
+
+        with self._lock:
+            return self._secrets.setdefault(name, value)
+
+    def _set_secret(self, name: str, value: str) -> None:
+        """
+        Store a secret value in the key vault and update the cached value.
+
+        Nothing is written if the value did not change. When using bundled state, the value is stored as an entry of
+        the bundle, which is only written if its content changed.
+        """
+        if not self.bundle_secret_name:
+            with self._lock:
+                if name in self._secrets and self._secrets[name] == value:
+                    log.debug(f"Secret {name} did not change. Not updating.")
+                    return
+
+            with span("keyvault.set_secret", secret=name):
+                self._get_secret_client().set_secret(name, value)
+
+            with self._lock:
+                self._secrets[name] = value
+            return
+
+        # Ensure all other entries are known before writing the bundle.
+        self._load_bundle()
+
+        with self._bundle_write_lock:
+            with self._lock:
+                self._secrets[name] = value
+                content = StateBundle(
+                    entries={k: v for k, v in self._secrets.items() if v is not None}
+                ).model_dump_json()
+                content_hash = _get_content_hash(content)
+
+                if content_hash == self._bundle_hash:
+                    log.debug("Bundled state did not change. Not updating.")
+                    return
+
+            self._write_bundle(content)
+
+            with self._lock:
+                self._bundle_hash = content_hash
+
+    @timed("cache.keyvault.get_token_cache")
     def get_token_cache(self) -> SerializableTokenCache:
         """
         Retrieve or create a token cache from Azure Key Vault.
 
         Creates a new cache if no existing cache is found.
         """
-        credential = DefaultAzureCredential()
-        secret_client = SecretClient(
-            vault_url=self.key_vault_url, credential=credential
-        )
+        from msal import SerializableTokenCache
 
         # Initialize empty cache.
         cache = SerializableTokenCache()
 
-        try:
-            secret = secret_client.get_secret(self.token_cache_secret_name)
-        except ResourceNotFoundError:
+        value = self._get_secret(self.token_cache_secret_name)
+        if value is None:
             # Return empty cache.
             return cache
 
         # Deserialize cache from secret value.
         try:
-            cache.deserialize(secret.value)
+            cache.deserialize(value)
         except Exception as e:
             raise RuntimeError("Failed to deserialize token cache from secret.") from e
 
         return cache
 
+    @timed("cache.keyvault.put_token_cache")
     def put_token_cache(self, token_cache: SerializableTokenCache) -> None:
         """
         Store the token cache in Azure Key Vault.
@@ -189,42 +582,74 @@ class KeyVaultCacheSettings(AbstractCacheSettings):
         Args:
             token_cache: The token cache to be serialized and stored
         """
-        credential = DefaultAzureCredential()
-        secret_client = SecretClient(
-            vault_url=self.key_vault_url, credential=credential
-        )
-        secret_client.set_secret(self.token_cache_secret_name, token_cache.serialize())
+        self._set_secret(self.token_cache_secret_name, token_cache.serialize())
 
-    def get_tz_cache(self) -> TimeZoneCache | None:
+    @timed("cache.keyvault.get_delta_cache")
+    def get_delta_cache(self) -> DeltaCache | None:
         """
-        Retrieve a time zone cache from Azure Key Vault.
+        Retrieve a delta cache from Azure Key Vault.
         """
-        credential = DefaultAzureCredential()
-        secret_client = SecretClient(
-            vault_url=self.key_vault_url, credential=credential
-        )
+        value = self._get_secret(self.delta_cache_secret_name)
+        if value is None:
+            return None
 
         try:
-            secret = secret_client.get_secret(self.tz_cache_secret_name)
-        except ResourceNotFoundError:
+            return DeltaCache.model_validate_json(value)
+        except Exception as e:
+            raise RuntimeError("Failed to read delta cache.") from e
+
+    @timed("cache.keyvault.put_delta_cache")
+    def put_delta_cache(self, delta_cache: DeltaCache) -> None:
+        """
+        Store a delta cache in Azure Key Vault.
+        """
+        self._set_secret(self.delta_cache_secret_name, delta_cache.model_dump_json())
+
+    @timed("cache.keyvault.get_fingerprint_cache")
+    def get_fingerprint_cache(self) -> FingerprintCache | None:
+        """
+        Retrieve a fingerprint cache from Azure Key Vault.
+        """
+        value = self._get_secret(self.fingerprint_cache_secret_name)
+        if value is None:
             return None
 
-        print(f"secret.value: {secret.value}")
+        try:
+            return FingerprintCache.model_validate_json(value)
+        except Exception as e:
+            raise RuntimeError("Failed to read fingerprint cache.") from e
+
+    @timed("cache.keyvault.put_fingerprint_cache")
+    def put_fingerprint_cache(self, fingerprint_cache: FingerprintCache) -> None:
+        """
+        Store a fingerprint cache in Azure Key Vault.
+        """
+        self._set_secret(
+            self.fingerprint_cache_secret_name, fingerprint_cache.model_dump_json()
+        )
+
+    @timed("cache.keyvault.get_authority_cache")
+    def get_authority_cache(self) -> AuthorityCache | None:
+        """
+        Retrieve an authority cache from Azure Key Vault.
+        """
+        value = self._get_secret(self.authority_cache_secret_name)
+        if value is None:
+            return None
 
         try:
-            return TimeZoneCache.model_validate_json(secret.value)
+            return AuthorityCache.model_validate_json(value)
         except Exception as e:
-            raise RuntimeError("Failed to read time zone cache.") from e
+            raise RuntimeError("Failed to read authority cache.") from e
 
-    def put_tz_cache(self, tz_cache: TimeZoneCache) -> None:
+    @timed("cache.keyvault.put_authority_cache")
+    def put_authority_cache(self, authority_cache: AuthorityCache) -> None:
         """
-        Store a time zone cache in Azure Key Vault.
+        Store an authority cache in Azure Key Vault.
         """
-        credential = DefaultAzureCredential()
-        secret_client = SecretClient(
-            vault_url=self.key_vault_url, credential=credential
+        self._set_secret(
+            self.authority_cache_secret_name, authority_cache.model_dump_json()
         )
-        secret_client.set_secret(self.tz_cache_secret_name, tz_cache.model_dump_json())
 
 
 class AppRegistrationSettings(BaseModel):
@@ -233,6 +658,10 @@ class AppRegistrationSettings(BaseModel):
 
     Configures client ID and tenant ID for access to the Microsoft Graph API. Optionally, can override the default
     scopes, base URL, and authentication flow to use when no access token is available from a cache.
+
+    The authority metadata that MSAL discovers from the identity platform is cached for authority_cache_ttl_seconds, so
+    that runs with a valid cached access token need no requests to the identity platform. Set it to 0 to disable this
+    cache.
     """
 
     tenant_id: str = Field(validation_alias=AliasChoices("tenant_id", "tenant-id"))
@@ -248,6 +677,77 @@ class AppRegistrationSettings(BaseModel):
     auth_flow: Literal["interactive", "device_code"] = Field(
         default="interactive", validation_alias=AliasChoices("auth_flow", "auth-flow")
     )
+    authority_cache_ttl_seconds: int = Field(
+        default=86400,
+        ge=0,
+        validation_alias=AliasChoices(
+            "authority_cache_ttl_seconds", "authority-cache-ttl-seconds"
+        ),
+    )
+
+
+class GraphSettings(BaseModel):
+    """
+    HTTP client settings for requests to the Microsoft Graph API.
+
+    Configures the size of the connection pool, request timeouts in seconds, and the page size for collections.
+
+    Throttled or failed requests are retried up to max_retries times, waiting as long as the API asks via Retry-After,
+    or else with exponential backoff and jitter. No retry starts after deadline_seconds since the first attempt, or
+    after run_deadline_seconds since the start of the run, for all mailboxes together.
+    Requests are limited to rate_limit per second in total, and to mailbox_rate_limit per second per mailbox, which
+    keeps within the Outlook limit of 10,000 requests per 10 minutes per mailbox.
+    """
+
+    pool_size: int = Field(
+        default=10, ge=1, validation_alias=AliasChoices("pool_size", "pool-size")
+    )
+    connect_timeout: float = Field(
+        default=10.0,
+        gt=0,
+        validation_alias=AliasChoices("connect_timeout", "connect-timeout"),
+    )
+    read_timeout: float = Field(
+        default=30.0,
+        gt=0,
+        validation_alias=AliasChoices("read_timeout", "read-timeout"),
+    )
+    page_size: int = Field(
+        default=50, ge=1, validation_alias=AliasChoices("page_size", "page-size")
+    )
+    max_retries: int = Field(
+        default=5, ge=0, validation_alias=AliasChoices("max_retries", "max-retries")
+    )
+    backoff_seconds: float = Field(
+        default=1.0,
+        gt=0,
+        validation_alias=AliasChoices("backoff_seconds", "backoff-seconds"),
+    )
+    max_backoff_seconds: float = Field(
+        default=60.0,
+        gt=0,
+        validation_alias=AliasChoices("max_backoff_seconds", "max-backoff-seconds"),
+    )
+    deadline_seconds: float = Field(
+        default=180.0,
+        gt=0,
+        validation_alias=AliasChoices("deadline_seconds", "deadline-seconds"),
+    )
+    run_deadline_seconds: float = Field(
+        default=600.0,
+        gt=0,
+        validation_alias=AliasChoices("run_deadline_seconds", "run-deadline-seconds"),
+    )
+    rate_limit: float = Field(
+        default=200.0,
+        gt=0,
+        validation_alias=AliasChoices("rate_limit", "rate-limit"),
+    )
+    mailbox_rate_limit: float = Field(
+        default=16.0,
+        gt=0,
+        validation_alias=AliasChoices("mailbox_rate_limit", "mailbox-rate-limit"),
+    )
 
 
 class AbstractTemplateSource(BaseModel, ABC):
@@ -256,20 +756,46 @@ class AbstractTemplateSource(BaseModel, ABC):
         """Return template content."""
         pass
 
+    @abstractmethod
+    def get_name(self) -> str:
+        """Return a name that identifies the template, e.g. for caching compiled templates."""
+        pass
+
+    def get_version(self) -> str:
+        """Return an identifier that changes whenever the template content changes."""
+        return _get_content_hash(self.get_template())
+
 
 class LocalTemplateSource(AbstractTemplateSource):
     """
     Local file-based template source for absence reply messages.
 
-    Reads template content from a local file path.
+    Reads template content from a local file path. The content is kept in memory and only read again after the file
+    has been modified.
     """
 
     type: Literal["local"] = "local"
     path: Path
 
+    _content: str | None = PrivateAttr(default=None)
+    _content_version: str | None = PrivateAttr(default=None)
+
     def get_template(self) -> str:
         """Read and return template content from file."""
-        return self.path.read_text()
+        version = self.get_version()
+        if self._content is None or self._content_version != version:
+            self._content = self.path.read_text()
+            self._content_version = version
+        return self._content
+
+    def get_name(self) -> str:
+        """Return the absolute path of the template file."""
+        return f"local:{self.path.absolute()}"
+
+    def get_version(self) -> str:
+        """Return the modification time and size of the template file."""
+        stat = self.path.stat()
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
 
 
 class StringTemplateSource(AbstractTemplateSource):
@@ -286,6 +812,10 @@ class StringTemplateSource(AbstractTemplateSource):
         """Return template content directly."""
         return self.content
 
+    def get_name(self) -> str:
+        """Return a name derived from the template content."""
+        return f"string:{self.get_version()}"
+
 
 class AbsenceSettings(BaseModel):
     """
@@ -302,6 +832,11 @@ class AbsenceSettings(BaseModel):
     max_delta_hours: int = Field(
         default=12, validation_alias=AliasChoices("max_delta_hours", "max-delta-hours")
     )
+    lookahead_days: int = Field(
+        default=365,
+        ge=1,
+        validation_alias=AliasChoices("lookahead_days", "lookahead-days"),
+    )
     internal_reply_template: LocalTemplateSource | StringTemplateSource = Field(
         default_factory=lambda: LocalTemplateSource(
             path=Path("internal_reply_template.html.in")
@@ -323,6 +858,101 @@ class AbsenceSettings(BaseModel):
     date_format: str = Field(
         default="%d.%m.%Y", validation_alias=AliasChoices("date_format", "date-format")
     )
+    template_cache_dir: Path | None = Field(
+        default=None,
+        validation_alias=AliasChoices("template_cache_dir", "template-cache-dir"),
+    )
+
+
+class FleetSettings(BaseModel):
+    """
+    Settings for processing multiple mailboxes in a single process.
+
+    Each mailbox is identified by the username of an account in the token cache. When no mailboxes are configured,
+    only the first cached account is processed.
+
+    Mailboxes are processed in a thread pool, or as tasks on an asyncio event loop with the asyncio engine, which
+    needs far less memory per concurrently processed mailbox. Either way, at most max_workers mailboxes are processed
+    at a time.
+    """
+
+    mailboxes: list[str] = Field(default_factory=list)
+    max_workers: int = Field(
+        default=8,
+        ge=1,
+        validation_alias=AliasChoices("max_workers", "max-workers"),
+    )
+    engine: Literal["threads", "asyncio"] = "threads"
+
+
+class SchedulerSettings(BaseModel):
+    """
+    Settings for running continuously at a regular interval.
+
+    Each run starts after the interval has passed since the start of the previous one, plus a random jitter of up to
+    the given number of seconds. Access tokens are refreshed in the background the given number of seconds before they
+    expire.
+    """
+
+    interval_seconds: float = Field(
+        default=900,
+        gt=0,
+        validation_alias=AliasChoices("interval_seconds", "interval-seconds"),
+    )
+    jitter_seconds: float = Field(
+        default=60,
+        ge=0,
+        validation_alias=AliasChoices("jitter_seconds", "jitter-seconds"),
+    )
+    token_refresh_seconds: float = Field(
+        default=300,
+        ge=0,
+        validation_alias=AliasChoices("token_refresh_seconds", "token-refresh-seconds"),
+    )
+
+
+class SimulationSettings(BaseModel):
+    """
+    Settings for simulating runs over a range of dates.
+
+    Runs are simulated at each tick from the start of the first day, by default today, over the given number of days.
+    The absence events and current automatic replies of all mailboxes are fetched once. If a snapshot file is given,
+    they are loaded from it instead if it exists, and written to it otherwise.
+    """
+
+    start: date | None = None
+    days: int = Field(default=365, ge=1)
+    tick_minutes: int = Field(
+        default=60,
+        ge=1,
+        validation_alias=AliasChoices("tick_minutes", "tick-minutes"),
+    )
+    snapshot_file: Path | None = Field(
+        default=None,
+        validation_alias=AliasChoices("snapshot_file", "snapshot-file"),
+    )
+
+
+class InstrumentationSettings(BaseModel):
+    """
+    Settings for exporting timings and counters of each run.
+
+    Timings of token acquisition, cache access, Microsoft Graph requests and template rendering are always recorded and
+    logged in summary at the end of each run. Optionally, they are also written to a JSON file, to a Prometheus textfile
+    for the node exporter, or sent as spans to an OpenTelemetry collector via OTLP over HTTP.
+    """
+
+    json_file: Path | None = Field(
+        default=None, validation_alias=AliasChoices("json_file", "json-file")
+    )
+    prometheus_file: Path | None = Field(
+        default=None,
+        validation_alias=AliasChoices("prometheus_file", "prometheus-file"),
+    )
+    otlp_endpoint: str | None = Field(
+        default=None,
+        validation_alias=AliasChoices("otlp_endpoint", "otlp-endpoint"),
+    )
 
 
 class AbstractSettings(BaseSettings, ABC):
@@ -353,15 +983,17 @@ class AbstractSettings(BaseSettings, ABC):
         Adds Azure Key Vault as a settings source if AZURE_KEY_VAULT_URL environment variable is set.
         """
         azure_key_vault_url = os.environ.get("AZURE_KEY_VAULT_URL")
-        az_key_vault_settings = (
-            AzureKeyVaultSettingsSource(
+        az_key_vault_settings = None
+
+        if azure_key_vault_url:
+            from pydantic_settings import AzureKeyVaultSettingsSource
+
+            az_key_vault_settings = AzureKeyVaultSettingsSource(
                 settings_cls,
                 azure_key_vault_url,
-                DefaultAzureCredential(),
+                get_azure_credential(),
             )
-            if azure_key_vault_url
-            else None
-        )
+
         return (
             init_settings,
             env_settings,
@@ -383,6 +1015,17 @@ class InitSettings(AbstractSettings):
     # App registration settings.
     app: AppRegistrationSettings = Field(default_factory=AppRegistrationSettings)
 
+    # Graph client settings.
+    graph: GraphSettings = Field(default_factory=GraphSettings)
+
+    # Multi-mailbox settings.
+    fleet: FleetSettings = Field(default_factory=FleetSettings)
+
+    # Instrumentation settings.
+    instrumentation: InstrumentationSettings = Field(
+        default_factory=InstrumentationSettings
+    )
+
 
 class RunSettings(InitSettings):
     """
@@ -402,3 +1045,28 @@ class RunSettings(InitSettings):
     dry_run: bool = Field(
         default=False, validation_alias=AliasChoices("dry_run", "dry-run")
     )
+
+    delta_sync: bool = Field(
+        default=False, validation_alias=AliasChoices("delta_sync", "delta-sync")
+    )
+
+    skip_unchanged: bool = Field(
+        default=False,
+        validation_alias=AliasChoices("skip_unchanged", "skip-unchanged"),
+    )
+
+
+class ServeSettings(RunSettings):
+    """
+    Application settings needed for running the application continuously.
+    """
+
+    scheduler: SchedulerSettings = Field(default_factory=SchedulerSettings)
+
+
+class SimulateSettings(RunSettings):
+    """
+    Application settings needed for simulating runs.
+    """
+
+    simulation: SimulationSettings = Field(default_factory=SimulationSettings)
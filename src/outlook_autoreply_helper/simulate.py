@@ -0,0 +1,284 @@
+import bisect
+import itertools
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from pydantic import BaseModel, TypeAdapter
+
+from .plan import MailboxState, plan
+from .settings import AbsenceSettings, AbstractTemplateSource
+from .templates import TemplateRegistry
+from .util import get_datetime, merge_adjacent_events
+
+UTC = ZoneInfo("UTC")
+
+
+class CalendarSnapshot(BaseModel):
+    """
+    Absence events and automatic replies of a mailbox at a point in time, which runs are simulated on.
+    """
+
+    mailbox: str | None = None
+    # IANA name of the mailbox time zone.
+    timezone: str
+    # Automatic replies settings at the time of the snapshot.
+    auto_reply_settings: dict
+    # Absence events, ordered by start.
+    events: list[dict]
+
+
+class SimulatedChange(BaseModel):
+    """
+    Change to the automatic replies of a mailbox that a run at the given time would have made.
+    """
+
+    time: datetime
+    mailbox: str | None = None
+    reason: str
+    start: datetime | None = None
+    end: datetime | None = None
+    # Names of the updated properties.
+    properties: list[str]
+
+
+# Serializes snapshots of several mailboxes to JSON and back.
+SNAPSHOTS_ADAPTER = TypeAdapter(list[CalendarSnapshot])
+
+# Serializes simulated changes to JSON.
+CHANGES_ADAPTER = TypeAdapter(list[SimulatedChange])
+
+
+class SimulatedClock:
+    """
+    Clock that ticks at a fixed interval from a start time, in place of the current time of a run.
+
+    Can skip ahead several ticks at once, so that ticks at which the outcome of a run cannot change are not simulated
+    at all.
+    """
+
+    def __init__(self, start: datetime, tick: timedelta):
+        self.start = start
+        self.tick = tick
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def get_tick(self, time: datetime) -> datetime:
+        """Return the first tick at or after the given time."""
+        return self.start - ((self.start - time) // self.tick) * self.tick
+
+    def advance(self, time: datetime | None = None) -> None:
+        """Advance to the next tick, or to the first tick at or after the given time if that is later."""
+        self.now = max(self.now + self.tick, self.get_tick(time or self.now))
+
+
+class _Calendar:
+    """
+    Absence events of a snapshot, answering the calendar view queries of a run for any time.
+    """
+
+    def __init__(self, settings: AbsenceSettings, snapshot: CalendarSnapshot):
+        self.timezone = ZoneInfo(snapshot.timezone)
+        self.future_period = timedelta(days=settings.future_period_days)
+        self.lookahead = timedelta(days=settings.lookahead_days)
+
+        self.events = sorted(
+            [
+                (
+                    get_datetime(event["start"]).replace(tzinfo=self.timezone),
+                    get_datetime(event["end"]).replace(tzinfo=self.timezone),
+                    event,
+                )
+                for event in snapshot.events
+            ],
+            key=lambda item: item[0],
+        )
+        self.starts = [start for start, _, _ in self.events]
+        # Latest end of the events up to each one, so that events that ended before a time can be skipped by bisection.
+        self.ends = list(itertools.accumulate((end for _, end, _ in self.events), max))
+
+        # Times at which the next absence event may change: when an event enters the future period, or ends. The future
+        # period is a fixed duration, so it is subtracted in UTC to be independent of DST transitions.
+        self.changes = sorted(
+            time
+            for start, end, _ in self.events
+            for time in (start.astimezone(UTC) - self.future_period, end)
+        )
+
+        # Adjacent events only depend on the next absence event, so they are determined once per event.
+        self._adjacent_events: dict[int, list[dict]] = {}
+
+    def _overlapping(self, start: datetime, end: datetime) -> Iterator[int]:
+        """Return the indexes of the events overlapping the given period, ordered by start."""
+        for i in range(
+            bisect.bisect_right(self.ends, start), bisect.bisect_left(self.starts, end)
+        ):
+            if self.events[i][1] > start:
+                yield i
+
+    def get_next_absence(self, now: datetime) -> int | None:
+        """Return the index of the next absence event within the future period, as the run would query it."""
+        return next(self._overlapping(now, now + self.future_period), None)
+
+    def get_adjacent_events(self, index: int) -> list[dict]:
+        """Return the events adjacent to or overlapping with an event, as the run would determine them."""
+        if index not in self._adjacent_events:
+            start, _, event = self.events[index]
+            self._adjacent_events[index] = merge_adjacent_events(
+                self.timezone,
+                event,
+                (
+                    self.events[i][2]
+                    for i in self._overlapping(start, start + self.lookahead)
+                ),
+            )
+        return self._adjacent_events[index]
+
+    def get_changes_from(self, now: datetime) -> Iterator[datetime]:
+        """Return the times from the given one on at which the next absence event may change, in ascending order."""
+        for i in range(bisect.bisect_left(self.changes, now), len(self.changes)):
+            yield self.changes[i]
+
+
+class _CachingTemplateRegistry(TemplateRegistry):
+    """
+    Template registry that renders each template source only once per set of variables.
+
+    Rendered templates are kept for the lifetime of the registry, and changes to template sources are not picked up.
+    """
+
+    def __init__(self, settings: AbsenceSettings):
+        super().__init__(settings)
+        self._rendered: dict[tuple, str] = {}
+
+    def render(self, source: AbstractTemplateSource, **kwargs) -> str:
+        key = (id(source), *kwargs.items())
+        if key not in self._rendered:
+            self._rendered[key] = super().render(source, **kwargs)
+        return self._rendered[key]
+
+
+def _get_next_tick(clock: SimulatedClock, times: Iterable[datetime]) -> datetime | None:
+    """
+    Return the first tick after the current one at which a condition that changes at any of the given times, in
+    ascending order and not before the current tick, may have changed. Conditions may change at or just after such a
+    time, so a time that is itself a tick is also seen at the tick after.
+    """
+    for time in times:
+        tick = clock.get_tick(time)
+        if tick > clock.now:
+            return tick
+        if tick == time:
+            return tick + clock.tick
+    return None
+
+
+def simulate_mailbox(
+    settings: AbsenceSettings,
+    snapshot: CalendarSnapshot,
+    templates: TemplateRegistry,
+    clock: SimulatedClock,
+    end: datetime,
+) -> list[SimulatedChange]:
+    """
+    Simulate runs for a mailbox at each tick of a clock until the given end, applying the changes each run would make
+    to the automatic replies before the next one.
+
+    The outcome of a run only depends on the time via the next absence event and the end of the scheduled automatic
+    replies. Until either may change, the simulation skips ahead, so that only a few runs per absence event are
+    evaluated, independent of the tick.
+
+    Args:
+        settings (AbsenceSettings): Absence settings
+        snapshot (CalendarSnapshot): Absence events and initial automatic replies of the mailbox
+        templates (TemplateRegistry): Registry of the reply templates
+        clock (SimulatedClock): Clock of the simulated runs, at the time of the first run
+        end (datetime): End of the simulated period
+
+    Returns:
+        list[SimulatedChange]: Changes to the automatic replies, in the order they would have been made
+    """
+    calendar = _Calendar(settings, snapshot)
+    auto_reply_settings = dict(snapshot.auto_reply_settings)
+    changes = []
+
+    while clock() < end:
+        now = clock()
+
+        index = calendar.get_next_absence(now)
+        mailbox_plan = plan(
+            settings,
+            MailboxState(
+                mailbox=snapshot.mailbox,
+                timezone=calendar.timezone,
+                auto_reply_settings=auto_reply_settings,
+                next_absence=calendar.events[index][2] if index is not None else None,
+                adjacent_events=calendar.get_adjacent_events(index)
+                if index is not None
+                else [],
+            ),
+            templates,
+            now,
+        )
+
+        if mailbox_plan.action == "update":
+            auto_reply_settings = {**auto_reply_settings, **mailbox_plan.changes}
+            changes.append(
+                SimulatedChange(
+                    time=now,
+                    mailbox=snapshot.mailbox,
+                    reason=mailbox_plan.reason,
+                    start=mailbox_plan.start,
+                    end=mailbox_plan.end,
+                    properties=list(mailbox_plan.changes),
+                )
+            )
+            clock.advance()
+            continue
+
+        # Nothing changes until the next absence event or the scheduled automatic replies may change.
+        ticks = [_get_next_tick(clock, calendar.get_changes_from(now))]
+        if auto_reply_settings.get("status") == "scheduled":
+            scheduled_end = get_datetime(auto_reply_settings["scheduledEndDateTime"])
+            if scheduled_end >= now:
+                ticks.append(_get_next_tick(clock, [scheduled_end]))
+
+        clock.advance(min((tick for tick in ticks if tick is not None), default=end))
+
+    return changes
+
+
+def simulate(
+    settings: AbsenceSettings,
+    snapshots: Iterable[CalendarSnapshot],
+    start: datetime,
+    end: datetime,
+    tick: timedelta,
+) -> list[SimulatedChange]:
+    """
+    Simulate runs for several mailboxes at each tick over a period.
+
+    The reply templates are rendered only once per absence period, since the simulation does not pick up changes to
+    them anyway.
+
+    Args:
+        settings (AbsenceSettings): Absence settings
+        snapshots (Iterable[CalendarSnapshot]): Absence events and initial automatic replies of each mailbox
+        start (datetime): Time of the first simulated run
+        end (datetime): End of the simulated period
+        tick (timedelta): Interval between simulated runs
+
+    Returns:
+        list[SimulatedChange]: Changes to the automatic replies, by mailbox in the given order, then by time
+    """
+    templates = _CachingTemplateRegistry(settings)
+
+    return [
+        change
+        for snapshot in snapshots
+        for change in simulate_mailbox(
+            settings, snapshot, templates, SimulatedClock(start, tick), end
+        )
+    ]
@@ -0,0 +1,98 @@
+import logging
+import threading
+from datetime import datetime
+
+import jinja2
+
+from .instrumentation import span
+from .settings import AbsenceSettings, AbstractTemplateSource
+
+log = logging.getLogger(__name__)
+
+
+class _TemplateSourceLoader(jinja2.BaseLoader):
+    """
+    Jinja2 loader for template sources registered by name.
+
+    Each loaded template is considered up to date as long as the version of its source does not change, so the
+    environment only recompiles a template after its source has changed.
+    """
+
+    def __init__(self):
+        self.sources: dict[str, AbstractTemplateSource] = {}
+
+    def get_source(self, environment: jinja2.Environment, template: str):
+        source = self.sources.get(template)
+        if source is None:
+            raise jinja2.TemplateNotFound(template)
+
+        # Determine the version before reading the content, so that a concurrent change is detected on the next use.
+        version = source.get_version()
+        content = source.get_template()
+
+        log.debug(f"Loading template {template}.")
+
+        return content, None, lambda: source.get_version() == version
+
+
+class TemplateRegistry:
+    """
+    Registry of compiled reply templates.
+
+    Templates are compiled once and reused for all subsequent renders, until their source changes. Local templates are
+    checked by file modification time and size, string templates by content hash. If a bytecode cache directory is
+    configured, compiled templates are also stored on disk and reused across processes.
+
+    A registry is safe to share between threads.
+    """
+
+    def __init__(self, settings: AbsenceSettings):
+        bytecode_cache = None
+        if settings.template_cache_dir is not None:
+            settings.template_cache_dir.mkdir(parents=True, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(
+                str(settings.template_cache_dir)
+            )
+
+        self._loader = _TemplateSourceLoader()
+        self._lock = threading.Lock()
+
+        self.env = jinja2.Environment(
+            loader=self._loader, bytecode_cache=bytecode_cache, auto_reload=True
+        )
+        self.env.filters["date"] = (
+            lambda value: value.strftime(settings.date_format)
+            if isinstance(value, datetime)
+            else value
+        )
+
+    def get_template(self, source: AbstractTemplateSource) -> jinja2.Template:
+        """
+        Return the compiled template for the given source, compiling it only if necessary.
+
+        Args:
+            source (AbstractTemplateSource): Template source
+
+        Returns:
+            jinja2.Template: Compiled template
+        """
+        name = source.get_name()
+
+        with self._lock:
+            self._loader.sources.setdefault(name, source)
+
+        return self.env.get_template(name)
+
+    def render(self, source: AbstractTemplateSource, **kwargs) -> str:
+        """
+        Render the template for the given source.
+
+        Args:
+            source (AbstractTemplateSource): Template source
+            **kwargs: Template variables
+
+        Returns:
+            str: Rendered template
+        """
+        with span("template.render", template=source.get_name()):
+            return self.get_template(source).render(**kwargs)
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+import msal
+from msal_extensions.persistence import BasePersistence
+
+from .instrumentation import span
+
+log = logging.getLogger(__name__)
+
+# Shard of entries that belong to no account, e.g. application metadata.
+_APP_SHARD = "app"
+
+# File of the index of all accounts, by shard. Shards are named after home account IDs, which never start with "_".
+_INDEX = "_index"
+
+# Credential types stored in the shard of their account, and only read once an account is looked up.
+_ACCOUNT_CREDENTIAL_TYPES = frozenset({"AccessToken", "RefreshToken", "IdToken"})
+
+
+def _get_shard(entry: dict) -> str:
+    """Return the name of the shard an entry belongs to, i.e. its home account, as a safe file name."""
+    home_account_id = entry.get("home_account_id")
+    if not home_account_id:
+        return _APP_SHARD
+    return re.sub(r"[^\w.-]", "_", home_account_id.lower())
+
+
+class ShardedTokenCache(msal.SerializableTokenCache):
+    """
+    Token cache that stores the entries of each account in a file of its own.
+
+    When the cache is created, only the shard of application metadata and a small index of all accounts are read. The
+    index lets MSAL find an account by username without reading its tokens. The shard of an account is only read once
+    its tokens are looked up, so a process working on a single account never reads the tokens of all others. Lookups
+    not restricted to an account read all shards. Each shard is read at most once, and all lookups are then answered
+    from memory, without file locks or reloading.
+
+    Each change is written right away, but only to the shard of the account it concerns, and only if its content
+    changed. A shard is replaced atomically, so that other processes never read a partially written shard. Processes
+    working on different accounts therefore never write the same shard. Accounts that other processes add in the
+    meantime are only seen by caches created afterwards. The index is rewritten when accounts are added or removed. If
+    it misses a shard, e.g. since another process added an account at the same time, that shard is read and indexed
+    by the next cache created.
+
+    All changes due to a single token response are written at once.
+    """
+
+    def __init__(self, directory: Path, persistence: Callable[[Path], BasePersistence]):
+        """
+        Args:
+            directory (Path): Directory holding the shards
+            persistence (Callable[[Path], BasePersistence]): Function returning the persistence for a shard file, e.g.
+                with encryption
+        """
+        super().__init__()
+        self.directory = directory
+        self._persistence = persistence
+
+        # Entries of the shards read so far, in the format of the serialized cache, and hashes of the shard files as
+        # last read or written.
+        self._shards: dict[str, dict[str, dict[str, dict]]] = {}
+        self._hashes: dict[str, str] = {}
+
+        # Account entries by shard, of all shards.
+        self._index: dict[str, dict[str, dict]] = {}
+        self._index_changed = False
+
+        # Locks that keep reads and writes of the same shard in order.
+        self._read_locks: dict[str, threading.Lock] = {}
+        self._write_locks: dict[str, threading.Lock] = {}
+        self._dirty: set[str] = set()
+        self._local = threading.local()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _get_path(self, shard: str) -> Path:
+        return self.directory / f"{shard}.json"
+
+    def _read(self, path: Path) -> tuple[dict, str]:
+        """Read a shard or the index, and return its content and the hash of its content."""
+        content = self._persistence(path).load()
+        try:
+            return json.loads(content), hashlib.sha256(content.encode()).hexdigest()
+        except ValueError as e:
+            raise RuntimeError(f"Failed to read token cache shard {path}.") from e
+
+    def _load(self) -> None:
+        """Read the index and the shard of application metadata, and index the accounts of shards missing in it."""
+        with span("token_cache.load", directory=str(self.directory)):
+            shards = {
+                path.stem
+                for path in self.directory.glob("*.json")
+                if path.stem != _INDEX
+            }
+
+            index_path = self._get_path(_INDEX)
+            if index_path.exists():
+                self._index = {
+                    shard: accounts
+                    for shard, accounts in self._read(index_path)[0].items()
+                    if shard in shards
+                }
+
+            missing = shards - set(self._index) - {_APP_SHARD}
+            for shard in sorted(missing | ({_APP_SHARD} & shards)):
+                self._load_shard(shard)
+
+            for accounts in self._index.values():
+                self._cache.setdefault("Account", {}).update(accounts)
+
+        if missing:
+            log.debug(f"Indexed accounts of {len(missing)} token cache shard(s).")
+            self._index_changed = True
+            self._write_index()
+
+        log.debug(
+            f"Loaded token cache index with {len(self._index)} shard(s). Read {len(self._shards)} shard(s)."
+        )
+
+    def _load_shard(self, shard: str) -> None:
+        """Read a shard into memory, unless already read or not stored yet."""
+        with self._lock:
+            lock = self._read_locks.setdefault(shard, threading.Lock())
+
+        with lock:
+            path = self._get_path(shard)
+            if shard in self._shards or not path.exists():
+                return
+
+            with span("token_cache.read", shard=shard):
+                state, content_hash = self._read(path)
+
+            with self._lock:
+                self._shards[shard] = state
+                self._hashes[shard] = content_hash
+                if shard != _APP_SHARD:
+                    self._index[shard] = dict(state.get("Account", {}))
+                for credential_type, entries in state.items():
+                    self._cache.setdefault(credential_type, {}).update(entries)
+
+    def search(self, credential_type, target=None, query=None, *, now=None):
+        # Read the shard of the account looked up, or all shards if the lookup is not restricted to an account.
+        if credential_type in _ACCOUNT_CREDENTIAL_TYPES:
+            home_account_id = (query or {}).get("home_account_id")
+            if home_account_id:
+                self._load_shard(_get_shard({"home_account_id": home_account_id}))
+            else:
+                for shard in sorted(self._index):
+                    self._load_shard(shard)
+
+        return super().search(credential_type, target=target, query=query, now=now)
+
+    def merge(self, state: str) -> None:
+        """
+        Add all entries of a serialized token cache, e.g. to migrate from a single token cache file.
+
+        Args:
+            state (str): Serialized token cache
+        """
+        self._local.deferred = True
+        try:
+            for credential_type, entries in (
+                json.loads(state) if state else {}
+            ).items():
+                for entry in entries.values():
+                    self.modify(credential_type, entry, entry)
+        finally:
+            self._local.deferred = False
+        self._write_dirty_shards()
+
+    def add(self, event, **kwargs):
+        self._local.deferred = True
+        try:
+            super().add(event, **kwargs)
+        finally:
+            self._local.deferred = False
+        self._write_dirty_shards()
+
+    def modify(self, credential_type, old_entry, new_key_value_pairs=None):
+        # Read the shard before changing it, so that its other entries are written back as well.
+        shard = _get_shard(old_entry)
+        self._load_shard(shard)
+
+        super().modify(credential_type, old_entry, new_key_value_pairs)
+
+        key = self.key_makers[credential_type](**old_entry)
+
+        with self._lock:
+            entry = self._cache.get(credential_type, {}).get(key)
+            entries = self._shards.setdefault(shard, {}).setdefault(credential_type, {})
+            if entry is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+            self._dirty.add(shard)
+
+            if credential_type == "Account" and self._index.get(shard) != entries:
+                self._index[shard] = dict(entries)
+                self._index_changed = True
+
+        if not getattr(self._local, "deferred", False):
+            self._write_dirty_shards()
+
+    def _write_dirty_shards(self) -> None:
+        """Write all shards changed since they were last written."""
+        with self._lock:
+            shards = sorted(self._dirty)
+            self._dirty.clear()
+            locks = [
+                self._write_locks.setdefault(shard, threading.Lock())
+                for shard in shards
+            ]
+
+        for shard, lock in zip(shards, locks):
+            with lock:
+                with self._lock:
+                    content = json.dumps(self._shards[shard], indent=4)
+                content_hash = hashlib.sha256(content.encode()).hexdigest()
+
+                if content_hash == self._hashes.get(shard):
+                    continue
+
+                self._write_shard(shard, content)
+                self._hashes[shard] = content_hash
+
+        self._write_index()
+
+        # All changes are stored, so there is nothing left to save.
+        self.has_state_changed = False
+
+    def _write_index(self) -> None:
+        """Write the index of all accounts, if it changed since it was last written."""
+        with self._lock:
+            lock = self._write_locks.setdefault(_INDEX, threading.Lock())
+
+        with lock:
+            with self._lock:
+                if not self._index_changed:
+                    return
+                self._index_changed = False
+                content = json.dumps(self._index, indent=4)
+
+            self._write_shard(_INDEX, content)
+
+    def _write_shard(self, shard: str, content: str) -> None:
+        """Replace a shard file atomically with the given content."""
+        path = self._get_path(shard)
+        temp_path = path.with_name(
+            f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+
+        with span("token_cache.write", shard=shard):
+            self._persistence(temp_path).save(content)
+            os.replace(temp_path, path)
+
+        log.debug(f"Saved token cache shard {shard}.")
@@ -0,0 +1,90 @@
+import functools
+import json
+import logging
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# Precompiled mapping from Windows time zones to IANA time zones, shipped with the package.
+WINDOWS_ZONES_FILE = Path(__file__).parent / "windows_zones.json"
+
+
+@functools.cache
+def _load_windows_zones() -> dict[str, str]:
+    """
+    Load the Windows to IANA time zone mapping shipped with the package.
+
+    The mapping is only loaded on first use and kept in memory afterwards.
+    """
+    with open(WINDOWS_ZONES_FILE, encoding="utf-8") as f:
+        index = json.load(f)
+
+    log.debug(f"Loaded Windows time zone index version {index['version']}.")
+
+    return index["zones"]
+
+
+def get_iana_timezone(windows_tz: str) -> str | None:
+    """
+    Look up the IANA time zone for a Windows time zone.
+
+    Args:
+        windows_tz (str): Windows time zone name, e.g. W. Europe Standard Time
+
+    Returns:
+        str | None: IANA time zone name, e.g. Europe/Berlin, or None if the Windows time zone is unknown
+    """
+    return _load_windows_zones().get(windows_tz)
+
+
+def build_windows_zones(xml_text: str) -> dict:
+    """
+    Build a Windows to IANA time zone index from the CLDR windowsZones.xml file.
+
+    Uses the default mapping for each Windows time zone, i.e. the one for territory 001.
+
+    Args:
+        xml_text (str): Content of windowsZones.xml
+
+    Returns:
+        dict: The index with its version and the mapping
+    """
+    import xml.etree.ElementTree as ElementTree
+
+    root = ElementTree.fromstring(xml_text)
+
+    map_timezones = root.find(".//mapTimezones")
+    if map_timezones is None:
+        raise ValueError("No time zone mappings found in CLDR file.")
+
+    zones = {
+        map_zone.get("other"): map_zone.get("type").split()[0]
+        for map_zone in map_timezones.findall("mapZone")
+        if map_zone.get("territory") == "001"
+    }
+
+    return {
+        "version": map_timezones.get("typeVersion", "unknown"),
+        "zones": dict(sorted(zones.items())),
+    }
+
+
+def update_windows_zones(
+    cldr_file: Path, output_file: Path = WINDOWS_ZONES_FILE
+) -> None:
+    """
+    Regenerate the Windows to IANA time zone index from a local copy of the CLDR windowsZones.xml file.
+
+    Args:
+        cldr_file (Path): Path to windowsZones.xml
+        output_file (Path): Path of the index to write. Defaults to the index shipped with the package.
+    """
+    index = build_windows_zones(cldr_file.read_text(encoding="utf-8"))
+
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+        f.write("\n")
+
+    log.info(
+        f"Wrote {len(index['zones'])} time zone mappings (version {index['version']}) to {output_file}."
+    )
@@ -1,91 +1,178 @@
 import logging
+import re
+from collections.abc import AsyncIterable, Iterable
+from contextlib import aclosing
 from datetime import datetime, timedelta, tzinfo
 from zoneinfo import ZoneInfo
 
-import requests
-
+from .graph import AsyncGraphClient, GraphClient, select
 from .settings import RunSettings
 
 log = logging.getLogger(__name__)
 
+# Fractional seconds, which the Microsoft Graph API returns with seven digits.
+_FRACTION_PATTERN = re.compile(r"(?<=:\d\d)\.(\d+)")
+
 
 def get_datetime(obj: dict) -> datetime:
     """
     Convert a Microsoft Graph API datetime object to a timezone-aware datetime.
 
+    Fractional seconds are cut or padded to microseconds, since datetime.fromisoformat only accepts six digits before
+    Python 3.11, whereas the Microsoft Graph API returns seven.
+
     Args:
         obj (dict): A dictionary containing 'dateTime' and 'timeZone' keys
 
     Returns:
         datetime: A timezone-aware datetime object
     """
-    return datetime.fromisoformat(obj["dateTime"]).replace(
-        tzinfo=ZoneInfo(obj["timeZone"])
+    value = _FRACTION_PATTERN.sub(
+        lambda match: "." + match.group(1)[:6].ljust(6, "0"), obj["dateTime"]
     )
+    return datetime.fromisoformat(value).replace(tzinfo=ZoneInfo(obj["timeZone"]))
 
 
 def get_adjacent_events(
-    mailbox_timezone: tzinfo, settings: RunSettings, headers: dict, start_event: dict
+    mailbox_timezone: tzinfo,
+    settings: RunSettings,
+    graph: GraphClient,
+    start_event: dict,
 ) -> list:
     """
-    Recursively finds all adjacent or overlapping events, starting with the given event.
+    Finds all events adjacent to or overlapping with the given event, directly or via other such events.
 
-    Searches for consecutive absence events to create a continuous absence period.
+    Streams the absence events within the look-ahead horizon, ordered by start, and merges them on the fly to
+    determine the contiguous absence period. Further pages are not fetched once the period ends.
 
     Args:
         mailbox_timezone (tzinfo): User's mailbox timezone
         settings (Settings): Application settings
-        headers (dict): API request headers
+        graph (GraphClient): Microsoft Graph API client
         start_event (dict): Initial absence event
 
     Returns:
-        list: Adjacent or overlapping absence events
+        list: Adjacent or overlapping absence events, ordered by start
     """
-    adjacent_events = []
-    current_event = start_event
+    events = graph.iter_collection(
+        "/me/calendar/calendarView",
+        params=_get_adjacent_events_params(mailbox_timezone, settings, start_event),
+    )
 
-    while True:
-        # Get the start and end time of the current event.
-        current_start = get_datetime(current_event["start"]).replace(
-            tzinfo=mailbox_timezone
+    return merge_adjacent_events(mailbox_timezone, start_event, events)
+
+
+async def get_adjacent_events_async(
+    mailbox_timezone: tzinfo,
+    settings: RunSettings,
+    graph: AsyncGraphClient,
+    start_event: dict,
+) -> list:
+    """
+    Finds all events adjacent to or overlapping with the given event, using an async client. See get_adjacent_events.
+    """
+    async with aclosing(
+        graph.iter_collection(
+            "/me/calendar/calendarView",
+            params=_get_adjacent_events_params(mailbox_timezone, settings, start_event),
         )
-        current_end = get_datetime(current_event["end"]).replace(
+    ) as events:
+        return await merge_adjacent_events_async(mailbox_timezone, start_event, events)
+
+
+def _get_adjacent_events_params(
+    mailbox_timezone: tzinfo, settings: RunSettings, start_event: dict
+) -> dict:
+    """
+    Return the query parameters for the absence events within the look-ahead horizon of the given event.
+    """
+    start_time = get_datetime(start_event["start"]).replace(tzinfo=mailbox_timezone)
+    end_time = start_time + timedelta(days=settings.absence.lookahead_days)
+
+    return {
+        "startDateTime": start_time.isoformat(),
+        "endDateTime": end_time.isoformat(),
+        "$filter": f"subject eq '{settings.absence.keyword}' and isAllDay eq true",
+        "$orderby": "start/dateTime",
+        **select("event"),
+    }
+
+
+class _AdjacentEventsSweep:
+    """
+    Sweep over events ordered by start, merging them into the contiguous period that starts with a given event.
+
+    The period is extended as long as the next event starts no later than the end of the period so far. Events repeated
+    with the same ID are skipped.
+    """
+
+    def __init__(self, mailbox_timezone: tzinfo, start_event: dict):
+        self.mailbox_timezone = mailbox_timezone
+        self.period_end = get_datetime(start_event["end"]).replace(
             tzinfo=mailbox_timezone
         )
+        self.seen_ids = set()
+        self.adjacent_events = []
 
-        # Look for events starting from the end of the current event.
-        calendar_view_response = requests.get(
-            f"{settings.app.base_url}/me/calendar/calendarView",
-            headers=headers,
-            params={
-                "startDateTime": current_start.isoformat(),
-                "endDateTime": (
-                    current_start + timedelta(days=365)
-                ).isoformat(),  # Look up to a year ahead
-                "$filter": f"subject eq '{settings.absence.keyword}' and isAllDay eq true",
-                "$orderby": "start/dateTime",
-                "$top": 10,  # Get multiple events to check for adjacency/overlap
-            },
-        )
+    def add(self, event: dict) -> bool:
+        """
+        Add the next event to the period.
+
+        Returns:
+            bool: False if there is a gap between the period so far and the event, which ends the sweep
+        """
+        event_start = get_datetime(event["start"]).replace(tzinfo=self.mailbox_timezone)
+        if event_start > self.period_end:
+            # Gap between the period so far and all remaining events.
+            return False
+
+        if event["id"] not in self.seen_ids:
+            event_end = get_datetime(event["end"]).replace(tzinfo=self.mailbox_timezone)
 
-        calendar_events = calendar_view_response.json().get("value", [])
-        calendar_events = [x for x in calendar_events if x not in adjacent_events]
+            self.seen_ids.add(event["id"])
+            self.adjacent_events.append(event)
+            self.period_end = max(self.period_end, event_end)
 
-        # Find the next adjacent or overlapping event.
-        next_event = None
-        for event in calendar_events:
-            event_start = get_datetime(event["start"]).replace(tzinfo=mailbox_timezone)
+        return True
 
-            # Check if this event is adjacent (starts on the same day or the next day) or overlaps with the current
-            # event.
-            if event_start <= current_end:
-                next_event = event
-                break
 
-        if next_event is None:
+def merge_adjacent_events(
+    mailbox_timezone: tzinfo, start_event: dict, events: Iterable[dict]
+) -> list:
+    """
+    Merges events into the contiguous period that starts with the given event.
+
+    Sweeps over the events, extending the period as long as the next event starts no later than the end of the period
+    so far. Stops consuming events at the first gap.
+
+    Args:
+        mailbox_timezone (tzinfo): User's mailbox timezone
+        start_event (dict): Initial absence event
+        events (Iterable[dict]): Candidate absence events, ordered by start
+
+    Returns:
+        list: Adjacent or overlapping absence events, ordered by start
+    """
+    sweep = _AdjacentEventsSweep(mailbox_timezone, start_event)
+
+    for event in events:
+        if not sweep.add(event):
             break
 
-        adjacent_events.append(next_event)
-        current_event = next_event
+    return sweep.adjacent_events
+
+
+async def merge_adjacent_events_async(
+    mailbox_timezone: tzinfo, start_event: dict, events: AsyncIterable[dict]
+) -> list:
+    """
+    Merges events from an async iterable into the contiguous period that starts with the given event. See
+    merge_adjacent_events.
+    """
+    sweep = _AdjacentEventsSweep(mailbox_timezone, start_event)
+
+    async for event in events:
+        if not sweep.add(event):
+            break
 
-    return adjacent_events
+    return sweep.adjacent_events
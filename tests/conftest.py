@@ -0,0 +1,69 @@
+import functools
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+import pytest
+
+from outlook_autoreply_helper.settings import RunSettings, get_azure_credential
+
+from .mock_services import (
+    CLIENT_ID,
+    TENANT_ID,
+    MockServices,
+    create_settings as _create_settings,
+    sign_in as _sign_in,
+)
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch) -> MockServices:
+    """Mock services, installed for the test, with the temporary path as working directory."""
+    monkeypatch.chdir(tmp_path)
+    services = MockServices()
+    services.install(monkeypatch)
+    return services
+
+
+@pytest.fixture
+def create_settings(tmp_path) -> Callable[..., RunSettings]:
+    """Create settings for the mock services, with a local cache in the temporary path by default. See create_settings."""
+
+    def create(path: Path = tmp_path, **kwargs) -> RunSettings:
+        return _create_settings(path, **kwargs)
+
+    return create
+
+
+@pytest.fixture
+def sign_in(services) -> Callable[..., None]:
+    """Sign in to the given accounts of the mock services. See sign_in."""
+    return functools.partial(_sign_in, services)
+
+
+@pytest.fixture
+def key_vault(monkeypatch) -> Iterator[None]:
+    """Authenticate to the mock key vault as an application via environment variables."""
+    monkeypatch.setenv("AZURE_TENANT_ID", TENANT_ID)
+    monkeypatch.setenv("AZURE_CLIENT_ID", CLIENT_ID)
+    monkeypatch.setenv("AZURE_CLIENT_SECRET", "test")
+    get_azure_credential.cache_clear()
+    yield
+    get_azure_credential.cache_clear()
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Report the results of all benchmarks that ran."""
+    from .test_benchmark import RESULTS
+
+    if not RESULTS:
+        return
+
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(
+        f"{'scenario':<28}{'wall time [ms]':>16}{'round trips':>14}{'bytes':>12}{'peak memory [KiB]':>20}"
+    )
+    for name, result in RESULTS.items():
+        terminalreporter.write_line(
+            f"{name:<28}{result['wall_time'] * 1000:>16.1f}{result['round_trips']:>14}"
+            f"{result['bytes']:>12}{result['peak_memory'] / 1024:>20.0f}"
+        )
@@ -0,0 +1,534 @@
+"""
+In-process mock of the Microsoft identity platform, Microsoft Graph and Azure Key Vault.
+
+MSAL, the Graph client and the Azure SDK all send their requests via requests, the async Graph client via httpx. The
+mock replaces the transport adapters of both, serves all requests from in-memory state and counts round trips and
+transferred bytes.
+"""
+
+import base64
+import http
+import io
+import json
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.settings import RunSettings
+from outlook_autoreply_helper.util import get_datetime
+
+TENANT_ID = "3c0e9f1a-5d47-4f5e-9f36-2a8e0b1d7c11"
+CLIENT_ID = "8d7b4e2c-1f3a-4b6d-a5c8-9e0f1a2b3c4d"
+VAULT_URL = "https://benchmark.vault.azure.net"
+
+LOGIN_URL = "https://login.microsoftonline.com"
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+
+def _b64(value: dict) -> str:
+    return (
+        base64.urlsafe_b64encode(json.dumps(value).encode("utf-8"))
+        .rstrip(b"=")
+        .decode("ascii")
+    )
+
+
+def _graph_datetime(value: datetime) -> dict:
+    return {"dateTime": value.strftime("%Y-%m-%dT%H:%M:%S.0000000"), "timeZone": "UTC"}
+
+
+@dataclass
+class Mailbox:
+    """
+    State of a single mock mailbox.
+    """
+
+    username: str
+    oid: str = field(default_factory=lambda: str(uuid.uuid4()))
+    time_zone: str = "W. Europe Standard Time"
+    automatic_replies: dict = field(
+        default_factory=lambda: {
+            "status": "disabled",
+            "externalAudience": "all",
+            "internalReplyMessage": "",
+            "externalReplyMessage": "",
+            "scheduledStartDateTime": _graph_datetime(datetime(2020, 1, 1)),
+            "scheduledEndDateTime": _graph_datetime(datetime(2020, 1, 2)),
+        }
+    )
+    events: list[dict] = field(default_factory=list)
+
+    def add_absence(
+        self, start: date, days: int = 1, subject: str = "Vacation"
+    ) -> dict:
+        """Add an all-day absence event, with a body as large as Outlook typically creates."""
+        start_time = datetime(start.year, start.month, start.day)
+        event = {
+            "id": str(uuid.uuid4()),
+            "changeKey": str(uuid.uuid4()),
+            "subject": subject,
+            "isAllDay": True,
+            "start": _graph_datetime(start_time),
+            "end": _graph_datetime(start_time + timedelta(days=days)),
+            "body": {"contentType": "html", "content": "<html>" + "x" * 4000},
+            "bodyPreview": "x" * 255,
+            "location": {"displayName": ""},
+            "attendees": [],
+            "organizer": {"emailAddress": {"address": self.username}},
+            "showAs": "oof",
+        }
+        self.events.append(event)
+        return event
+
+    def get_settings(self) -> dict:
+        return {
+            "automaticRepliesSetting": self.automatic_replies,
+            "timeZone": self.time_zone,
+            "language": {"locale": "en-US", "displayName": "English (United States)"},
+            "workingHours": {
+                "daysOfWeek": ["monday", "tuesday", "wednesday", "thursday", "friday"],
+                "startTime": "08:00:00.0000000",
+                "endTime": "17:00:00.0000000",
+                "timeZone": {"name": self.time_zone},
+            },
+            "dateFormat": "dd.MM.yyyy",
+            "timeFormat": "HH:mm",
+            "delegateMeetingMessageDeliveryOptions": "sendToDelegateOnly",
+        }
+
+
+class MockServices:
+    """
+    Mock of the identity platform, Microsoft Graph and Azure Key Vault, with counters for benchmarking.
+    """
+
+    def __init__(self):
+        self.mailboxes: dict[str, Mailbox] = {}
+        self.secrets: dict[str, str] = {}
+        self._secret_versions: dict[tuple[str, str], str] = {}
+        # Users that sign in via device code flow, in order.
+        self.logins: list[str] = []
+        # Lifetime of issued access tokens in seconds.
+        self.token_lifetime = 3600
+        self._tokens: dict[str, str] = {}
+        self._device_codes: dict[str, str] = {}
+        self.reset_counters()
+
+    def add_mailbox(self, username: str) -> Mailbox:
+        mailbox = Mailbox(username)
+        self.mailboxes[username] = mailbox
+        return mailbox
+
+    def reset_counters(self) -> None:
+        self.round_trips = 0
+        self.bytes_transferred = 0
+        # URLs of all requests, in order.
+        self.urls: list[str] = []
+
+    def install(self, monkeypatch) -> None:
+        """Route all requests made via requests, or httpx if installed, to the mock."""
+        services = self
+
+        def send(adapter, request, **kwargs):
+            status, headers, body = services.handle(
+                request.method, request.url, request.headers, request.body
+            )
+            raw = HTTPResponse(
+                body=io.BytesIO(body),
+                headers={**headers, "Content-Length": str(len(body))},
+                status=status,
+                reason=http.HTTPStatus(status).phrase,
+                preload_content=False,
+                decode_content=False,
+                request_method=request.method,
+            )
+            return adapter.build_response(request, raw)
+
+        monkeypatch.setattr(HTTPAdapter, "send", send)
+
+        # Also route requests made via the optional async HTTP client.
+        try:
+            import httpx
+        except ImportError:
+            return
+
+        async def handle_async_request(transport, request):
+            status, headers, body = services.handle(
+                request.method, str(request.url), request.headers, request.content
+            )
+            return httpx.Response(
+                status,
+                headers={**headers, "Content-Length": str(len(body))},
+                content=body,
+                request=request,
+            )
+
+        monkeypatch.setattr(
+            httpx.AsyncHTTPTransport, "handle_async_request", handle_async_request
+        )
+
+    def handle(
+        self, method: str, url: str, headers, body: bytes | str | None
+    ) -> tuple[int, dict, bytes]:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+
+        parsed = urlparse(url)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+        if url.startswith(LOGIN_URL):
+            status, result = self._handle_login(method, parsed.path, query, body)
+        elif url.startswith(GRAPH_URL):
+            status, result = self._handle_graph(
+                method, parsed.path, query, headers, body
+            )
+        elif url.startswith(VAULT_URL):
+            status, result = self._handle_vault(method, parsed.path, headers, body)
+        else:
+            status, result = 404, {"error": {"code": "NotFound", "message": url}}
+
+        response_headers = {"Content-Type": "application/json"}
+        if status == 401 and url.startswith(VAULT_URL):
+            response_headers["WWW-Authenticate"] = (
+                f'Bearer authorization="{LOGIN_URL}/{TENANT_ID}", resource="https://vault.azure.net"'
+            )
+
+        content = json.dumps(result).encode("utf-8")
+
+        self.round_trips += 1
+        self.bytes_transferred += len(body) + len(content)
+        self.urls.append(url)
+
+        return status, response_headers, content
+
+    # Identity platform.
+
+    def _issue_tokens(self, subject: str, scope: str, mailbox: Mailbox | None) -> dict:
+        access_token = uuid.uuid4().hex
+        self._tokens[access_token] = subject
+        result = {
+            "token_type": "Bearer",
+            "scope": scope,
+            "expires_in": self.token_lifetime,
+            "ext_expires_in": self.token_lifetime,
+            "access_token": access_token,
+        }
+
+        if mailbox is not None:
+            refresh_token = uuid.uuid4().hex
+            self._tokens[refresh_token] = subject
+            now = int(time.time())
+            claims = {
+                "aud": CLIENT_ID,
+                "iss": f"{LOGIN_URL}/{TENANT_ID}/v2.0",
+                "iat": now,
+                "nbf": now,
+                "exp": now + 3600,
+                "oid": mailbox.oid,
+                "sub": mailbox.oid,
+                "tid": TENANT_ID,
+                "name": mailbox.username,
+                "preferred_username": mailbox.username,
+                "ver": "2.0",
+            }
+            result["refresh_token"] = refresh_token
+            result["id_token"] = f"{_b64({'alg': 'none'})}.{_b64(claims)}.sig"
+            result["client_info"] = _b64({"uid": mailbox.oid, "utid": TENANT_ID})
+
+        return result
+
+    def _handle_login(
+        self, method: str, path: str, query: dict, body: bytes
+    ) -> tuple[int, dict]:
+        form = {
+            key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()
+        }
+
+        if path.endswith("/discovery/instance"):
+            return 200, {
+                "tenant_discovery_endpoint": f"{LOGIN_URL}/{TENANT_ID}/v2.0/.well-known/openid-configuration",
+                "api-version": "1.1",
+                "metadata": [
+                    {
+                        "preferred_network": "login.microsoftonline.com",
+                        "preferred_cache": "login.windows.net",
+                        "aliases": [
+                            "login.microsoftonline.com",
+                            "login.windows.net",
+                            "login.microsoft.com",
+                            "sts.windows.net",
+                        ],
+                    }
+                ],
+            }
+
+        match = re.fullmatch(r"/([^/]+)/v2\.0/\.well-known/openid-configuration", path)
+        if match:
+            base = f"{LOGIN_URL}/{match.group(1)}"
+            return 200, {
+                "issuer": f"{LOGIN_URL}/{TENANT_ID}/v2.0",
+                "authorization_endpoint": f"{base}/oauth2/v2.0/authorize",
+                "token_endpoint": f"{base}/oauth2/v2.0/token",
+                "device_authorization_endpoint": f"{base}/oauth2/v2.0/devicecode",
+                "end_session_endpoint": f"{base}/oauth2/v2.0/logout",
+                "tenant_region_scope": "EU",
+            }
+
+        if path.endswith("/oauth2/v2.0/devicecode") and method == "POST":
+            device_code = uuid.uuid4().hex
+            self._device_codes[device_code] = form.get("scope", "")
+            return 200, {
+                "device_code": device_code,
+                "user_code": "BENCHMARK",
+                "verification_uri": "https://microsoft.com/devicelogin",
+                "expires_in": 900,
+                "interval": 5,
+                "message": "To sign in, enter the code BENCHMARK.",
+            }
+
+        if path.endswith("/oauth2/v2.0/token") and method == "POST":
+            grant_type = form.get("grant_type")
+            scope = form.get("scope", "")
+
+            if grant_type == "urn:ietf:params:oauth:grant-type:device_code":
+                scope = self._device_codes.pop(form.get("device_code"))
+                mailbox = self.mailboxes[self.logins.pop(0)]
+                return 200, self._issue_tokens(mailbox.username, scope, mailbox)
+
+            if grant_type == "refresh_token":
+                subject = self._tokens.get(form.get("refresh_token"))
+                if subject is None:
+                    return 400, {"error": "invalid_grant"}
+                return 200, self._issue_tokens(subject, scope, self.mailboxes[subject])
+
+            if grant_type == "client_credentials":
+                return 200, self._issue_tokens(form.get("client_id"), scope, None)
+
+            return 400, {"error": "unsupported_grant_type"}
+
+        return 404, {"error": "not_found"}
+
+    # Microsoft Graph.
+
+    def _get_mailbox(self, headers) -> Mailbox | None:
+        authorization = headers.get("Authorization", "")
+        subject = self._tokens.get(authorization.removeprefix("Bearer "))
+        return self.mailboxes.get(subject) if subject else None
+
+    def _handle_graph(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> tuple[int, dict]:
+        mailbox = self._get_mailbox(headers)
+        if mailbox is None:
+            return 401, {"error": {"code": "InvalidAuthenticationToken"}}
+
+        path = path.removeprefix("/v1.0")
+
+        if path == "/$batch" and method == "POST":
+            responses = []
+            for item in json.loads(body)["requests"]:
+                parsed = urlparse(item["url"])
+                status, result = self._handle_graph_resource(
+                    mailbox,
+                    item["method"],
+                    parsed.path,
+                    {k: v[0] for k, v in parse_qs(parsed.query).items()},
+                    item.get("body"),
+                )
+                responses.append(
+                    {
+                        "id": item["id"],
+                        "status": status,
+                        "headers": {"Content-Type": "application/json"},
+                        "body": result,
+                    }
+                )
+            return 200, {"responses": responses}
+
+        return self._handle_graph_resource(
+            mailbox, method, path, query, json.loads(body) if body else None
+        )
+
+    def _handle_graph_resource(
+        self, mailbox: Mailbox, method: str, path: str, query: dict, body: dict | None
+    ) -> tuple[int, dict]:
+        if path == "/me/mailboxSettings":
+            if method == "PATCH":
+                mailbox.automatic_replies.update(
+                    body.get("automaticRepliesSetting", {})
+                )
+            return 200, _select(mailbox.get_settings(), query)
+
+        if path == "/me/calendar/calendarView" and method == "GET":
+            return 200, self._get_calendar_view(mailbox, path, query)
+
+        if path == "/me/calendar/calendarView/delta" and method == "GET":
+            if "$deltatoken" in query:
+                return 200, {
+                    "value": [],
+                    "@odata.deltaLink": f"{GRAPH_URL}{path}?$deltatoken=1",
+                }
+            return 200, {
+                "value": self._filter_events(mailbox, query),
+                "@odata.deltaLink": f"{GRAPH_URL}{path}?$deltatoken=1",
+            }
+
+        return 404, {"error": {"code": "ResourceNotFound", "message": path}}
+
+    def _filter_events(self, mailbox: Mailbox, query: dict) -> list[dict]:
+        window_start = datetime.fromisoformat(query["startDateTime"])
+        window_end = datetime.fromisoformat(query["endDateTime"])
+
+        # Treat the event times as local times of the mailbox.
+        def local(value: dict) -> datetime:
+            return get_datetime(value).replace(tzinfo=window_start.tzinfo)
+
+        events = [
+            event
+            for event in mailbox.events
+            if local(event["start"]) < window_end and local(event["end"]) > window_start
+        ]
+
+        match = re.fullmatch(
+            r"subject eq '(.*)' and isAllDay eq true", query.get("$filter", "")
+        )
+        if match:
+            events = [
+                event
+                for event in events
+                if event["isAllDay"] and event["subject"] == match.group(1)
+            ]
+
+        return sorted(events, key=lambda event: event["start"]["dateTime"])
+
+    def _get_calendar_view(self, mailbox: Mailbox, path: str, query: dict) -> dict:
+        events = self._filter_events(mailbox, query)
+
+        top = int(query.get("$top", 10))
+        skip = int(query.get("$skip", 0))
+
+        result = _select(
+            {"value": [dict(event) for event in events[skip : skip + top]]}, query
+        )
+        if skip + top < len(events):
+            result["@odata.nextLink"] = (
+                f"{GRAPH_URL}{path}?{urlencode({**query, '$skip': skip + top})}"
+            )
+
+        return result
+
+    # Azure Key Vault.
+
+    def _handle_vault(
+        self, method: str, path: str, headers, body: bytes
+    ) -> tuple[int, dict]:
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {"error": {"code": "Unauthorized"}}
+
+        match = re.fullmatch(r"/secrets/([^/]+)/?([^/]*)", path)
+        if match is None:
+            return 404, {"error": {"code": "NotFound"}}
+
+        name, version = match.groups()
+
+        if method == "PUT":
+            version = uuid.uuid4().hex
+            self.secrets[name] = json.loads(body)["value"]
+            self._secret_versions[name, version] = self.secrets[name]
+        elif name not in self.secrets or (
+            version and (name, version) not in self._secret_versions
+        ):
+            return 404, {
+                "error": {
+                    "code": "SecretNotFound",
+                    "message": f"A secret with (name/id) {name} was not found in this key vault.",
+                }
+            }
+
+        return 200, {
+            "value": self._secret_versions[name, version]
+            if version
+            else self.secrets[name],
+            "id": f"{VAULT_URL}/secrets/{name}/{version or uuid.uuid4().hex}",
+            "attributes": {"enabled": True, "created": 0, "updated": 0},
+        }
+
+
+def _select(result: dict, query: dict) -> dict:
+    """Apply a $select projection to a resource or collection."""
+    if "$select" not in query:
+        return result
+
+    fields = set(query["$select"].split(",")) | {"id"}
+
+    def project(item: dict) -> dict:
+        return {key: value for key, value in item.items() if key in fields}
+
+    if "value" in result:
+        return {**result, "value": [project(item) for item in result["value"]]}
+
+    return project(result)
+
+
+# Reply template of the settings created by create_settings.
+TEMPLATE = "<p>I am out of office from {{ start | date }} to {{ end | date }}.</p>"
+
+
+def create_settings(
+    path: Path,
+    cache: str = "local",
+    settings_cls: type[RunSettings] = RunSettings,
+    **kwargs,
+) -> RunSettings:
+    """
+    Create settings for the mock services, with a local cache in the given path or a cache in the mock key vault.
+
+    The cache is either "local", "sharded", i.e. local with a token cache directory, "keyvault", or "bundle", i.e. in
+    the key vault with all state bundled in the secret "state".
+    """
+    if cache in ("keyvault", "bundle"):
+        cache_settings = {"type": "keyvault", "key_vault_url": VAULT_URL}
+        if cache == "bundle":
+            cache_settings["bundle_secret_name"] = "state"
+    else:
+        cache_settings = {
+            "type": "local",
+            "token_cache_file": path / "token_cache.bin",
+            "delta_cache_file": path / "delta_cache.json",
+            "fingerprint_cache_file": path / "fingerprint_cache.json",
+            "authority_cache_file": path / "authority_cache.json",
+        }
+        if cache == "sharded":
+            cache_settings["token_cache_dir"] = path / "token_cache"
+
+    return settings_cls(
+        app={
+            "tenant_id": TENANT_ID,
+            "client_id": CLIENT_ID,
+            "auth_flow": "device_code",
+        },
+        cache=cache_settings,
+        absence={
+            "internal_reply_template": {"type": "string", "content": TEMPLATE},
+            "external_reply_template": {"type": "string", "content": TEMPLATE},
+        },
+        **kwargs,
+    )
+
+
+def sign_in(services: MockServices, settings: RunSettings, *usernames: str) -> None:
+    """Sign in to the given accounts via the init command, in order."""
+    services.logins.extend(usernames)
+    if settings.fleet.mailboxes:
+        command.init_fleet(settings)
+    else:
+        command.init(settings)
@@ -0,0 +1,142 @@
+import gc
+import time
+from datetime import date, timedelta
+
+import msal
+import requests
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.auth import (
+    TokenManager,
+    _AuthorityCachingHttpClient,
+    get_msal_app,
+)
+from outlook_autoreply_helper.graph import GraphClient
+from outlook_autoreply_helper.settings import AuthorityCache, KeyVaultCacheSettings
+
+from .mock_services import LOGIN_URL
+
+
+def test_warm_run_skips_authority_discovery(services, create_settings, sign_in):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    services.reset_counters()
+    command.run(create_settings())
+
+    assert services.urls
+    assert not [url for url in services.urls if url.startswith(LOGIN_URL)]
+
+
+def test_expired_authority_metadata_is_discovered_again(
+    tmp_path, services, create_settings, sign_in
+):
+    services.add_mailbox("adele@example.com")
+    sign_in(create_settings(), "adele@example.com")
+
+    authority_cache_file = tmp_path / "authority_cache.json"
+    authority_cache = AuthorityCache.model_validate_json(
+        authority_cache_file.read_text()
+    )
+    (key,) = [key for key in authority_cache.responses if "openid-configuration" in key]
+    entry = authority_cache.responses[key]
+    expired = entry.expires - timedelta(days=2)
+    entry.expires = expired
+    authority_cache_file.write_text(authority_cache.model_dump_json())
+
+    services.reset_counters()
+    command.run(create_settings())
+
+    assert [url for url in services.urls if url.startswith(LOGIN_URL)] == [key]
+    entry = AuthorityCache.model_validate_json(
+        authority_cache_file.read_text()
+    ).responses[key]
+    assert entry.expires > expired + timedelta(days=1)
+
+
+def test_token_manager_refreshes_ahead_of_expiry(
+    monkeypatch, services, create_settings, sign_in, key_vault
+):
+    services.add_mailbox("adele@example.com")
+    services.token_lifetime = 2
+    settings = create_settings(cache="keyvault")
+    sign_in(settings, "adele@example.com")
+
+    saved = []
+    put_token_cache = KeyVaultCacheSettings.put_token_cache
+
+    def save(self, token_cache):
+        saved.append(token_cache)
+        put_token_cache(self, token_cache)
+
+    monkeypatch.setattr(KeyVaultCacheSettings, "put_token_cache", save)
+
+    token_cache = settings.cache.get_token_cache()
+    msal_app = get_msal_app(settings.app, token_cache, cache_settings=settings.cache)
+    tokens = TokenManager(
+        settings.app, settings.cache, token_cache, msal_app, timedelta(seconds=1.5)
+    )
+
+    with tokens:
+        authorization = tokens.get_authorization("adele@example.com")
+        saves = len(saved)
+
+        deadline = time.monotonic() + 5
+        while tokens.get_authorization("adele@example.com") == authorization:
+            assert time.monotonic() < deadline, "Token was not refreshed."
+            time.sleep(0.05)
+
+    # The refreshed token is valid, and the changed token cache was stored once.
+    services.reset_counters()
+    graph = GraphClient(settings.graph, settings.app.base_url)
+    graph.set_authorization(lambda: tokens.get_authorization("adele@example.com"))
+    assert graph.get("/me/mailboxSettings").status_code == 200
+    assert not [url for url in services.urls if url.startswith(LOGIN_URL)]
+    assert len(saved) == saves + 1
+
+    tokens.save()
+    assert len(saved) == saves + 1
+
+
+def test_only_discovery_responses_are_cached(tmp_path, create_settings):
+    class Session:
+        def __init__(self):
+            self.urls = []
+
+        def get(self, url, params=None, **kwargs):
+            self.urls.append(url)
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b"{}"
+            return response
+
+    settings = create_settings()
+    session = Session()
+    client = _AuthorityCachingHttpClient(session, settings.cache, timedelta(days=1))
+
+    discovery_url = f"{LOGIN_URL}/common/discovery/instance"
+    other_url = f"{LOGIN_URL}/common/userrealm/adele@example.com"
+    for _ in range(2):
+        client.get(discovery_url, params={"api-version": "1.1"})
+        client.get(other_url)
+
+    assert session.urls == [discovery_url, other_url, other_url]
+    assert list(settings.cache.get_authority_cache().responses) == [
+        f"{discovery_url}?api-version=1.1"
+    ]
+
+
+def test_own_session_is_closed_with_msal_app(monkeypatch, services, create_settings):
+    closed = []
+    monkeypatch.setattr(requests.Session, "close", lambda self: closed.append(self))
+
+    settings = create_settings()
+    msal_app = get_msal_app(
+        settings.app, msal.SerializableTokenCache(), cache_settings=settings.cache
+    )
+    assert not closed
+
+    del msal_app
+    gc.collect()
+    assert len(closed) == 1
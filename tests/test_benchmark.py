@@ -0,0 +1,294 @@
+"""
+Benchmarks of the init, run, plan and simulate commands against in-process mocks of the identity platform, Microsoft
+Graph and Azure Key Vault.
+
+Each scenario reports wall time, HTTP round trips, transferred bytes and peak memory, and fails if a metric regresses
+beyond the tolerance and slack over the baseline in benchmark_baseline.json. Round trips and bytes are deterministic,
+so they are checked on every test run. Wall time and peak memory depend on the machine, so they are measured once and
+only reported by default. With BENCHMARK_TIMING=1, as in the benchmark job of the CI workflow, they are measured as the
+best of several executions after a warm-up, and checked as well. Run with BENCHMARK_UPDATE_BASELINE=1 to store all
+measured values as the new baseline.
+"""
+
+import json
+import os
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.cassette import Cassette, recording, replaying
+from outlook_autoreply_helper.settings import SimulateSettings, get_azure_credential
+
+from .mock_services import (
+    CLIENT_ID,
+    TEMPLATE,
+    TENANT_ID,
+    MockServices,
+    create_settings,
+    sign_in,
+)
+
+BASELINE_FILE = Path(__file__).parent / "benchmark_baseline.json"
+
+# Measured results of all scenarios, reported at the end of the test session.
+RESULTS: dict[str, dict[str, float]] = {}
+
+
+def init(services: MockServices, path: Path) -> Callable:
+    services.add_mailbox("adele@example.com")
+    services.logins.append("adele@example.com")
+    settings = create_settings(path)
+    return lambda: command.init(settings)
+
+
+def run_no_events(services: MockServices, path: Path) -> Callable:
+    services.add_mailbox("adele@example.com")
+    settings = create_settings(path)
+    sign_in(services, settings, "adele@example.com")
+    return lambda: command.run(settings)
+
+
+def run_single_absence(services: MockServices, path: Path) -> Callable:
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    settings = create_settings(path)
+    sign_in(services, settings, "adele@example.com")
+    return lambda: command.run(settings)
+
+
+def run_unchanged(services: MockServices, path: Path) -> Callable:
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    settings = create_settings(path)
+    sign_in(services, settings, "adele@example.com")
+    command.run(settings)
+    return lambda: command.run(settings)
+
+
+def run_long_chain(services: MockServices, path: Path) -> Callable:
+    mailbox = services.add_mailbox("adele@example.com")
+    for day in range(1, 201):
+        mailbox.add_absence(date.today() + timedelta(days=day))
+    settings = create_settings(path)
+    sign_in(services, settings, "adele@example.com")
+    return lambda: command.run(settings)
+
+
+def run_large_templates(services: MockServices, path: Path) -> Callable:
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    settings = create_settings(path)
+    large_template = TEMPLATE + "<p>" + "Lorem ipsum dolor sit amet. " * 10000 + "</p>"
+    settings.absence.internal_reply_template.content = large_template
+    settings.absence.external_reply_template.content = large_template
+    sign_in(services, settings, "adele@example.com")
+    return lambda: command.run(settings)
+
+
+def run_many_mailboxes(services: MockServices, path: Path) -> Callable:
+    usernames = [f"user{i:03}@example.com" for i in range(50)]
+    for i, username in enumerate(usernames):
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1 + i % 3), days=5)
+    settings = create_settings(path, fleet={"mailboxes": usernames})
+    sign_in(services, settings, *usernames)
+    return lambda: command.run_fleet(settings)
+
+
+def run_many_mailboxes_async(services: MockServices, path: Path) -> Callable:
+    pytest.importorskip("httpx")
+    usernames = [f"user{i:03}@example.com" for i in range(50)]
+    for i, username in enumerate(usernames):
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1 + i % 3), days=5)
+    settings = create_settings(
+        path, fleet={"mailboxes": usernames, "engine": "asyncio"}
+    )
+    sign_in(services, settings, *usernames)
+    return lambda: command.run_fleet(settings)
+
+
+def run_many_mailboxes_sharded(services: MockServices, path: Path) -> Callable:
+    usernames = [f"user{i:03}@example.com" for i in range(50)]
+    for i, username in enumerate(usernames):
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1 + i % 3), days=5)
+    settings = create_settings(path, cache="sharded", fleet={"mailboxes": usernames})
+    sign_in(services, settings, *usernames)
+    return lambda: command.run_fleet(settings)
+
+
+def plan_many_mailboxes(services: MockServices, path: Path) -> Callable:
+    usernames = [f"user{i:03}@example.com" for i in range(50)]
+    for i, username in enumerate(usernames):
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1 + i % 3), days=5)
+    settings = create_settings(path, fleet={"mailboxes": usernames})
+    sign_in(services, settings, *usernames)
+    return lambda: command.plan(settings)
+
+
+def simulate_many_mailboxes(services: MockServices, path: Path) -> Callable:
+    usernames = [f"user{i:03}@example.com" for i in range(50)]
+    for i, username in enumerate(usernames):
+        mailbox = services.add_mailbox(username)
+        for week in range(i % 4, 52, 4):
+            mailbox.add_absence(date.today() + timedelta(weeks=week), days=1 + i % 5)
+    settings = create_settings(
+        path, settings_cls=SimulateSettings, fleet={"mailboxes": usernames}
+    )
+    sign_in(services, settings, *usernames)
+    return lambda: command.simulate(settings)
+
+
+def replay_keyvault(services: MockServices, path: Path) -> Callable:
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    settings = create_settings(path, cache="keyvault")
+    with recording(path / "cassette.json.gz"):
+        sign_in(services, settings, "adele@example.com")
+        command.run(create_settings(path, cache="keyvault"))
+
+    # Replay the recorded run against an empty vault, without the mocks sending any responses.
+    services.secrets.clear()
+    get_azure_credential.cache_clear()
+    cassette = Cassette.load(path / "cassette.json.gz")
+    with replaying(cassette):
+        command.init(create_settings(path, cache="keyvault"))
+
+    def execute():
+        with replaying(cassette):
+            command.run(create_settings(path, cache="keyvault"))
+
+    return execute
+
+
+def run_keyvault(services: MockServices, path: Path) -> Callable:
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    settings = create_settings(path, cache="keyvault")
+    sign_in(services, settings, "adele@example.com")
+    # Start with a fresh settings object, as a new process would.
+    settings = create_settings(path, cache="keyvault")
+    return lambda: command.run(settings)
+
+
+SCENARIOS = [
+    init,
+    run_no_events,
+    run_single_absence,
+    run_unchanged,
+    run_long_chain,
+    run_large_templates,
+    run_many_mailboxes,
+    run_many_mailboxes_async,
+    run_many_mailboxes_sharded,
+    plan_many_mailboxes,
+    simulate_many_mailboxes,
+    run_keyvault,
+    replay_keyvault,
+]
+
+
+def _measure(
+    scenario: Callable, path: Path, monkeypatch, trace_memory: bool
+) -> dict[str, float]:
+    """
+    Set up a scenario against fresh mocks and measure a single execution of it.
+    """
+    path.mkdir()
+    monkeypatch.chdir(path)
+
+    # Key Vault access authenticates as an application via environment variables.
+    monkeypatch.setenv("AZURE_TENANT_ID", TENANT_ID)
+    monkeypatch.setenv("AZURE_CLIENT_ID", CLIENT_ID)
+    monkeypatch.setenv("AZURE_CLIENT_SECRET", "benchmark")
+    get_azure_credential.cache_clear()
+
+    services = MockServices()
+    services.install(monkeypatch)
+
+    execute = scenario(services, path)
+    services.reset_counters()
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        execute()
+        wall_time = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return {
+        "wall_time": wall_time,
+        "round_trips": services.round_trips,
+        "bytes": services.bytes_transferred,
+        "peak_memory": peak_memory,
+    }
+
+
+# Metrics that do not depend on the machine running the benchmarks.
+DETERMINISTIC_METRICS = ("round_trips", "bytes")
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=lambda scenario: scenario.__name__)
+def test_benchmark(scenario, tmp_path, monkeypatch):
+    update_baseline = bool(os.environ.get("BENCHMARK_UPDATE_BASELINE"))
+    timing = update_baseline or bool(os.environ.get("BENCHMARK_TIMING"))
+
+    if timing:
+        # Warm up once, then measure the best of several executions.
+        _measure(scenario, tmp_path / "warmup", monkeypatch, trace_memory=False)
+        timings = [
+            _measure(scenario, tmp_path / f"run{i}", monkeypatch, trace_memory=False)
+            for i in range(3)
+        ]
+        result = min(timings, key=lambda timing: timing["wall_time"])
+        metrics = [*DETERMINISTIC_METRICS, "wall_time", "peak_memory"]
+    else:
+        result = _measure(scenario, tmp_path / "run", monkeypatch, trace_memory=False)
+        metrics = list(DETERMINISTIC_METRICS)
+
+    # Memory is traced separately, since tracing slows down execution.
+    memory = _measure(scenario, tmp_path / "memory", monkeypatch, trace_memory=True)
+    result["peak_memory"] = memory["peak_memory"]
+
+    RESULTS[scenario.__name__] = result
+
+    baseline = json.loads(BASELINE_FILE.read_text())
+
+    if update_baseline:
+        baseline["scenarios"][scenario.__name__] = {
+            "wall_time": round(result["wall_time"], 4),
+            "round_trips": result["round_trips"],
+            "bytes": result["bytes"],
+            "peak_memory": result["peak_memory"],
+        }
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=2) + "\n")
+        return
+
+    # Each metric may exceed its baseline by a relative tolerance plus an absolute slack, which keeps very small
+    # values from failing due to noise.
+    expected = baseline["scenarios"][scenario.__name__]
+    limits = {
+        metric: expected[metric] * (1 + baseline["tolerance"][metric])
+        + baseline["slack"][metric]
+        for metric in metrics
+    }
+    regressions = [
+        f"{metric}: {result[metric]} > {limit} (baseline {expected[metric]})"
+        for metric, limit in limits.items()
+        if result[metric] > limit
+    ]
+
+    assert not regressions, f"Regression in {scenario.__name__}: " + ", ".join(
+        regressions
+    )
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+from outlook_autoreply_helper.settings import (
+    MAX_SECRET_SIZE,
+    DeltaCache,
+    DeltaState,
+    KeyVaultCacheSettings,
+    _split_content,
+)
+
+from .mock_services import VAULT_URL
+
+
+def test_split_content_keeps_characters_whole():
+    content = "Abwesenheit 🏖 " * 100
+
+    parts = _split_content(content, 9)
+
+    assert "".join(parts) == content
+    assert all(0 < len(part.encode("utf-8")) <= 9 for part in parts)
+
+
+def test_large_bundle_is_split_into_parts(services, key_vault):
+    def create_cache() -> KeyVaultCacheSettings:
+        return KeyVaultCacheSettings(
+            key_vault_url=VAULT_URL, bundle_secret_name="state"
+        )
+
+    now = datetime.now(timezone.utc)
+    delta_cache = DeltaCache(
+        mailboxes={
+            f"user{i:03}@example.com": DeltaState(
+                delta_link=f"https://graph.microsoft.com/v1.0/me/calendar/calendarView/delta?$deltatoken={i:0500}",
+                keyword="Abwesenheit 🏖",
+                window_start=now,
+                window_end=now + timedelta(days=30),
+            )
+            for i in range(100)
+        }
+    )
+
+    create_cache().put_delta_cache(delta_cache)
+
+    # No secret exceeds the size limit of the key vault.
+    assert "state-part-1" in services.secrets
+    assert all(
+        len(value.encode("utf-8")) <= MAX_SECRET_SIZE
+        for value in services.secrets.values()
+    )
+
+    cache = create_cache()
+    assert cache.get_delta_cache() == delta_cache
+
+    # Unchanged state is not written again, and smaller state fits into the bundle secret again.
+    secrets = dict(services.secrets)
+    cache.put_delta_cache(delta_cache)
+    assert services.secrets == secrets
+
+    small_cache = DeltaCache(mailboxes=dict(list(delta_cache.mailboxes.items())[:1]))
+    cache.put_delta_cache(small_cache)
+    assert len(services.secrets["state"]) <= MAX_SECRET_SIZE
+    assert create_cache().get_delta_cache() == small_cache
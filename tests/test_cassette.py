@@ -0,0 +1,139 @@
+import base64
+import json
+from datetime import date, timedelta
+
+import requests
+
+from outlook_autoreply_helper import command, settings as settings_module
+from outlook_autoreply_helper.cassette import (
+    REDACTED_PREFIX,
+    Cassette,
+    _redact_secret,
+    recording,
+    replaying,
+)
+
+from .mock_services import CLIENT_ID, LOGIN_URL, TENANT_ID
+
+
+def test_cassette_redacts_secrets(tmp_path, services, create_settings, sign_in):
+    services.add_mailbox("adele@example.com")
+    settings = create_settings()
+
+    with recording(tmp_path / "cassette.json") as cassette:
+        sign_in(settings, "adele@example.com")
+
+    content = (tmp_path / "cassette.json").read_text()
+    tokens = json.loads((tmp_path / "token_cache.bin").read_text())
+
+    secrets = [
+        entry["secret"]
+        for kind in ("AccessToken", "RefreshToken")
+        for entry in tokens[kind].values()
+    ]
+    assert secrets
+    assert not any(secret in content for secret in secrets)
+    assert Cassette.load(tmp_path / "cassette.json").interactions == (
+        cassette.interactions
+    )
+
+
+def test_cassette_redacts_secrets_in_split_bundles(
+    tmp_path, monkeypatch, services, key_vault, create_settings, sign_in
+):
+    # Split the bundled state into many small parts, with tokens across their boundaries.
+    monkeypatch.setattr(settings_module, "MAX_SECRET_SIZE", 500)
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+
+    with recording(tmp_path / "cassette.json"):
+        sign_in(create_settings(cache="bundle"), "adele@example.com")
+        recorded = command.run(create_settings(cache="bundle"))
+
+    assert "state-part-1" in services.secrets
+    content = (tmp_path / "cassette.json").read_text()
+    tokens = json.loads(
+        create_settings(cache="bundle").cache.get_token_cache().serialize()
+    )
+    secrets = [
+        entry["secret"]
+        for kind in ("AccessToken", "RefreshToken")
+        for entry in tokens[kind].values()
+    ]
+    assert secrets
+    # Neither tokens nor their halves at the boundaries of parts survive.
+    assert not any(
+        half in content
+        for secret in secrets
+        for half in (secret[: len(secret) // 2], secret[len(secret) // 2 :])
+    )
+
+    # Replaying reassembles the redacted bundle.
+    services.reset_counters()
+    with replaying(tmp_path / "cassette.json"):
+        command.init(create_settings(cache="bundle"))
+        replayed = command.run(create_settings(cache="bundle"))
+
+    assert services.round_trips == 0
+    assert replayed == recorded
+
+
+def test_cassette_redacts_claims_of_id_tokens(
+    tmp_path, services, create_settings, sign_in
+):
+    mailbox = services.add_mailbox("adele@example.com")
+
+    with recording(tmp_path / "cassette.json") as cassette:
+        sign_in(create_settings(), "adele@example.com")
+
+    (id_token,) = [
+        interaction["response"]["body"]["json"]["id_token"]
+        for interaction in cassette.interactions
+        if "id_token" in interaction["response"]["body"].get("json", {})
+    ]
+    payload = id_token.split(".")[1]
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+    # Claims that identify the user are redacted, those MSAL needs to read the token are kept.
+    for name in ("oid", "sub", "name", "preferred_username"):
+        assert claims[name].startswith(REDACTED_PREFIX)
+    assert mailbox.oid not in json.dumps(claims)
+    assert (claims["aud"], claims["tid"]) == (CLIENT_ID, TENANT_ID)
+    assert _redact_secret(id_token) == id_token
+
+
+def test_cassette_replays_run(
+    tmp_path, monkeypatch, services, create_settings, sign_in
+):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+
+    with recording(tmp_path / "cassette.json.gz"):
+        sign_in(create_settings(), "adele@example.com")
+        recorded = command.run(create_settings())
+
+    # Replay with a fresh token cache, without the mocks receiving any requests.
+    replay_path = tmp_path / "replay"
+    replay_path.mkdir()
+    monkeypatch.chdir(replay_path)
+    services.reset_counters()
+
+    cassette = Cassette.load(tmp_path / "cassette.json.gz")
+    with replaying(cassette):
+        command.init(create_settings(replay_path))
+        replayed = command.run(create_settings(replay_path))
+
+    assert services.round_trips == 0
+    assert replayed == recorded
+
+
+def test_cassette_rejects_unrecorded_requests(monkeypatch):
+    with replaying(Cassette()):
+        try:
+            requests.get(
+                f"{LOGIN_URL}/{TENANT_ID}/v2.0/.well-known/openid-configuration"
+            )
+        except RuntimeError as e:
+            assert "No recorded response" in str(e)
+        else:
+            raise AssertionError("Request was not rejected.")
@@ -0,0 +1,112 @@
+from datetime import date, timedelta
+
+import pytest
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.settings import LocalCacheSettings
+
+from .mock_services import GRAPH_URL
+
+
+def test_delta_sync_queries_default_calendar(services, create_settings, sign_in):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    services.reset_counters()
+    first = command.run(create_settings(delta_sync=True))
+    second = command.run(create_settings(delta_sync=True))
+
+    assert first.status == "updated"
+    assert second.status == "unchanged"
+
+    delta_urls = [url for url in services.urls if "/delta" in url]
+    assert len(delta_urls) == 2
+    assert all(
+        url.startswith(f"{GRAPH_URL}/me/calendar/calendarView/delta")
+        for url in delta_urls
+    )
+
+
+def test_delta_sync_repairs_replies_changed_outside(services, create_settings, sign_in):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    assert command.run(create_settings(delta_sync=True)).status == "updated"
+    assert command.run(create_settings(delta_sync=True)).status == "unchanged"
+
+    # Unchanged runs end after querying the calendar changes and the mailbox settings.
+    services.reset_counters()
+    assert command.run(create_settings(delta_sync=True)).status == "unchanged"
+    assert services.round_trips == 2
+
+    mailbox.automatic_replies["status"] = "disabled"
+
+    assert command.run(create_settings(delta_sync=True)).status == "updated"
+    assert mailbox.automatic_replies["status"] == "scheduled"
+
+
+@pytest.mark.parametrize("engine", ["threads", "asyncio"])
+def test_delta_sync_applies_changed_templates(
+    services, create_settings, sign_in, engine
+):
+    if engine == "asyncio":
+        pytest.importorskip("httpx")
+
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    fleet = {"mailboxes": ["adele@example.com"], "engine": engine}
+    sign_in(create_settings(fleet=fleet), "adele@example.com")
+
+    def run(template: str | None = None):
+        settings = create_settings(delta_sync=True, fleet=fleet)
+        if template is not None:
+            settings.absence.internal_reply_template.content = template
+        return command.run_fleet(settings)[0].status
+
+    assert run() == "updated"
+    assert run() == "unchanged"
+
+    # The calendar did not change, but the replies are rendered from the new template.
+    assert run("<p>Back on {{ end | date }}.</p>") == "updated"
+    assert mailbox.automatic_replies["internalReplyMessage"].startswith("<p>Back on")
+    assert run("<p>Back on {{ end | date }}.</p>") == "unchanged"
+
+
+@pytest.mark.parametrize("engine", ["threads", "asyncio"])
+def test_delta_sync_stores_states_once_per_fleet_run(
+    monkeypatch, services, create_settings, sign_in, engine
+):
+    if engine == "asyncio":
+        pytest.importorskip("httpx")
+
+    usernames = ["adele@example.com", "bob@example.com", "carol@example.com"]
+    for username in usernames:
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(fleet={"mailboxes": usernames}), *usernames)
+
+    stored = []
+    put_delta_cache = LocalCacheSettings.put_delta_cache
+
+    def put(self, delta_cache):
+        stored.append(sorted(delta_cache.mailboxes))
+        put_delta_cache(self, delta_cache)
+
+    monkeypatch.setattr(LocalCacheSettings, "put_delta_cache", put)
+
+    def run_fleet():
+        return command.run_fleet(
+            create_settings(
+                delta_sync=True, fleet={"mailboxes": usernames, "engine": engine}
+            )
+        )
+
+    # The states of all mailboxes are stored together, and only if they changed.
+    assert {result.status for result in run_fleet()} == {"updated"}
+    assert {result.status for result in run_fleet()} == {"unchanged"}
+    assert stored == [usernames, usernames]
+
+    assert {result.status for result in run_fleet()} == {"unchanged"}
+    assert len(stored) == 2
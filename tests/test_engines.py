@@ -0,0 +1,111 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from outlook_autoreply_helper import command
+
+from .mock_services import MockServices, create_settings, sign_in
+
+USERNAMES = [
+    "adele@example.com",
+    "bob@example.com",
+    "carol@example.com",
+    "dave@example.com",
+]
+
+
+def _add_mailboxes(services: MockServices) -> None:
+    """Add mailboxes with an upcoming absence, none, adjacent absences and an absence beyond the future period."""
+    today = date.today()
+    services.add_mailbox("adele@example.com").add_absence(
+        today + timedelta(days=1), days=7
+    )
+    services.add_mailbox("bob@example.com")
+    carol = services.add_mailbox("carol@example.com")
+    carol.add_absence(today + timedelta(days=2), days=3)
+    carol.add_absence(today + timedelta(days=5), days=2)
+    services.add_mailbox("dave@example.com").add_absence(
+        today + timedelta(days=60), days=5
+    )
+
+
+def _run_fleet(monkeypatch, tmp_path, engine: str, **kwargs) -> list:
+    """
+    Run the fleet twice on fresh mock services with the given engine, and return the results, round trips and
+    automatic replies of each run.
+    """
+    services = MockServices()
+    services.install(monkeypatch)
+    _add_mailboxes(services)
+
+    path = tmp_path / engine
+    path.mkdir()
+    settings = create_settings(
+        path, fleet={"mailboxes": USERNAMES, "engine": engine}, **kwargs
+    )
+    sign_in(services, settings, *USERNAMES)
+
+    runs = []
+    for _ in range(2):
+        services.reset_counters()
+        results = command.run_fleet(settings)
+        runs.append(
+            (
+                # httpx serializes request bodies more compactly than requests, so their sizes differ.
+                [result.model_dump(exclude={"bytes_sent"}) for result in results],
+                services.round_trips,
+                {
+                    username: dict(mailbox.automatic_replies)
+                    for username, mailbox in services.mailboxes.items()
+                },
+            )
+        )
+
+    return runs
+
+
+@pytest.mark.parametrize("delta_sync", [False, True])
+def test_engines_make_same_changes_with_same_round_trips(
+    monkeypatch, tmp_path, delta_sync
+):
+    pytest.importorskip("httpx")
+    monkeypatch.chdir(tmp_path)
+
+    threads = _run_fleet(monkeypatch, tmp_path, "threads", delta_sync=delta_sync)
+    asyncio_ = _run_fleet(monkeypatch, tmp_path, "asyncio", delta_sync=delta_sync)
+
+    assert [result["status"] for result in threads[0][0]] == [
+        "updated",
+        "no_absence",
+        "updated",
+        "no_absence",
+    ]
+    assert asyncio_ == threads
+
+
+def test_run_async_matches_run(services, create_settings, sign_in):
+    pytest.importorskip("httpx")
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    initial_replies = dict(mailbox.automatic_replies)
+
+    services.reset_counters()
+    result = command.run(create_settings())
+    round_trips = services.round_trips
+    automatic_replies = dict(mailbox.automatic_replies)
+
+    # Start over from the same automatic replies.
+    mailbox.automatic_replies = initial_replies
+
+    services.reset_counters()
+    result_async = asyncio.run(command.run_async(create_settings()))
+
+    assert result.status == "updated"
+    assert result_async.model_dump(exclude={"bytes_sent"}) == result.model_dump(
+        exclude={"bytes_sent"}
+    )
+    assert services.round_trips == round_trips
+    assert mailbox.automatic_replies == automatic_replies
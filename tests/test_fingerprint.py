@@ -0,0 +1,108 @@
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.templates import TemplateRegistry
+
+
+@pytest.fixture
+def evaluations(monkeypatch) -> dict[str, int]:
+    """Count the plans evaluated and the templates rendered."""
+    counts = {"plans": 0, "renders": 0}
+    plan_mailbox = command.plan_mailbox
+    render = TemplateRegistry.render
+
+    def counting_plan_mailbox(*args, **kwargs):
+        counts["plans"] += 1
+        return plan_mailbox(*args, **kwargs)
+
+    def counting_render(self, *args, **kwargs):
+        counts["renders"] += 1
+        return render(self, *args, **kwargs)
+
+    monkeypatch.setattr(command, "plan_mailbox", counting_plan_mailbox)
+    monkeypatch.setattr(TemplateRegistry, "render", counting_render)
+    return counts
+
+
+def test_skip_unchanged_stores_fingerprints_only_for_absences(
+    tmp_path, services, create_settings, sign_in
+):
+    services.add_mailbox("bob@example.com")
+    sign_in(create_settings(), "bob@example.com")
+
+    assert command.run(create_settings(skip_unchanged=True)).status == "no_absence"
+    assert not (tmp_path / "fingerprint_cache.json").exists()
+
+    services.mailboxes["bob@example.com"].add_absence(
+        date.today() + timedelta(days=1), days=7
+    )
+
+    assert command.run(create_settings(skip_unchanged=True)).status == "updated"
+    assert command.run(create_settings(skip_unchanged=True)).status == "unchanged"
+    assert (tmp_path / "fingerprint_cache.json").exists()
+
+
+def test_skip_unchanged_skips_evaluation_of_unchanged_inputs(
+    services, create_settings, sign_in, evaluations
+):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    # After an update, the next run evaluates the replies in full once more.
+    assert command.run(create_settings(skip_unchanged=True)).status == "updated"
+    assert command.run(create_settings(skip_unchanged=True)).status == "unchanged"
+    assert evaluations == {"plans": 2, "renders": 4}
+
+    services.reset_counters()
+    result = command.run(create_settings(skip_unchanged=True))
+
+    assert result.status == "unchanged"
+    assert result.end is not None
+    assert evaluations == {"plans": 2, "renders": 4}
+    # All reads are needed to compute the inputs, so skipping saves no round trips.
+    assert services.round_trips == 2
+
+
+def test_skip_unchanged_detects_replies_changed_outside(
+    services, create_settings, sign_in, evaluations
+):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    command.run(create_settings(skip_unchanged=True))
+    assert command.run(create_settings(skip_unchanged=True)).status == "unchanged"
+
+    mailbox.automatic_replies["status"] = "disabled"
+
+    assert command.run(create_settings(skip_unchanged=True)).status == "updated"
+    assert mailbox.automatic_replies["status"] == "scheduled"
+    assert evaluations["plans"] == 3
+
+
+@pytest.mark.parametrize("change", ["template", "change_key"])
+def test_skip_unchanged_evaluates_changed_inputs(
+    services, create_settings, sign_in, evaluations, change
+):
+    mailbox = services.add_mailbox("adele@example.com")
+    event = mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    command.run(create_settings(skip_unchanged=True))
+    assert command.run(create_settings(skip_unchanged=True)).status == "unchanged"
+
+    settings = create_settings(skip_unchanged=True)
+    if change == "template":
+        settings.absence.internal_reply_template.content = "<p>Back soon.</p>"
+        expected = "updated"
+    else:
+        # E.g. the event body was edited, which leaves the replies as they are.
+        event["changeKey"] = str(uuid.uuid4())
+        expected = "unchanged"
+
+    assert command.run(settings).status == expected
+    assert evaluations["plans"] == 3
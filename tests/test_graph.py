@@ -0,0 +1,278 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+import requests
+
+from outlook_autoreply_helper.graph import (
+    AsyncGraphClient,
+    GraphClient,
+    RateLimiter,
+    RunDeadline,
+    get_retry_after,
+)
+from outlook_autoreply_helper.settings import GraphSettings
+from outlook_autoreply_helper.util import get_adjacent_events, get_adjacent_events_async
+
+from .mock_services import GRAPH_URL, create_settings
+
+
+def _create_response(status_code: int, retry_after: str | None = None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+@pytest.mark.parametrize(
+    "retry_after, expected",
+    [("5", 5.0), ("0.5", 0.5), ("-3", 0.0), ("soon", None), (None, None)],
+)
+def test_get_retry_after_parses_seconds(retry_after, expected):
+    assert get_retry_after(_create_response(429, retry_after)) == expected
+
+
+def test_get_retry_after_parses_http_dates():
+    future = datetime.now(timezone.utc) + timedelta(seconds=120)
+    past = datetime.now(timezone.utc) - timedelta(seconds=120)
+
+    assert 115 < get_retry_after(_create_response(429, format_datetime(future))) <= 120
+    assert get_retry_after(_create_response(429, format_datetime(past))) == 0.0
+
+
+def test_rate_limiter_allows_bursts_of_one_second():
+    limiter = RateLimiter(10)
+
+    assert [limiter.reserve() for _ in range(10)] == [0.0] * 10
+    # Further tokens are handed out in turn at the configured rate.
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+    assert limiter.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_rate_limiter_pauses():
+    limiter = RateLimiter(10)
+    limiter.pause(5)
+
+    assert limiter.reserve() == pytest.approx(5, abs=0.01)
+
+    # A shorter pause does not end a longer one early.
+    limiter.pause(1)
+    assert limiter.reserve() == pytest.approx(5, abs=0.01)
+
+
+def test_run_deadline_bounds_retries_of_all_clients():
+    settings = GraphSettings()
+    run_deadline = RunDeadline(settings.run_deadline_seconds)
+    clients = [
+        GraphClient(settings, GRAPH_URL, run_deadline=run_deadline) for _ in range(2)
+    ]
+    request_deadline = time.monotonic() + settings.deadline_seconds
+    throttled = _create_response(429, "1")
+
+    assert [
+        client.get_retry_delay(0, request_deadline, "HTTP 429", throttled)
+        for client in clients
+    ] == [1.0, 1.0]
+
+    run_deadline.expires = time.monotonic()
+    assert [
+        client.get_retry_delay(0, request_deadline, "HTTP 429", throttled)
+        for client in clients
+    ] == [None, None]
+
+    # The next run may retry again.
+    run_deadline.start()
+    assert clients[0].get_retry_delay(0, request_deadline, "HTTP 429", throttled) == 1.0
+
+
+class _BatchEndpoint:
+    """Answers batch requests in reverse order, failing the sub-requests given by URL with the given status codes."""
+
+    def __init__(self, failures: dict[str, list[int]] | None = None):
+        self.failures = failures or {}
+        self.batches: list[list[dict]] = []
+
+    def __call__(self, method: str, path: str, **kwargs):
+        assert (method, path) == ("POST", "/$batch")
+        items = kwargs["json"]["requests"]
+        self.batches.append(items)
+
+        results = []
+        for item in reversed(items):
+            statuses = self.failures.get(item["url"])
+            status = statuses.pop(0) if statuses else 200
+            results.append(
+                {
+                    "id": item["id"],
+                    "status": status,
+                    "headers": {"Retry-After": "0"} if status == 429 else {},
+                    "body": {"url": item["url"]}
+                    if status == 200
+                    else {"error": {"code": "Failed"}},
+                }
+            )
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"responses": results}).encode()
+        return response
+
+
+def _create_batch_client(monkeypatch, endpoint: _BatchEndpoint) -> GraphClient:
+    client = GraphClient(GraphSettings(), GRAPH_URL)
+    monkeypatch.setattr(client, "request", endpoint)
+    return client
+
+
+def test_batch_splits_requests_and_maps_responses_by_id(monkeypatch):
+    endpoint = _BatchEndpoint()
+    client = _create_batch_client(monkeypatch, endpoint)
+
+    with client.batch() as batch:
+        responses = [batch.get(f"/users/{i}/mailboxSettings") for i in range(45)]
+
+    assert [len(items) for items in endpoint.batches] == [20, 20, 5]
+    # Responses arrive in reverse order, but are matched to their requests.
+    assert [response.json()["url"] for response in responses] == [
+        f"/users/{i}/mailboxSettings" for i in range(45)
+    ]
+
+
+def test_batch_retries_only_throttled_requests(monkeypatch):
+    endpoint = _BatchEndpoint({"/users/1/mailboxSettings": [429, 429]})
+    client = _create_batch_client(monkeypatch, endpoint)
+
+    with client.batch() as batch:
+        responses = [batch.get(f"/users/{i}/mailboxSettings") for i in range(3)]
+
+    assert [[item["url"] for item in items] for items in endpoint.batches] == [
+        [f"/users/{i}/mailboxSettings" for i in range(3)],
+        ["/users/1/mailboxSettings"],
+        ["/users/1/mailboxSettings"],
+    ]
+    assert [response.status_code for response in responses] == [200, 200, 200]
+
+
+def test_batch_returns_failed_requests(monkeypatch):
+    endpoint = _BatchEndpoint({"/users/1/mailboxSettings": [404]})
+    client = _create_batch_client(monkeypatch, endpoint)
+
+    with client.batch() as batch:
+        responses = [batch.get(f"/users/{i}/mailboxSettings") for i in range(3)]
+
+    # Permanent failures are not retried, and only affect their own response.
+    assert len(endpoint.batches) == 1
+    assert [response.status_code for response in responses] == [200, 404, 200]
+    with pytest.raises(requests.HTTPError):
+        responses[1].raise_for_status()
+    assert responses[2].json() == {"url": "/users/2/mailboxSettings"}
+
+
+def _event(event_id: str, start: str, end: str) -> dict:
+    return {
+        "id": event_id,
+        "start": {"dateTime": f"{start}T00:00:00.0000000", "timeZone": "UTC"},
+        "end": {"dateTime": f"{end}T00:00:00.0000000", "timeZone": "UTC"},
+    }
+
+
+class _PagedCollection:
+    """Serves the given pages of a collection, linked via @odata.nextLink, and records the pages requested."""
+
+    def __init__(self, *pages: list[dict]):
+        self.pages = pages
+        self.requested: list[int] = []
+
+    def get_page(self, path: str) -> dict:
+        index = int(path.rsplit("page=", 1)[1]) if "page=" in path else 0
+        self.requested.append(index)
+
+        page = {"value": self.pages[index]}
+        if index + 1 < len(self.pages):
+            page["@odata.nextLink"] = (
+                f"{GRAPH_URL}/me/calendar/calendarView?page={index + 1}"
+            )
+        return page
+
+    def get(self, path: str, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.get_page(path)).encode()
+        return response
+
+    async def get_async(self, path: str, **kwargs):
+        import httpx
+
+        return httpx.Response(
+            200,
+            json=self.get_page(path),
+            request=httpx.Request("GET", f"{GRAPH_URL}{path}"),
+        )
+
+
+def test_iter_collection_fetches_pages_lazily(monkeypatch):
+    collection = _PagedCollection([{"id": "a"}, {"id": "b"}], [{"id": "c"}])
+    client = GraphClient(GraphSettings(), GRAPH_URL)
+    monkeypatch.setattr(client, "get", collection.get)
+
+    items = client.iter_collection("/me/calendar/calendarView")
+    assert collection.requested == []
+
+    # The next page is only requested once all items of the current page have been consumed.
+    assert [next(items)["id"], next(items)["id"]] == ["a", "b"]
+    assert collection.requested == [0]
+    assert next(items)["id"] == "c"
+    assert collection.requested == [0, 1]
+    assert list(items) == []
+
+
+# Pages of absence events, with a gap after the events of the first page.
+ADJACENT_EVENT_PAGES = [
+    [
+        _event("a", "2025-03-10", "2025-03-15"),
+        _event("b", "2025-03-14", "2025-03-16"),
+        _event("c", "2025-03-20", "2025-03-22"),
+    ],
+    [_event("d", "2025-03-21", "2025-03-25")],
+]
+
+
+def test_get_adjacent_events_stops_fetching_after_gap(tmp_path, monkeypatch):
+    collection = _PagedCollection(*ADJACENT_EVENT_PAGES)
+    client = GraphClient(GraphSettings(), GRAPH_URL)
+    monkeypatch.setattr(client, "get", collection.get)
+
+    events = get_adjacent_events(
+        ZoneInfo("UTC"), create_settings(tmp_path), client, ADJACENT_EVENT_PAGES[0][0]
+    )
+
+    assert [event["id"] for event in events] == ["a", "b"]
+    assert collection.requested == [0]
+
+
+def test_get_adjacent_events_async_stops_fetching_after_gap(tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    collection = _PagedCollection(*ADJACENT_EVENT_PAGES)
+
+    async def get_adjacent_events_of_first():
+        client = AsyncGraphClient(GraphSettings(), GRAPH_URL)
+        monkeypatch.setattr(client, "get", collection.get_async)
+        try:
+            return await get_adjacent_events_async(
+                ZoneInfo("UTC"),
+                create_settings(tmp_path),
+                client,
+                ADJACENT_EVENT_PAGES[0][0],
+            )
+        finally:
+            await client.close()
+
+    events = asyncio.run(get_adjacent_events_of_first())
+
+    assert [event["id"] for event in events] == ["a", "b"]
+    assert collection.requested == [0]
@@ -0,0 +1,24 @@
+from outlook_autoreply_helper import instrumentation
+from outlook_autoreply_helper.settings import InstrumentationSettings
+
+
+def test_prometheus_export_describes_last_run(tmp_path):
+    settings = InstrumentationSettings(prometheus_file=tmp_path / "metrics.prom")
+    instrumentation.recorder.reset()
+
+    for _ in range(2):
+        with instrumentation.span("graph.request"):
+            pass
+        instrumentation.increment("mailboxes")
+        instrumentation.export(settings)
+
+    metrics = settings.prometheus_file.read_text()
+
+    # Each export starts from scratch, so the series must not be declared as counters.
+    assert " counter\n" not in metrics
+    assert "_total" not in metrics
+    assert (
+        'outlook_autoreply_helper_last_run_operations{operation="graph.request"} 1\n'
+        in metrics
+    )
+    assert 'outlook_autoreply_helper_last_run_count{counter="mailboxes"} 1\n' in metrics
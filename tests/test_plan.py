@@ -0,0 +1,218 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from outlook_autoreply_helper.plan import (
+    MailboxState,
+    get_changed_properties,
+    plan,
+    plan_many,
+)
+from outlook_autoreply_helper.settings import AbsenceSettings
+from outlook_autoreply_helper.templates import TemplateRegistry
+
+TIMEZONE = ZoneInfo("Europe/Berlin")
+
+NOW = datetime(2025, 3, 2, 9, tzinfo=ZoneInfo("UTC"))
+
+TEMPLATE = "Out of office from {{ start | date }} to {{ end | date }}."
+
+
+@pytest.fixture
+def settings() -> AbsenceSettings:
+    return AbsenceSettings(
+        internal_reply_template={"type": "string", "content": TEMPLATE},
+        external_reply_template={"type": "string", "content": TEMPLATE},
+    )
+
+
+@pytest.fixture
+def templates(settings) -> TemplateRegistry:
+    return TemplateRegistry(settings)
+
+
+def _event(start: str, end: str) -> dict:
+    return {
+        "start": {"dateTime": f"{start}T00:00:00.0000000", "timeZone": "UTC"},
+        "end": {"dateTime": f"{end}T00:00:00.0000000", "timeZone": "UTC"},
+    }
+
+
+def _scheduled(start: str, end: str, message: str = "") -> dict:
+    return {
+        "status": "scheduled",
+        "scheduledStartDateTime": {"dateTime": start, "timeZone": "Europe/Berlin"},
+        "scheduledEndDateTime": {"dateTime": end, "timeZone": "Europe/Berlin"},
+        "internalReplyMessage": message,
+        "externalReplyMessage": message,
+        "externalAudience": "all",
+    }
+
+
+def _state(auto_reply_settings: dict, *events: dict) -> MailboxState:
+    return MailboxState(
+        mailbox="adele@example.com",
+        timezone=TIMEZONE,
+        auto_reply_settings=auto_reply_settings,
+        next_absence=events[0] if events else None,
+        adjacent_events=list(events[1:]),
+    )
+
+
+def test_plan_without_absence(settings, templates):
+    result = plan(settings, _state({"status": "disabled"}), templates, NOW)
+
+    assert result.action == "none"
+    assert result.changes is None
+
+
+def test_plan_schedules_disabled_replies(settings, templates):
+    result = plan(
+        settings,
+        _state({"status": "disabled"}, _event("2025-03-04", "2025-03-08")),
+        templates,
+        NOW,
+    )
+
+    assert result.action == "update"
+    assert result.changes["status"] == "scheduled"
+    assert result.changes["scheduledStartDateTime"]["dateTime"] == "2025-03-04T00:00:00"
+    assert result.changes["internalReplyMessage"] == (
+        "Out of office from 04.03.2025 to 08.03.2025."
+    )
+
+
+def test_plan_includes_adjacent_events(settings, templates):
+    result = plan(
+        settings,
+        _state(
+            {"status": "disabled"},
+            _event("2025-03-04", "2025-03-08"),
+            _event("2025-03-08", "2025-03-11"),
+        ),
+        templates,
+        NOW,
+    )
+
+    assert result.end == datetime(2025, 3, 11, tzinfo=TIMEZONE)
+
+
+def test_plan_leaves_always_enabled_replies(settings, templates):
+    result = plan(
+        settings,
+        _state({"status": "alwaysEnabled"}, _event("2025-03-04", "2025-03-08")),
+        templates,
+        NOW,
+    )
+
+    assert result.action == "none"
+    assert result.changes is None
+
+
+def test_plan_leaves_matching_replies(settings, templates):
+    # Scheduled times as returned by the Microsoft Graph API, with seven fractional digits.
+    result = plan(
+        settings,
+        _state(
+            _scheduled(
+                "2025-03-04T00:00:00.0000000",
+                "2025-03-08T00:00:00.0000000",
+                "Out of office from 04.03.2025 to 08.03.2025.",
+            ),
+            _event("2025-03-04", "2025-03-08"),
+        ),
+        templates,
+        NOW,
+    )
+
+    assert result.action == "none"
+
+
+def test_plan_updates_messages_only(settings, templates):
+    result = plan(
+        settings,
+        _state(
+            _scheduled("2025-03-04T00:00:00", "2025-03-08T00:00:00", "Old message"),
+            _event("2025-03-04", "2025-03-08"),
+        ),
+        templates,
+        NOW,
+    )
+
+    assert result.action == "update"
+    assert set(result.changes) == {"internalReplyMessage", "externalReplyMessage"}
+
+
+@pytest.mark.parametrize(
+    "current",
+    [
+        {"dateTime": "2025-03-04T00:00:00", "timeZone": "Europe/Berlin"},
+        {"dateTime": "2025-03-03T23:00:00.0000000", "timeZone": "UTC"},
+        {"dateTime": "2025-03-03T18:00:00.0000000", "timeZone": "America/New_York"},
+    ],
+)
+def test_get_changed_properties_compares_points_in_time(current):
+    desired = {"dateTime": "2025-03-04T00:00:00", "timeZone": "Europe/Berlin"}
+
+    assert (
+        get_changed_properties(
+            {"scheduledStartDateTime": current}, {"scheduledStartDateTime": desired}
+        )
+        == {}
+    )
+
+
+def test_get_changed_properties_returns_only_differing_properties():
+    current = _scheduled("2025-03-04T00:00:00", "2025-03-08T00:00:00", "Message")
+    current["scheduledEndDateTime"] = {
+        "dateTime": "2025-03-07T23:00:00.0000000",
+        "timeZone": "UTC",
+    }
+    desired = _scheduled("2025-03-04T00:00:00", "2025-03-10T00:00:00", "Message")
+
+    assert get_changed_properties(current, desired) == {
+        "scheduledEndDateTime": desired["scheduledEndDateTime"]
+    }
+
+    # Missing properties count as changed.
+    assert get_changed_properties({}, desired) == desired
+
+
+@pytest.mark.parametrize(
+    "scheduled_end, merged",
+    [("2025-03-03T20:00:00", True), ("2025-03-03T06:00:00", False)],
+)
+def test_plan_merges_close_periods(settings, templates, scheduled_end, merged):
+    result = plan(
+        settings,
+        _state(
+            _scheduled("2025-03-01T00:00:00", scheduled_end),
+            _event("2025-03-04", "2025-03-08"),
+        ),
+        templates,
+        NOW,
+    )
+
+    assert (result.action == "update") is merged
+    if merged:
+        assert result.start == datetime(2025, 3, 1, tzinfo=TIMEZONE)
+
+
+def test_plan_many_keeps_order(settings, templates):
+    states = [
+        _state({"status": "disabled"}, _event("2025-03-04", "2025-03-08")),
+        _state({"status": "alwaysEnabled"}, _event("2025-03-04", "2025-03-08")),
+    ]
+
+    results = plan_many(settings, states, templates, NOW)
+
+    assert [result.action for result in results] == ["update", "none"]
+
+
+def test_plan_is_deterministic(settings, templates):
+    state = _state({"status": "disabled"}, _event("2025-03-04", "2025-03-08"))
+
+    assert plan(settings, state, templates, NOW) == plan(
+        settings, state, templates, NOW
+    )
@@ -0,0 +1,36 @@
+import signal
+from datetime import date, timedelta
+
+import pytest
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.settings import ServeSettings
+
+
+def test_serve_stops_on_signal_and_restores_handlers(
+    monkeypatch, services, create_settings, sign_in
+):
+    mailbox = services.add_mailbox("adele@example.com")
+    mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(create_settings(), "adele@example.com")
+
+    handlers = {
+        signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+    # Ask to stop at the end of the first run.
+    monkeypatch.setattr(
+        command, "export", lambda settings: signal.raise_signal(signal.SIGTERM)
+    )
+
+    command.serve(create_settings(settings_cls=ServeSettings))
+
+    assert mailbox.automatic_replies["status"] == "scheduled"
+    assert {signum: signal.getsignal(signum) for signum in handlers} == handlers
+
+
+def test_serve_rejects_asyncio_engine(services, create_settings):
+    settings = create_settings(settings_cls=ServeSettings, fleet={"engine": "asyncio"})
+
+    with pytest.raises(ValueError, match="asyncio"):
+        command.serve(settings)
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from outlook_autoreply_helper.settings import AbsenceSettings
+from outlook_autoreply_helper.simulate import (
+    SNAPSHOTS_ADAPTER,
+    CalendarSnapshot,
+    SimulatedClock,
+    simulate,
+    simulate_mailbox,
+)
+from outlook_autoreply_helper.templates import TemplateRegistry
+
+START = datetime(2025, 3, 1, tzinfo=ZoneInfo("UTC"))
+
+TEMPLATE = "Out of office from {{ start | date }} to {{ end | date }}."
+
+
+class _EveryTickClock(SimulatedClock):
+    """Clock that never skips ahead, simulating a run at each tick."""
+
+    def advance(self, time: datetime | None = None) -> None:
+        self.now += self.tick
+
+
+@pytest.fixture
+def settings() -> AbsenceSettings:
+    return AbsenceSettings(
+        internal_reply_template={"type": "string", "content": TEMPLATE},
+        external_reply_template={"type": "string", "content": TEMPLATE},
+    )
+
+
+def _event(start: str, end: str) -> dict:
+    return {
+        "id": f"{start}/{end}",
+        "start": {"dateTime": f"{start}T00:00:00.0000000", "timeZone": "UTC"},
+        "end": {"dateTime": f"{end}T00:00:00.0000000", "timeZone": "UTC"},
+    }
+
+
+def _snapshot(*events: dict) -> CalendarSnapshot:
+    return CalendarSnapshot(
+        mailbox="adele@example.com",
+        timezone="Europe/Berlin",
+        auto_reply_settings={"status": "disabled"},
+        events=list(events),
+    )
+
+
+def test_simulate_schedules_each_absence(settings):
+    snapshot = _snapshot(
+        _event("2025-03-10", "2025-03-15"),
+        _event("2025-03-15", "2025-03-17"),
+        _event("2025-04-20", "2025-04-22"),
+    )
+
+    changes = simulate(
+        settings, [snapshot], START, START + timedelta(days=60), timedelta(hours=1)
+    )
+
+    # Adjacent events are scheduled as one absence, each absence once it comes within the future period.
+    assert [(change.time, change.start, change.end) for change in changes] == [
+        (
+            datetime(2025, 3, 7, tzinfo=ZoneInfo("UTC")),
+            datetime(2025, 3, 10, tzinfo=ZoneInfo("Europe/Berlin")),
+            datetime(2025, 3, 17, tzinfo=ZoneInfo("Europe/Berlin")),
+        ),
+        (
+            datetime(2025, 4, 16, 23, tzinfo=ZoneInfo("UTC")),
+            datetime(2025, 4, 20, tzinfo=ZoneInfo("Europe/Berlin")),
+            datetime(2025, 4, 22, tzinfo=ZoneInfo("Europe/Berlin")),
+        ),
+    ]
+    assert all(change.mailbox == "adele@example.com" for change in changes)
+    assert "internalReplyMessage" in changes[0].properties
+
+
+@pytest.mark.parametrize("tick_minutes", [37, 60, 1440])
+def test_simulate_skips_only_unchanged_runs(settings, tick_minutes):
+    snapshot = _snapshot(
+        _event("2025-03-02", "2025-03-05"),
+        _event("2025-03-10", "2025-03-15"),
+        _event("2025-03-25", "2025-04-02"),
+        _event("2025-03-30", "2025-04-05"),
+        _event("2025-10-20", "2025-10-30"),
+    )
+    templates = TemplateRegistry(settings)
+    tick = timedelta(minutes=tick_minutes)
+    end = START + timedelta(days=365)
+
+    assert simulate_mailbox(
+        settings, snapshot, templates, SimulatedClock(START, tick), end
+    ) == simulate_mailbox(
+        settings, snapshot, templates, _EveryTickClock(START, tick), end
+    )
+
+
+def test_simulate_snapshots_round_trip():
+    snapshots = [_snapshot(_event("2025-03-10", "2025-03-15"))]
+
+    assert (
+        SNAPSHOTS_ADAPTER.validate_json(SNAPSHOTS_ADAPTER.dump_json(snapshots))
+        == snapshots
+    )
+
+
+def test_simulate_keeps_replies_scheduled_as_returned_by_graph(settings):
+    message = "Out of office from 10.03.2025 to 15.03.2025."
+    snapshot = _snapshot(_event("2025-03-10", "2025-03-15")).model_copy(
+        update={
+            "auto_reply_settings": {
+                "status": "scheduled",
+                "externalAudience": "all",
+                "scheduledStartDateTime": {
+                    "dateTime": "2025-03-10T00:00:00.0000000",
+                    "timeZone": "Europe/Berlin",
+                },
+                "scheduledEndDateTime": {
+                    "dateTime": "2025-03-15T00:00:00.0000000",
+                    "timeZone": "Europe/Berlin",
+                },
+                "internalReplyMessage": message,
+                "externalReplyMessage": message,
+            }
+        }
+    )
+
+    assert (
+        simulate(
+            settings, [snapshot], START, START + timedelta(days=30), timedelta(hours=1)
+        )
+        == []
+    )
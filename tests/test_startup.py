@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+# Dependencies that must only be imported on the code paths that need them.
+HEAVY_MODULES = ["azure", "msal", "msal_extensions", "jinja2", "requests"]
+
+# Budget for importing the command-line entry point and loading the logging settings, in seconds.
+STARTUP_BUDGET = 1.0
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True
+    )
+
+
+def test_startup_skips_heavy_dependencies():
+    result = _run_python(
+        "-c",
+        "import sys\n"
+        "from outlook_autoreply_helper.__main__ import LoggingSettings\n"
+        "LoggingSettings()\n"
+        "print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))",
+    )
+    imported = set(result.stdout.split())
+
+    assert imported.isdisjoint(HEAVY_MODULES), imported & set(HEAVY_MODULES)
+
+
+def test_startup_within_budget():
+    result = _run_python(
+        "-X", "importtime", "-c", "import outlook_autoreply_helper.__main__"
+    )
+
+    # Each line reads "import time: <self us> | <cumulative us> | <module>".
+    cumulative = {
+        fields[2].strip(): int(fields[1])
+        for fields in (
+            line.removeprefix("import time:").split("|")
+            for line in result.stderr.splitlines()
+            if line.startswith("import time:") and "cumulative" not in line
+        )
+    }
+
+    assert cumulative["outlook_autoreply_helper.__main__"] / 1e6 < STARTUP_BUDGET
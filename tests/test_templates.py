@@ -0,0 +1,88 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from outlook_autoreply_helper.settings import (
+    AbsenceSettings,
+    LocalTemplateSource,
+    StringTemplateSource,
+)
+from outlook_autoreply_helper.templates import TemplateRegistry
+
+END = datetime(2025, 8, 15)
+
+
+def _create_registry(monkeypatch, **kwargs) -> tuple[TemplateRegistry, list[str]]:
+    """Create a template registry that records the name of each template it compiles."""
+    registry = TemplateRegistry(AbsenceSettings(**kwargs))
+    compiled = []
+    compile = registry.env.compile
+
+    def counting_compile(source, name=None, *args, **kwargs):
+        compiled.append(name)
+        return compile(source, name, *args, **kwargs)
+
+    monkeypatch.setattr(registry.env, "compile", counting_compile)
+    return registry, compiled
+
+
+def test_registry_compiles_templates_once(monkeypatch):
+    registry, compiled = _create_registry(monkeypatch)
+    source = StringTemplateSource(content="Back on {{ end | date }}.")
+
+    assert registry.render(source, end=END) == "Back on 15.08.2025."
+    assert registry.render(source, end=END) == "Back on 15.08.2025."
+    # An equal source, e.g. from settings loaded again, shares the compiled template.
+    assert registry.render(source.model_copy(), end=END) == "Back on 15.08.2025."
+    assert len(compiled) == 1
+
+    source.content = "Back in office on {{ end | date }}."
+
+    assert registry.render(source, end=END) == "Back in office on 15.08.2025."
+    assert len(compiled) == 2
+
+
+def test_registry_recompiles_changed_template_files(tmp_path, monkeypatch):
+    registry, compiled = _create_registry(monkeypatch)
+    path = tmp_path / "reply.html"
+    path.write_text("Back on {{ end | date }}.")
+    source = LocalTemplateSource(path=path)
+
+    assert registry.render(source, end=END) == "Back on 15.08.2025."
+    assert registry.render(source, end=END) == "Back on 15.08.2025."
+    assert len(compiled) == 1
+
+    # A change of size is detected, however close in time.
+    path.write_text("Back again on {{ end | date }}.")
+
+    assert registry.render(source, end=END) == "Back again on 15.08.2025."
+    assert len(compiled) == 2
+
+    # A change of the same size is detected by the modification time.
+    mtime_ns = path.stat().st_mtime_ns
+    path.write_text("Back again by {{ end | date }}.")
+    os.utime(path, ns=(mtime_ns + 1_000_000_000, mtime_ns + 1_000_000_000))
+
+    assert registry.render(source, end=END) == "Back again by 15.08.2025."
+    assert len(compiled) == 3
+
+
+@pytest.mark.parametrize("kind", ["string", "local"])
+def test_registry_reuses_bytecode_across_processes(tmp_path, monkeypatch, kind):
+    cache_dir = tmp_path / "template_cache"
+    if kind == "string":
+        source = StringTemplateSource(content="Back on {{ end | date }}.")
+    else:
+        (tmp_path / "reply.html").write_text("Back on {{ end | date }}.")
+        source = LocalTemplateSource(path=tmp_path / "reply.html")
+
+    registry, compiled = _create_registry(monkeypatch, template_cache_dir=cache_dir)
+    assert registry.render(source, end=END) == "Back on 15.08.2025."
+    assert len(compiled) == 1
+    assert list(cache_dir.iterdir())
+
+    # Another registry, as in a new process, loads the compiled template from the cache directory.
+    registry, compiled = _create_registry(monkeypatch, template_cache_dir=cache_dir)
+    assert registry.render(source, end=END) == "Back on 15.08.2025."
+    assert compiled == []
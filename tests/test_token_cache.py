@@ -0,0 +1,146 @@
+import json
+from datetime import date, timedelta
+from pathlib import Path
+
+from outlook_autoreply_helper import command
+from outlook_autoreply_helper.token_cache import (
+    _APP_SHARD,
+    _INDEX,
+    ShardedTokenCache,
+    _get_shard,
+)
+
+USERNAMES = ["adele@example.com", "bob@example.com", "carol@example.com"]
+
+
+def _read_shards(path: Path) -> dict[str, str]:
+    return {shard.name: shard.read_text() for shard in sorted(path.glob("*.json"))}
+
+
+def test_sharded_token_cache_stores_each_account_separately(
+    tmp_path, services, create_settings, sign_in
+):
+    for username in USERNAMES:
+        services.add_mailbox(username)
+    settings = create_settings(cache="sharded", fleet={"mailboxes": USERNAMES})
+    sign_in(settings, *USERNAMES)
+
+    token_cache_dir = tmp_path / "token_cache"
+    shards = _read_shards(token_cache_dir)
+    # One shard per account, one for application metadata, and the index of all accounts.
+    assert len(shards) == len(USERNAMES) + 2
+    assert not list(token_cache_dir.glob("*.tmp"))
+
+    # A new cache sees all accounts.
+    token_cache = settings.cache.get_token_cache()
+    assert isinstance(token_cache, ShardedTokenCache)
+    assert sorted(
+        account["username"] for account in token_cache.search("Account")
+    ) == sorted(USERNAMES)
+
+    # Runs with valid access tokens leave all shards untouched.
+    command.run_fleet(create_settings(cache="sharded", fleet={"mailboxes": USERNAMES}))
+    assert _read_shards(token_cache_dir) == shards
+
+
+def test_sharded_token_cache_writes_only_changed_account(
+    tmp_path, services, create_settings, sign_in
+):
+    for username in USERNAMES:
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    settings = create_settings(cache="sharded", fleet={"mailboxes": USERNAMES})
+    sign_in(settings, *USERNAMES)
+
+    token_cache_dir = tmp_path / "token_cache"
+    shards = _read_shards(token_cache_dir)
+
+    # Drop the access token of a single account, so that the next run refreshes it.
+    token_cache = settings.cache.get_token_cache()
+    (account,) = token_cache.search("Account", query={"username": "bob@example.com"})
+    (access_token,) = token_cache.search(
+        "AccessToken", query={"home_account_id": account["home_account_id"]}
+    )
+    token_cache.remove_at(access_token)
+
+    command.run_fleet(create_settings(cache="sharded", fleet={"mailboxes": USERNAMES}))
+
+    changed = [
+        name
+        for name, content in _read_shards(token_cache_dir).items()
+        if content != shards[name]
+    ]
+    assert changed == [token_cache._get_path(_get_shard(account)).name]
+
+
+def test_sharded_token_cache_reads_only_shard_of_account_looked_up(
+    tmp_path, monkeypatch, services, create_settings, sign_in
+):
+    for username in USERNAMES:
+        mailbox = services.add_mailbox(username)
+        mailbox.add_absence(date.today() + timedelta(days=1), days=7)
+    sign_in(
+        create_settings(cache="sharded", fleet={"mailboxes": USERNAMES}), *USERNAMES
+    )
+
+    read = []
+    _read = ShardedTokenCache._read
+
+    def recording_read(self, path):
+        read.append(path.stem)
+        return _read(self, path)
+
+    monkeypatch.setattr(ShardedTokenCache, "_read", recording_read)
+
+    # Accounts are found by username via the index, without reading their shards.
+    token_cache = create_settings(cache="sharded").cache.get_token_cache()
+    (account,) = token_cache.search("Account", query={"username": "bob@example.com"})
+    assert read == [_INDEX, _APP_SHARD]
+
+    # A process working on a single mailbox only reads the shard of that account.
+    read.clear()
+    results = command.run_fleet(
+        create_settings(cache="sharded", fleet={"mailboxes": ["bob@example.com"]})
+    )
+    assert [result.status for result in results] == ["updated"]
+    assert read == [_INDEX, _APP_SHARD, _get_shard(account)]
+
+
+def test_sharded_token_cache_indexes_accounts_added_elsewhere(
+    tmp_path, services, create_settings, sign_in
+):
+    for username in USERNAMES:
+        services.add_mailbox(username)
+    settings = create_settings(cache="sharded", fleet={"mailboxes": USERNAMES})
+    sign_in(settings, *USERNAMES)
+
+    # E.g. another process added an account while the index was written concurrently.
+    index_path = tmp_path / "token_cache" / f"{_INDEX}.json"
+    index = json.loads(index_path.read_text())
+    del index[next(iter(index))]
+    index_path.write_text(json.dumps(index))
+
+    token_cache = settings.cache.get_token_cache()
+    assert sorted(
+        account["username"] for account in token_cache.search("Account")
+    ) == sorted(USERNAMES)
+    assert len(json.loads(index_path.read_text())) == len(USERNAMES)
+
+
+def test_sharded_token_cache_migrates_token_cache_file(
+    tmp_path, services, create_settings, sign_in
+):
+    services.add_mailbox("adele@example.com")
+    sign_in(create_settings(), "adele@example.com")
+
+    settings = create_settings(cache="sharded")
+    token_cache = settings.cache.get_token_cache()
+
+    assert [account["username"] for account in token_cache.search("Account")] == [
+        "adele@example.com"
+    ]
+    assert len(_read_shards(tmp_path / "token_cache")) == 3
+
+    # Runs use the migrated tokens without signing in again.
+    services.logins.clear()
+    command.run(create_settings(cache="sharded"))
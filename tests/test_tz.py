@@ -0,0 +1,100 @@
+import json
+import sys
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from outlook_autoreply_helper import __main__ as main_module, tz
+from outlook_autoreply_helper.tz import (
+    build_windows_zones,
+    get_iana_timezone,
+    update_windows_zones,
+)
+
+# Excerpt of the CLDR windowsZones.xml file, with mappings for several territories per Windows time zone.
+WINDOWS_ZONES_XML = """<?xml version="1.0" encoding="UTF-8" ?>
+<supplementalData>
+    <version number="$Revision$"/>
+    <windowsZones>
+        <mapTimezones otherVersion="7e11800" typeVersion="2024a">
+            <mapZone other="W. Europe Standard Time" territory="001" type="Europe/Berlin"/>
+            <mapZone other="W. Europe Standard Time" territory="AD" type="Europe/Andorra"/>
+            <mapZone other="W. Europe Standard Time" territory="DE" type="Europe/Berlin Europe/Busingen"/>
+            <mapZone other="Pacific Standard Time" territory="CA" type="America/Vancouver"/>
+            <mapZone other="Pacific Standard Time" territory="001" type="America/Los_Angeles"/>
+            <mapZone other="UTC" territory="001" type="Etc/UTC"/>
+            <mapZone other="UTC" territory="ZZ" type="Etc/UTC Etc/GMT"/>
+        </mapTimezones>
+    </windowsZones>
+</supplementalData>
+"""
+
+
+def test_get_iana_timezone_maps_shipped_index():
+    assert get_iana_timezone("W. Europe Standard Time") == "Europe/Berlin"
+    assert get_iana_timezone("Pacific Standard Time") == "America/Los_Angeles"
+    assert get_iana_timezone("Nowhere Standard Time") is None
+
+    # Each mapped time zone is known to the time zone database.
+    for iana_tz in tz._load_windows_zones().values():
+        ZoneInfo(iana_tz)
+
+
+def test_build_windows_zones_uses_default_territory():
+    index = build_windows_zones(WINDOWS_ZONES_XML)
+
+    assert index == {
+        "version": "2024a",
+        "zones": {
+            "Pacific Standard Time": "America/Los_Angeles",
+            "UTC": "Etc/UTC",
+            "W. Europe Standard Time": "Europe/Berlin",
+        },
+    }
+
+
+def test_build_windows_zones_rejects_files_without_mappings():
+    with pytest.raises(ValueError):
+        build_windows_zones("<supplementalData/>")
+
+
+def test_update_windows_zones_writes_index(tmp_path, monkeypatch):
+    cldr_file = tmp_path / "windowsZones.xml"
+    cldr_file.write_text(WINDOWS_ZONES_XML, encoding="utf-8")
+    output_file = tmp_path / "windows_zones.json"
+
+    update_windows_zones(cldr_file, output_file)
+
+    assert json.loads(output_file.read_text()) == build_windows_zones(WINDOWS_ZONES_XML)
+
+    # The index is loaded from the written file.
+    monkeypatch.setattr(tz, "WINDOWS_ZONES_FILE", output_file)
+    tz._load_windows_zones.cache_clear()
+    try:
+        assert get_iana_timezone("UTC") == "Etc/UTC"
+        assert get_iana_timezone("Tokyo Standard Time") is None
+    finally:
+        tz._load_windows_zones.cache_clear()
+
+
+def test_update_tz_index_command(tmp_path, monkeypatch):
+    cldr_file = tmp_path / "windowsZones.xml"
+    cldr_file.write_text(WINDOWS_ZONES_XML, encoding="utf-8")
+    output_file = tmp_path / "windows_zones.json"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "outlook-autoreply-helper",
+            "update-tz-index",
+            str(cldr_file),
+            "--output",
+            str(output_file),
+        ],
+    )
+
+    main_module.main()
+
+    assert json.loads(output_file.read_text())["zones"]["W. Europe Standard Time"] == (
+        "Europe/Berlin"
+    )
@@ -0,0 +1,76 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from outlook_autoreply_helper.util import get_datetime, merge_adjacent_events
+
+TIMEZONE = ZoneInfo("Europe/Berlin")
+
+
+def _event(event_id: str, start: str, end: str) -> dict:
+    return {
+        "id": event_id,
+        "start": {"dateTime": f"{start}T00:00:00.0000000", "timeZone": "UTC"},
+        "end": {"dateTime": f"{end}T00:00:00.0000000", "timeZone": "UTC"},
+    }
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2025-03-10T08:30:00.1234567", datetime(2025, 3, 10, 8, 30, 0, 123456)),
+        ("2025-03-10T08:30:00.0000000", datetime(2025, 3, 10, 8, 30)),
+        ("2025-03-10T08:30:00.5", datetime(2025, 3, 10, 8, 30, 0, 500000)),
+        ("2025-03-10T08:30:00", datetime(2025, 3, 10, 8, 30)),
+    ],
+)
+def test_get_datetime_parses_fractional_seconds(value, expected):
+    assert get_datetime(
+        {"dateTime": value, "timeZone": "Europe/Berlin"}
+    ) == expected.replace(tzinfo=ZoneInfo("Europe/Berlin"))
+
+
+def test_merge_adjacent_events_merges_overlapping_events():
+    start = _event("a", "2025-03-10", "2025-03-15")
+    events = [
+        start,
+        _event("b", "2025-03-12", "2025-03-20"),
+        _event("c", "2025-03-19", "2025-03-22"),
+    ]
+
+    assert merge_adjacent_events(TIMEZONE, start, events) == events
+
+
+def test_merge_adjacent_events_merges_touching_events():
+    start = _event("a", "2025-03-10", "2025-03-15")
+    touching = _event("b", "2025-03-15", "2025-03-17")
+
+    assert merge_adjacent_events(TIMEZONE, start, [start, touching]) == [
+        start,
+        touching,
+    ]
+
+
+def test_merge_adjacent_events_stops_at_first_gap():
+    start = _event("a", "2025-03-10", "2025-03-15")
+    adjacent = _event("b", "2025-03-14", "2025-03-16")
+    after_gap = [
+        _event("c", "2025-03-17", "2025-03-20"),
+        _event("d", "2025-03-18", "2025-03-25"),
+    ]
+    events = iter([start, adjacent, *after_gap])
+
+    assert merge_adjacent_events(TIMEZONE, start, events) == [start, adjacent]
+    # Events after the gap are not consumed beyond the first one.
+    assert list(events) == after_gap[1:]
+
+
+def test_merge_adjacent_events_skips_duplicate_ids():
+    start = _event("a", "2025-03-10", "2025-03-15")
+    adjacent = _event("b", "2025-03-14", "2025-03-16")
+
+    # Pages of a calendar view may repeat events, e.g. if the calendar changes while paging.
+    assert merge_adjacent_events(
+        TIMEZONE, start, [start, adjacent, adjacent, start]
+    ) == [start, adjacent]